@@ -0,0 +1,9 @@
+'''Shared helpers for the Otto protocols.
+
+Protocols uploaded through the OpenTrons app still have to be single files,
+so everything in here is meant to be imported by scripts run from the repo
+(opentrons_simulate, opentrons_execute or jupyter on the robot) and by the
+planning tools. Import from the submodules, e.g.
+
+    from otto.tips import TipAllocator
+'''
@@ -0,0 +1,207 @@
+'''Dry run the whole protocol tree in a process pool.
+
+    python -m otto.batch
+    python -m otto.batch -g num_samples=1,8,24 -j 8 shawn_scripts/production
+
+Finds every protocol (a .py file with a run() function) under the given
+files and directories, by default the production trees, and runs each one
+through otto.recording with its add_parameters() defaults, plus every
+combination of the -g grids that it declares. The opentrons API and the
+custom labware definitions are loaded once before the workers fork, so a
+run costs an exec of the protocol file and the recording itself.
+
+Prints pass, FAIL (the protocol raised), TIPS (it ran out of tips) or VOL
+(a well went over its max volume, see otto.volumes) per run with its wall
+time; the exit status is 1 unless everything passed.
+'''
+
+import argparse
+import contextlib
+import io
+import itertools
+import multiprocessing
+import os
+import re
+import sys
+import time
+
+from otto.labware import CUSTOM_LABWARE, REPO, custom_definitions
+
+TREES = ('shawn_scripts/production', 'sashi_scripts', 'alex_scripts',
+         'Johannes_ Otto Protocols')
+
+_RUN = re.compile(r'^def run\(', re.MULTILINE)
+
+
+def discover(paths=None):
+    '''Protocol files under paths (files or directories), sorted.'''
+    found = []
+    for path in paths or [os.path.join(REPO, tree) for tree in TREES]:
+        if os.path.isfile(path):
+            found.append(path)
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                if not name.endswith('.py'):
+                    continue
+                name = os.path.join(root, name)
+                with open(name, encoding='utf-8', errors='replace') as f:
+                    if _RUN.search(f.read()):
+                        found.append(name)
+    return found
+
+
+def parse_grid(pairs):
+    '''{'name': ['1', '8', '24'], ...} from name=v1,v2,... pairs.'''
+    grid = {}
+    for pair in pairs or []:
+        name, _, values = pair.partition('=')
+        grid[name.strip()] = [v.strip() for v in values.split(',')]
+    return grid
+
+
+def combinations(declared, grid):
+    '''Parameter sets for one protocol: the defaults and its share of grid.'''
+    names = [name for name in grid if name in declared]
+    sets = [{}]
+    for values in itertools.product(*[grid[name] for name in names]):
+        if values:
+            sets.append(dict(zip(names, values)))
+    return sets
+
+
+def _preload(labware_dir):
+    # pay for these once in the parent, the workers inherit them
+    custom_definitions(labware_dir)
+    with contextlib.redirect_stdout(io.StringIO()):
+        try:
+            import opentrons.protocol_api  # noqa: F401
+        except ImportError:
+            pass
+
+
+def jobs(paths, grid=None, labware_dir=CUSTOM_LABWARE):
+    '''(path, params, labware_dir) for every run of every protocol.'''
+    from otto.recording import declared_parameters, load_protocol
+
+    found = []
+    for path in paths:
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                declared = declared_parameters(load_protocol(path)).declared
+        except Exception:
+            declared = {}
+        for params in combinations(declared, grid or {}):
+            found.append((path, params, labware_dir))
+    return found
+
+
+def simulate(job, timing=None):
+    '''Run one job, returns a picklable result dict.'''
+    from otto.budget import tip_budget
+    from otto.recording import load_protocol, record
+    from otto.volumes import overfilled, well_volumes
+
+    path, params, labware_dir = job
+    started = time.time()
+    result = {'path': path, 'params': params, 'error': None, 'line': None,
+              'short': 0, 'tips': 0, 'overfilled': [], 'commands': 0,
+              'runtime': None}
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            module = load_protocol(path)
+        ctx = record(path, params, labware_dir, module, timing=timing)
+    except Exception as e:
+        result['error'] = repr(e)
+    else:
+        if ctx.error is not None:
+            result['error'] = repr(ctx.error)
+            result['line'] = ctx.error_line
+        result['commands'] = len(ctx.commands)
+        result['tips'] = sum(entry['tips'] for entry in tip_budget(ctx))
+        result['short'] = sum(tips for step, pipette, tips, line
+                              in ctx.shortages)
+        result['overfilled'] = [
+            (str(well), peak, well.max_volume)
+            for well, volume, peak in overfilled(well_volumes(ctx))]
+        if timing is not None:
+            result['runtime'] = ctx.clock
+    result['seconds'] = time.time() - started
+    result['status'] = ('FAIL' if result['error'] else
+                        'TIPS' if result['short'] else
+                        'VOL' if result['overfilled'] else 'pass')
+    return result
+
+
+def _timed(job):
+    from otto.runtime import TimeModel
+    return simulate(job, TimeModel())
+
+
+def run_jobs(found, processes=None, runtime=False):
+    '''Results of every job, in job order.'''
+    if not found:
+        return []
+    _preload(found[0][2])
+    worker = _timed if runtime else simulate
+    if processes == 1:
+        return [worker(job) for job in found]
+    with multiprocessing.get_context('fork').Pool(processes) as pool:
+        return pool.map(worker, found, chunksize=1)
+
+
+def report(results, root=REPO):
+    lines = []
+    for result in results:
+        params = ' '.join('{}={}'.format(*item)
+                          for item in sorted(result['params'].items()))
+        line = '{:<4} {:>6.2f}s  {}{}'.format(
+               result['status'], result['seconds'],
+               os.path.relpath(result['path'], root),
+               ' [{}]'.format(params) if params else '')
+        if result['runtime'] is not None:
+            line += '  ~{:.0f} min'.format(result['runtime'] / 60)
+        lines.append(line)
+        if result['error']:
+            lines.append('       line {}: {}'.format(result['line'],
+                                                     result['error']))
+        elif result['short']:
+            lines.append('       short {} tip(s)'.format(result['short']))
+        elif result['overfilled']:
+            well, peak, max_volume = result['overfilled'][0]
+            lines.append('       {} well(s) overfilled, first {} to {:g} of '
+                         '{:g} µL'.format(len(result['overfilled']), well,
+                                          peak, max_volume))
+    counts = {}
+    for result in results:
+        counts[result['status']] = counts.get(result['status'], 0) + 1
+    lines.append('{} runs: {}'.format(len(results), ', '.join(
+                 '{} {}'.format(n, status)
+                 for status, n in sorted(counts.items()))))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Dry run every protocol in a process pool.')
+    parser.add_argument('paths', nargs='*',
+                        help='protocol files or directories, default the '
+                             'production trees')
+    parser.add_argument('-g', '--grid', action='append',
+                        help='parameter values to add, name=v1,v2,...')
+    parser.add_argument('-j', '--processes', type=int, default=None)
+    parser.add_argument('-L', '--labware', default=CUSTOM_LABWARE)
+    parser.add_argument('--runtime', action='store_true',
+                        help='also estimate run times (otto.runtime)')
+    args = parser.parse_args(argv)
+    started = time.time()
+    found = jobs(discover(args.paths), parse_grid(args.grid), args.labware)
+    results = run_jobs(found, args.processes, args.runtime)
+    print(report(results))
+    print('{:.1f}s wall time'.format(time.time() - started))
+    return 1 if any(r['status'] != 'pass' for r in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,104 @@
+'''Tip budget for a protocol and parameter set, from a dry run.
+
+    python -m otto.budget shawn_scripts/production/crosslinking/crosslinking_multi.py -p num_samples=24
+
+Reports per pipette how many tips get used, which columns of which rack,
+how many extra racks (swaps) the run needs and the first step that would
+find no tip.
+'''
+
+import argparse
+import linecache
+import sys
+
+from otto.labware import CUSTOM_LABWARE
+from otto.recording import record
+
+
+def parse_params(pairs):
+    params = {}
+    for pair in pairs or []:
+        name, _, value = pair.partition('=')
+        params[name.strip()] = value.strip()
+    return params
+
+
+def tip_budget(ctx):
+    '''Per pipette tip usage of a recorded run.'''
+    budget = []
+    for pipette in ctx.pipettes():
+        racks = {}
+        tips = 0
+        pickups = 0
+        for command in ctx.commands:
+            if command.name != 'pick_up_tip' or command.pipette is not pipette:
+                continue
+            pickups += 1
+            tips += command.tips
+            rack = command.well.parent
+            col = int(command.well.well_name[1:])
+            used = racks.setdefault(rack, {})
+            used[col] = used.get(col, 0) + command.tips
+        shortages = [s for s in ctx.shortages if s[1] is pipette]
+        budget.append({
+            'pipette': pipette,
+            'tips': tips,
+            'pickups': pickups,
+            'racks': racks,
+            'loaded': len(pipette.tip_racks),
+            'needed': len(racks),
+            'swaps': len(pipette.virtual_racks),
+            'first_shortage': shortages[0] if shortages else None,
+        })
+    return budget
+
+
+def _columns(used):
+    return ' '.join(str(col) if count >= 8 else '{}({})'.format(col, count)
+                    for col, count in sorted(used.items()))
+
+
+def report(path, ctx):
+    lines = [path]
+    for entry in tip_budget(ctx):
+        pipette = entry['pipette']
+        lines.append('  {} ({}): {} tips in {} pickups, {} rack(s) loaded, '
+                     '{} needed'.format(pipette.name, pipette.mount,
+                                        entry['tips'], entry['pickups'],
+                                        entry['loaded'], entry['needed']))
+        for rack, used in entry['racks'].items():
+            where = 'extra rack' if rack.virtual else 'slot {}'.format(
+                    rack.parent)
+            lines.append('    {} {}: columns {}'.format(
+                         where, rack.load_name, _columns(used)))
+        lines.append('    rack swaps: {}'.format(entry['swaps']))
+        if entry['first_shortage']:
+            step, _, tips, line = entry['first_shortage']
+            lines.append('    first out of tips: step {} (line {}) short {} '
+                         'tip(s): {}'.format(step, line, tips,
+                         linecache.getline(ctx.source, line).strip()
+                         if line else ''))
+    if ctx.error is not None:
+        lines.append('  protocol failed at line {}: {!r}'.format(
+                     ctx.error_line, ctx.error))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('protocol', nargs='+')
+    parser.add_argument('-p', '--param', action='append',
+                        help='parameter override, name=value')
+    parser.add_argument('-L', '--labware', default=CUSTOM_LABWARE,
+                        help='custom labware directory')
+    args = parser.parse_args(argv)
+    failed = False
+    for path in args.protocol:
+        ctx = record(path, parse_params(args.param), args.labware)
+        print(report(path, ctx))
+        failed = failed or ctx.error is not None or bool(ctx.shortages)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
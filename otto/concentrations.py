@@ -0,0 +1,220 @@
+'''Per-well concentrations from a recorded run.
+
+    python -m otto.concentrations shawn_scripts/production/general_serial_dilutions/2d_screen_titration.py -s 8:A1=protein:10 -s 8:A2=salt:2000
+
+A Tracker is an otto.volumes ledger that also moves amounts of named
+species. Stocks are declared per well with their concentrations; every
+aspirate takes the well's current mix into the tip (per channel), every
+dispense and blow out hands the tip's mix on in proportion, and a new
+tip starts clean. Wells are taken as mixed the moment liquid goes in.
+Anything not declared counts as plain buffer.
+
+    tracker = Tracker({plate['A1']: {'NaCl': 2000}}).run(ctx)
+    salt = tracker.concentration(plate)[..., tracker.species.index('NaCl')]
+
+Concentrations come out in the units the stocks were given in.
+'''
+
+import argparse
+import sys
+
+import numpy as np
+
+from otto.labware import CUSTOM_LABWARE
+from otto.volumes import LIQUID, Ledger
+
+
+class Tracker(Ledger):
+    def __init__(self, stocks):
+        Ledger.__init__(self, liquids=True)
+        self.stocks = stocks
+        self.species = []
+        for components in stocks.values():
+            for name in components:
+                if name not in self.species:
+                    self.species.append(name)
+        self.amount = {}       # id(labware) -> wells x species
+        self.fixed = {}        # id(labware) -> stock concentrations
+        self.is_stock = {}
+        self._tips = {}        # id(pipette) -> (amounts, volumes) by channel
+
+    def add(self, labware):
+        key = id(labware)
+        if key in self.volume:
+            return key
+        Ledger.add(self, labware)
+        wells = labware.wells()
+        fixed = np.zeros((len(wells), len(self.species)))
+        is_stock = np.zeros(len(wells), dtype=bool)
+        for well in wells:
+            if well in self.stocks:
+                is_stock[well.index] = True
+                for name, conc in self.stocks[well].items():
+                    fixed[well.index, self.species.index(name)] = conc
+        self.fixed[key] = fixed
+        self.is_stock[key] = is_stock
+        self.amount[key] = fixed * self.volume[key][:, None]
+        return key
+
+    def _tip(self, pipette):
+        if id(pipette) not in self._tips:
+            self._tips[id(pipette)] = (
+                np.zeros((pipette.channels, len(self.species))),
+                np.zeros(pipette.channels))
+        return self._tips[id(pipette)]
+
+    def _mix(self, key, index):
+        '''Concentrations in the wells at index, stocks fixed.'''
+        volume = self.volume[key][index]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            conc = np.where(volume[:, None] > 1e-9,
+                            self.amount[key][index] / volume[:, None], 0.0)
+        stock = self.is_stock[key][index]
+        conc[stock] = self.fixed[key][index][stock]
+        return conc
+
+    def apply(self, command):
+        if command.name in ('pick_up_tip', 'drop_tip', 'return_tip'):
+            amounts, volumes = self._tip(command.pipette)
+            amounts[:] = 0
+            volumes[:] = 0
+            return
+        if command.name not in LIQUID or not command.volume:
+            return
+        well = command.well
+        if not hasattr(well, 'liquids') or well.parent is None:
+            return
+        key = self.add(well.parent)
+        wells = command.pipette.wells_under(well, command.tips)
+        index = np.array([w.index for w in wells])
+        n = len(index)
+        amounts, volumes = self._tip(command.pipette)
+        if command.name == 'aspirate':
+            taken = self._mix(key, index) * command.volume
+            np.subtract.at(self.amount[key], index, taken)
+            amounts[:n] += taken
+            volumes[:n] += command.volume
+        else:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                share = np.where(volumes[:n] > 1e-9,
+                                 np.minimum(command.volume / volumes[:n], 1),
+                                 0.0)
+            moved = amounts[:n] * share[:, None]
+            np.add.at(self.amount[key], index, moved)
+            amounts[:n] -= moved
+            volumes[:n] = np.maximum(volumes[:n] - command.volume, 0)
+        Ledger.apply(self, command)
+
+    def run(self, ctx):
+        for labware in list(ctx.loaded_labwares.values()) + [
+                module.labware for module in ctx.loaded_modules.values()
+                if module.labware is not None]:
+            if not labware.is_tiprack:
+                self.add(labware)
+        for command in ctx.commands:
+            self.apply(command)
+        return self
+
+    def concentration(self, labware):
+        '''rows x columns x species array, nan for empty wells.'''
+        key = self.add(labware)
+        conc = self._mix(key, np.arange(len(labware.wells())))
+        conc[self.volume[key] <= 1e-9] = np.nan
+        columns = labware.columns()
+        grid = np.full((max(len(c) for c in columns), len(columns),
+                        len(self.species)), np.nan)
+        for c, column in enumerate(columns):
+            for r, well in enumerate(column):
+                grid[r, c] = conc[well.index]
+        return grid
+
+    def to_csv(self, f, labware=None):
+        '''One line per filled well: labware, well, volume, species...'''
+        f.write('labware,well,volume,' + ','.join(self.species) + '\n')
+        for lw in [labware] if labware is not None else self.labware:
+            key = id(lw)
+            wells = lw.wells()
+            conc = self._mix(key, np.arange(len(wells)))
+            for i in np.flatnonzero(self.touched[key] &
+                                    (self.volume[key] > 1e-9)):
+                f.write('{},{},{:g},{}\n'.format(
+                    str(lw).replace(',', ' '), wells[i].well_name,
+                    round(self.volume[key][i], 3),
+                    ','.join('{:g}'.format(round(c, 6)) for c in conc[i])))
+
+
+def parse_stocks(pairs, ctx):
+    '''{well: {species: conc}} from -s arguments.
+
+    Each is slot:well=name:conc,... or, for every well loaded with a
+    liquid, liquid=name:conc,...
+    '''
+    wells = {}
+    for labware in list(ctx.loaded_labwares.values()) + [
+            module.labware for module in ctx.loaded_modules.values()
+            if module.labware is not None]:
+        # module labware goes by the module's slot
+        slot = getattr(labware.parent, 'parent', labware.parent)
+        for well in labware.wells():
+            wells.setdefault('{}:{}'.format(slot, well.well_name), well)
+            for liquid, volume in well.liquids:
+                if liquid is not None:
+                    wells.setdefault(liquid.name, [])
+                    if isinstance(wells[liquid.name], list):
+                        wells[liquid.name].append(well)
+    stocks = {}
+    for pair in pairs or []:
+        where, _, components = pair.partition('=')
+        found = wells.get(where.strip())
+        if found is None:
+            raise KeyError('no well or liquid {}'.format(where))
+        mix = {}
+        for component in components.split(','):
+            name, _, conc = component.partition(':')
+            mix[name.strip()] = float(conc)
+        for well in found if isinstance(found, list) else [found]:
+            stocks[well] = mix
+    return stocks
+
+
+def main(argv=None):
+    from otto.budget import parse_params
+    from otto.recording import record
+
+    parser = argparse.ArgumentParser(
+        description='Per-well concentrations a protocol ends up with.')
+    parser.add_argument('protocol')
+    parser.add_argument('-s', '--stock', action='append', required=True,
+                        help='slot:well=name:conc,... or '
+                             'liquid=name:conc,...')
+    parser.add_argument('-p', '--param', action='append',
+                        help='parameter override, name=value')
+    parser.add_argument('-L', '--labware', default=CUSTOM_LABWARE)
+    parser.add_argument('--csv', help='write every filled well here')
+    args = parser.parse_args(argv)
+    ctx = record(args.protocol, parse_params(args.param), args.labware)
+    tracker = Tracker(parse_stocks(args.stock, ctx)).run(ctx)
+    for labware in tracker.labware:
+        grid = tracker.concentration(labware)
+        if np.isnan(grid).all():
+            continue
+        for s, name in enumerate(tracker.species):
+            values = grid[..., s]
+            if not np.nanmax(values) > 0:
+                continue
+            print('{} {} (rows x columns):'.format(labware, name))
+            for row in values:
+                print('  ' + ' '.join('{:>7}'.format(
+                      '' if np.isnan(v) else '{:.3g}'.format(v))
+                      for v in row))
+    if args.csv:
+        with open(args.csv, 'w') as f:
+            tracker.to_csv(f)
+    if ctx.error is not None:
+        print('protocol failed at line {}: {!r}'.format(ctx.error_line,
+                                                       ctx.error))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
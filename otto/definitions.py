@@ -0,0 +1,291 @@
+'''Labware definition diff and what it does to the protocols.
+
+    python -m otto.definitions custom_labware_definitions/old_costar_96_wellplate_200ul.json costar_96_wellplate_200ul
+
+Compares two definitions (json files or load names) field by field, the
+wells summarised per field through otto.geometry, then dry runs every
+protocol that loads either load name with each of the two in its place
+(otto.runtime timing) and compares run time, head travel, how
+high above the well bottom the tips work, and the clearance left if the
+plate on the deck is the other one: a tip sent to bottom(1) of a
+definition whose wells sit 1.5 mm lower than the real plate's hits the
+bottom.
+
+Load names are looked up like the tools do (otto.labware); files that
+declare the same load name as another are listed, only one of them is
+ever used.
+'''
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+
+import numpy as np
+
+from otto.labware import CUSTOM_LABWARE, definition_files, load_definition
+
+WELL_FIELDS = ('x', 'y', 'z', 'depth', 'totalLiquidVolume', 'diameter',
+               'xDimension', 'yDimension', 'shape')
+LIQUID = ('aspirate', 'dispense', 'mix')
+MARGIN = 1.0   # mm, clearance that counts as a near miss
+
+
+def read(spec, labware_dir=CUSTOM_LABWARE):
+    '''(label, definition) of a json file or a load name.'''
+    if os.path.isfile(spec):
+        with open(spec) as f:
+            return os.path.basename(spec), json.load(f)
+    return spec, load_definition(spec, labware_dir=labware_dir)
+
+
+def _flatten(value, path=''):
+    if isinstance(value, dict):
+        for key in sorted(value):
+            yield from _flatten(value[key], '{}.{}'.format(path, key)
+                                if path else key)
+    else:
+        yield path, value
+
+
+def diff_fields(a, b):
+    '''(field, a, b) for every field outside the wells that differs.'''
+    skip = ('wells', 'ordering')
+    flat_a = {k: v for k, v in _flatten(a) if not k.startswith(skip)}
+    flat_b = {k: v for k, v in _flatten(b) if not k.startswith(skip)}
+    return [(key, flat_a.get(key), flat_b.get(key))
+            for key in sorted(set(flat_a) | set(flat_b))
+            if flat_a.get(key) != flat_b.get(key)]
+
+
+def diff_wells(a, b):
+    '''Per well field: (field, wells that differ, min, max of b - a).
+
+    Also returns the well names only in a and only in b.
+    '''
+    wells_a, wells_b = a['wells'], b['wells']
+    common = [name for name in wells_a if name in wells_b]
+    fields = []
+    for field in WELL_FIELDS:
+        va = [wells_a[n].get(field) for n in common]
+        vb = [wells_b[n].get(field) for n in common]
+        differ = [i for i in range(len(common)) if va[i] != vb[i]]
+        if not differ:
+            continue
+        numeric = [i for i in differ
+                   if isinstance(va[i], (int, float)) and
+                   isinstance(vb[i], (int, float))]
+        delta = np.array([vb[i] - va[i] for i in numeric], dtype=float)
+        fields.append((field, len(differ),
+                       float(delta.min()) if len(delta) else None,
+                       float(delta.max()) if len(delta) else None))
+    only_a = [n for n in wells_a if n not in wells_b]
+    only_b = [n for n in wells_b if n not in wells_a]
+    if a['ordering'] != b['ordering'] and not (only_a or only_b):
+        fields.append(('ordering', len(common), None, None))
+    return fields, only_a, only_b
+
+
+def bottom_shift(a, b):
+    '''b - a of the absolute well bottom (corner offset included), mm.'''
+    from otto.geometry import index
+    ga, gb = index(a), index(b)
+    common = [name for name in ga.names if name in gb.lookup]
+    return gb.bottom[gb.index(*common)] - ga.bottom[ga.index(*common)]
+
+
+def users(*load_names, paths=None):
+    '''Protocol files that mention any of load_names (otto.batch trees).'''
+    from otto.batch import discover
+    found = []
+    for path in discover(paths):
+        with open(path, encoding='utf-8', errors='replace') as f:
+            text = f.read()
+        if any(name in text for name in load_names):
+            found.append(path)
+    return found
+
+
+def _liquid(ctx, load_names):
+    '''Liquid handling commands into labware of load_names.'''
+    return [c for c in ctx.commands if c.name in LIQUID and c.point and
+            getattr(getattr(c.well, 'parent', None), 'load_name', None) in
+            load_names]
+
+
+def impact(path, a, b, params=None, labware_dir=CUSTOM_LABWARE):
+    '''Dry run path with a and then b in place of either's load name.
+
+    None if the protocol loads neither; a protocol that does not import
+    comes back with just its path and the error.
+    '''
+    from otto.recording import load_protocol, record
+    from otto.runtime import TimeModel
+    from otto.trace import to_trace, travel
+
+    names = {a['parameters']['loadName'], b['parameters']['loadName']}
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            module = load_protocol(path)
+    except Exception as e:
+        return {'path': path, 'error': repr(e)}
+    runs = []
+    for definition in (a, b):
+        ctx = record(path, params, labware_dir, module, timing=TimeModel(),
+                     definitions={name: definition for name in names})
+        loaded = list(ctx.loaded_labwares.values()) + [
+            m.labware for m in ctx.loaded_modules.values() if m.labware]
+        if not any(lw.load_name in names for lw in loaded):
+            return None
+        heights = np.array([c.point[2] - c.well.bottom_point.z
+                            for c in _liquid(ctx, names)])
+        runs.append({'ctx': ctx, 'runtime': ctx.clock,
+                     'travel': sum(travel(to_trace(ctx)).values()),
+                     'heights': heights, 'error': ctx.error,
+                     'error_line': ctx.error_line})
+    result = {'path': path, 'a': runs[0], 'b': runs[1]}
+    # a tip placed for one definition in a plate that is the other: line
+    # the two runs up command by command while they do the same thing
+    cross = {'a': [], 'b': []}
+    for ca, cb in zip(_liquid(runs[0]['ctx'], names),
+                      _liquid(runs[1]['ctx'], names)):
+        if ca.name != cb.name or ca.well.well_name != cb.well.well_name:
+            break
+        # plate is a, positions from b; and the other way round
+        cross['a'].append(cb.point[2] - ca.well.bottom_point.z)
+        cross['b'].append(ca.point[2] - cb.well.bottom_point.z)
+    result['cross'] = {k: np.array(v) for k, v in cross.items()}
+    return result
+
+
+def _short(value, width=30):
+    text = repr(value)
+    return text if len(text) <= width else text[:width - 3] + '...'
+
+
+def _heights(heights):
+    if not len(heights):
+        return '-'
+    return '{:.2f}-{:.2f}'.format(heights.min(), heights.max())
+
+
+def _clearance(values):
+    if not len(values):
+        return None
+    hit = int((values < 0).sum())
+    near = int(((values >= 0) & (values < MARGIN)).sum())
+    text = 'min {:.2f} mm'.format(values.min())
+    if hit:
+        text += ', {} below the bottom'.format(hit)
+    if near:
+        text += ', {} within {:g} mm'.format(near, MARGIN)
+    return text
+
+
+def report(label_a, label_b, a, b, results, labware_dir=CUSTOM_LABWARE):
+    from otto.runtime import clock
+
+    lines = ['a: {}'.format(label_a), 'b: {}'.format(label_b)]
+    for load_name, paths in sorted(definition_files(labware_dir).items()):
+        if len(paths) > 1 and load_name in (
+                a['parameters']['loadName'], b['parameters']['loadName']):
+            lines.append('  {} is declared by {}; only {} is used'.format(
+                         load_name, ', '.join(os.path.basename(p)
+                                              for p in paths),
+                         os.path.basename(paths[0])))
+    fields = diff_fields(a, b)
+    wells, only_a, only_b = diff_wells(a, b)
+    if not fields and not wells and not only_a and not only_b:
+        lines.append('  definitions are the same')
+    for key, va, vb in fields:
+        lines.append('  {:<40} {} -> {}'.format(key, _short(va), _short(vb)))
+    for field, count, low, high in wells:
+        if low is None:
+            lines.append('  wells.{:<34} differs in {} wells'.format(field,
+                                                                     count))
+        else:
+            lines.append('  wells.{:<34} differs in {} wells, b - a '
+                         '{:+g} to {:+g}'.format(field, count, low, high))
+    if only_a or only_b:
+        lines.append('  wells only in a: {}, only in b: {}'.format(
+                     len(only_a), len(only_b)))
+    shift = bottom_shift(a, b)
+    if len(shift) and np.abs(shift).max() > 0:
+        lines.append('  well bottoms move x {:+.2f} y {:+.2f} z {:+.2f} mm '
+                     '(mean)'.format(*shift.mean(axis=0)))
+    totals = {'a': [0.0, 0.0], 'b': [0.0, 0.0]}
+    worst = {'a': [], 'b': []}
+    for result in results:
+        lines.append(os.path.relpath(result['path']))
+        if 'error' in result:
+            lines.append('  does not load: {}'.format(result['error']))
+            continue
+        for key in ('a', 'b'):
+            run = result[key]
+            if run['error'] is not None:
+                lines.append('  {} failed at line {}: {!r}'.format(
+                             key, run['error_line'], run['error']))
+            totals[key][0] += run['runtime']
+            totals[key][1] += run['travel']
+            worst[key].extend(result['cross'][key])
+        ra, rb = result['a'], result['b']
+        lines.append('  run time {} -> {}, travel {:.0f} -> {:.0f} mm, tips '
+                     '{} -> {} mm above the bottom'.format(
+                         clock(ra['runtime']), clock(rb['runtime']),
+                         ra['travel'], rb['travel'], _heights(ra['heights']),
+                         _heights(rb['heights'])))
+        # cross['a']: the plate on the deck is a, the positions are b's
+        for plate, other in (('a', 'b'), ('b', 'a')):
+            text = _clearance(result['cross'][plate])
+            if text is not None:
+                lines.append('  {} plate run as {}: {}'.format(plate, other,
+                                                               text))
+    if results:
+        lines.append('{} protocol(s): run time {} -> {}, travel {:.0f} -> '
+                     '{:.0f} mm'.format(
+                         len([r for r in results if 'error' not in r]),
+                         clock(totals['a'][0]), clock(totals['b'][0]),
+                         totals['a'][1], totals['b'][1]))
+        for plate, other in (('a', 'b'), ('b', 'a')):
+            text = _clearance(np.array(worst[plate]))
+            if text is not None:
+                lines.append('  {} plate run as {}: {}'.format(plate, other,
+                                                               text))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    from otto.budget import parse_params
+
+    parser = argparse.ArgumentParser(
+        description='Diff two labware definitions and dry run the protocols '
+                    'that use either with each.')
+    parser.add_argument('a', help='json file or load name')
+    parser.add_argument('b', help='json file or load name')
+    parser.add_argument('paths', nargs='*',
+                        help='protocols or directories (default: otto.batch '
+                             'trees)')
+    parser.add_argument('-p', '--param', action='append',
+                        help='parameter override, name=value')
+    parser.add_argument('-L', '--labware', default=CUSTOM_LABWARE)
+    parser.add_argument('--no-runs', action='store_true',
+                        help='only diff the definitions')
+    args = parser.parse_args(argv)
+    label_a, a = read(args.a, args.labware)
+    label_b, b = read(args.b, args.labware)
+    results = []
+    if not args.no_runs:
+        params = parse_params(args.param)
+        for path in users(a['parameters']['loadName'], b['parameters']
+                          ['loadName'], paths=args.paths or None):
+            result = impact(path, a, b, params, args.labware)
+            if result is not None:
+                results.append(result)
+    print(report(label_a, label_b, a, b, results, args.labware))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,162 @@
+'''Behaviour diff between two versions of a protocol.
+
+    python -m otto.diff shawn_scripts/deprecated/shawn_384well_saltscreen_12serialdilution.py shawn_scripts/deprecated/shawn_384well_saltscreen_12serialdilution_fast.py
+
+Dry runs both (otto.runtime timing) and compares what they do rather than
+their source: the final volume of every well (labware matched by deck
+slot and load name), tips used, head travel and estimated run time, plus
+an alignment of the two command sequences showing where they part ways.
+-p parameters go to whichever of the two declares them.
+'''
+
+import argparse
+import difflib
+import sys
+
+from otto.labware import CUSTOM_LABWARE
+
+TOLERANCE = 0.01   # µL
+
+
+def well_key(well):
+    '''(slot, load name, well name), the same across two runs.'''
+    labware = well.parent
+    slot = getattr(labware.parent, 'parent', labware.parent)
+    return str(slot), labware.load_name, well.well_name
+
+
+def final_volumes(ctx):
+    from otto.volumes import well_volumes
+    return {well_key(well): volume
+            for well, (volume, peak) in well_volumes(ctx).items()}
+
+
+def _token(command):
+    '''What a command does, without step numbers or timing.'''
+    well = command.well
+    where = well_key(well) if hasattr(well, 'well_name') else None
+    volume = round(command.volume, 2) if command.volume is not None else None
+    pipette = command.pipette.name if command.pipette is not None else None
+    return command.name, pipette, where, volume, command.tips
+
+
+def align(a, b):
+    '''difflib opcodes over the command tokens of two runs.'''
+    matcher = difflib.SequenceMatcher(None, [_token(c) for c in a.commands],
+                                      [_token(c) for c in b.commands],
+                                      autojunk=False)
+    return matcher.get_opcodes()
+
+
+def compare(a, b):
+    '''Summary numbers of two recorded, timed runs.'''
+    from otto.budget import tip_budget
+    from otto.trace import to_trace, travel
+
+    volumes_a, volumes_b = final_volumes(a), final_volumes(b)
+    changed = []
+    for key in sorted(set(volumes_a) | set(volumes_b)):
+        va, vb = volumes_a.get(key, 0.0), volumes_b.get(key, 0.0)
+        if abs(va - vb) > TOLERANCE:
+            changed.append((key, va, vb))
+    opcodes = align(a, b)
+    return {
+        'runtime': (a.clock, b.clock),
+        'tips': tuple(sum(e['tips'] for e in tip_budget(ctx))
+                      for ctx in (a, b)),
+        'travel': tuple(sum(travel(to_trace(ctx)).values())
+                        for ctx in (a, b)),
+        'commands': (len(a.commands), len(b.commands)),
+        'volumes': changed,
+        'wells': (len(volumes_a), len(volumes_b)),
+        'same_commands': sum(i2 - i1 for tag, i1, i2, j1, j2 in opcodes
+                             if tag == 'equal'),
+        'opcodes': opcodes,
+    }
+
+
+def _change(old, new, fmt):
+    delta = new - old
+    pct = ' ({:+.0f}%)'.format(delta / old * 100) if old else ''
+    return '{} -> {}, {}{}{}'.format(fmt(old), fmt(new),
+                                     '-' if delta < 0 else '+',
+                                     fmt(abs(delta)), pct)
+
+
+def report(path_a, path_b, a, b, hunks=5):
+    from otto.runtime import clock
+
+    result = compare(a, b)
+    lines = ['a: {}'.format(path_a), 'b: {}'.format(path_b)]
+    for ctx, name in ((a, 'a'), (b, 'b')):
+        if ctx.error is not None:
+            lines.append('  {} failed at line {}: {!r}'.format(
+                         name, ctx.error_line, ctx.error))
+    lines.append('  run time  {}'.format(_change(
+                 *result['runtime'], fmt=clock)))
+    lines.append('  tips      {}'.format(_change(*result['tips'],
+                                                 fmt=str)))
+    lines.append('  travel    {}'.format(_change(
+                 *result['travel'], fmt=lambda mm: '{:.0f} mm'.format(mm))))
+    lines.append('  commands  {} -> {}, {} in common'.format(
+                 *result['commands'], result['same_commands']))
+    changed = result['volumes']
+    if not changed:
+        lines.append('  final volumes: same in all {} wells'.format(
+                     result['wells'][0]))
+    else:
+        lines.append('  final volumes: {} well(s) differ'.format(
+                     len(changed)))
+        for (slot, load_name, well), va, vb in changed[:10]:
+            lines.append('    slot {} {} {}: {:g} -> {:g} µL'.format(
+                         slot, load_name, well, va, vb))
+        if len(changed) > 10:
+            lines.append('    ...')
+    shown = 0
+    for tag, i1, i2, j1, j2 in result['opcodes']:
+        if tag == 'equal':
+            continue
+        if shown == hunks:
+            lines.append('  ...')
+            break
+        shown += 1
+        lines.append('  {} a[{}:{}] b[{}:{}]'.format(tag, i1, i2, j1, j2))
+        for command in a.commands[i1:min(i2, i1 + 3)]:
+            lines.append('    - line {:<4} {}'.format(command.line or '',
+                                                      command))
+        for command in b.commands[j1:min(j2, j1 + 3)]:
+            lines.append('    + line {:<4} {}'.format(command.line or '',
+                                                      command))
+    return '\n'.join(lines)
+
+
+def _params(path, params):
+    from otto.recording import declared_parameters, load_protocol
+    declared = declared_parameters(load_protocol(path)).declared
+    return {name: value for name, value in params.items()
+            if name in declared}
+
+
+def main(argv=None):
+    from otto.budget import parse_params
+    from otto.runtime import estimate
+
+    parser = argparse.ArgumentParser(
+        description='What two versions of a protocol do differently.')
+    parser.add_argument('a')
+    parser.add_argument('b')
+    parser.add_argument('-p', '--param', action='append',
+                        help='parameter override, name=value')
+    parser.add_argument('-L', '--labware', default=CUSTOM_LABWARE)
+    parser.add_argument('--hunks', type=int, default=5,
+                        help='command differences to show')
+    args = parser.parse_args(argv)
+    params = parse_params(args.param)
+    a = estimate(args.a, _params(args.a, params), args.labware)
+    b = estimate(args.b, _params(args.b, params), args.labware)
+    print(report(args.a, args.b, a, b, args.hunks))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,490 @@
+'''Serial dilution planner.
+
+    python -m otto.dilutions corning3575_384well_alt --lanes 16 -n 12 -f 2 -v 20 --blank
+
+Replaces the hand sliced transfer chains of the titration scripts
+(shawn_384well_*serialdilution, protein_titration_*, the AssayPrep
+serial_dilution) with a description of the series:
+
+    series = Series(plate384, 'A1', steps=12, lanes=16, factor=2, volume=20)
+    plan = plan_dilution(series, stock=plate96['A1'], buffer=plate96['A2'])
+    run_plan(plan, p300m, lambda n: tips.pick_up(p300m, n))
+
+A lane is one dilution series, steps wells along the axis ('row' runs
+across the columns, 'column' down the rows), with the lanes side by side.
+Every well ends up with volume µL at 1/factor of the well before it: the
+first well gets volume * factor / (factor - 1) of stock, the rest volume of
+buffer, and the surplus of the last well leaves with the tip. blank=True
+adds a buffer only well at the end of every lane.
+
+Lanes that sit under the nozzles of a multichannel together (every row of a
+96 well plate, every other row of a 384) go as one pass with one tip per
+lane, so 16 row series on a 384 take two passes. Series down a column
+can't share the nozzles and take a single tip each. Buffer goes in with
+multi-dispense (otto.dispense) ahead of the chain, with the pass's tips.
+
+plan_grid() puts a second species on top for 2D titrations: its series is
+made in premix wells, one per lane, then added to every well of the lane.
+'''
+
+import argparse
+import math
+import sys
+
+from otto.dispense import compile_steps, min_volume, trash_well
+from otto.labware import CUSTOM_LABWARE
+
+CHANNELS = 8
+
+
+class Series:
+    '''lanes dilution series of steps wells each on plate, from start.'''
+
+    def __init__(self, plate, start='A1', steps=12, lanes=1, axis='row',
+                 factor=2.0, volume=20.0, mix=(3, None), blank=False):
+        if axis not in ('row', 'column'):
+            raise ValueError("axis is 'row' or 'column', not {!r}".format(
+                             axis))
+        if factor <= 1:
+            raise ValueError('dilution factor has to be more than 1')
+        if steps < 1 or lanes < 1:
+            raise ValueError('need at least one step and one lane')
+        self.plate = plate
+        self.start = start
+        self.steps = steps
+        self.lanes = lanes
+        self.axis = axis
+        self.factor = float(factor)
+        self.volume = float(volume)
+        self.mix = mix
+        self.blank = blank
+        for r, row in enumerate(plate.rows()):
+            if plate[start] in row:
+                self.row, self.column = r, row.index(plate[start])
+                break
+
+    @property
+    def transfer(self):
+        '''µL carried from one well to the next.'''
+        return self.volume / (self.factor - 1)
+
+    def wells(self):
+        '''One list of wells per lane, in plate order.'''
+        length = self.steps + bool(self.blank)
+        if self.axis == 'row':
+            lines, along, across = self.plate.rows(), self.column, self.row
+        else:
+            lines, along, across = self.plate.columns(), self.row, self.column
+        if across + self.lanes > len(lines) or (
+                along + length > len(lines[0])):
+            raise ValueError('{} lanes of {} wells from {} run off {}'.format(
+                             self.lanes, length, self.start, self.plate))
+        return [line[along:along + length]
+                for line in lines[across:across + self.lanes]]
+
+    def dilutions(self):
+        '''Fold dilution of the stock in every well of a lane.'''
+        folds = [self.factor ** i for i in range(self.steps)]
+        return folds + [math.inf] if self.blank else folds
+
+
+def _stride(plate, channels):
+    # rows between neighbouring nozzles: 1 on a 96, 2 on a 384
+    return len(plate.columns()[0]) // channels if channels > 1 else 0
+
+
+def passes(series, channels=CHANNELS):
+    '''Lanes grouped into the passes a multichannel can do them in.'''
+    lanes = series.wells()
+    stride = _stride(series.plate, channels)
+    if series.axis != 'row' or stride < 1:
+        return [[lane] for lane in lanes]
+    # every stride-th row rides on the next nozzle, so split by row parity
+    # and fill the nozzles from A down
+    grouped = []
+    for parity in range(stride):
+        mine = [lane for i, lane in enumerate(lanes)
+                if (series.row + i) % stride == parity]
+        grouped.extend(mine[i:i + channels]
+                       for i in range(0, len(mine), channels))
+    return grouped
+
+
+def _move(source, dest, volume, max_volume):
+    pieces = int(math.ceil(volume / max_volume - 1e-9))
+    ops = []
+    for i in range(pieces):
+        ops.append(('aspirate', volume / pieces, source))
+        ops.append(('dispense', volume / pieces, dest))
+    return ops
+
+
+def _fill(steps, max_volume, disposal_volume, multi_dispense):
+    if not multi_dispense:
+        return [op for step in steps
+                for op in compile_steps([step], max_volume)[0][1]]
+    return compile_steps(steps, max_volume, disposal_volume)[0][1]
+
+
+def _chain(lane, steps, stock, buffer, volume, factor, mix, max_volume,
+           disposal_volume=0, multi_dispense=True, discard=True, fill=True):
+    '''Ops for one series along lane.
+
+    fill=False and a stock of None leave out the buffer and the stock,
+    for callers that put them in themselves.
+    '''
+    transfer = volume / (factor - 1)
+    for well in lane[:steps]:
+        if volume + transfer > well.max_volume:
+            raise ValueError('{} would need {:g} µL'.format(
+                             well, volume + transfer))
+    reps, mix_volume = mix or (0, None)
+    mix_volume = min(mix_volume or transfer, max_volume)
+    ops = []
+    if fill:
+        ops += _fill([(buffer, well, volume) for well in lane[1:]],
+                     max_volume, disposal_volume, multi_dispense)
+    if stock is not None:
+        ops += _move(stock, lane[0], volume + transfer, max_volume)
+    for source, dest in zip(lane[:steps - 1], lane[1:steps]):
+        ops += _move(source, dest, transfer, max_volume)
+        if reps:
+            ops.append(('mix', reps, mix_volume, dest))
+    if discard:
+        pieces = int(math.ceil(transfer / max_volume - 1e-9))
+        for i in range(pieces):
+            ops.append(('aspirate', transfer / pieces, lane[steps - 1]))
+            if i < pieces - 1:
+                ops.append(('blow_out', None))
+    return ops
+
+
+def _per_pass(location, count):
+    if isinstance(location, (list, tuple)):
+        if len(location) < count:
+            raise ValueError('{} passes but {} locations given'.format(
+                             count, len(location)))
+        return list(location)
+    return [location] * count
+
+
+def plan_dilution(series, stock, buffer, channels=CHANNELS, max_volume=300,
+                  disposal_volume=None, multi_dispense=True, discard=True):
+    '''Blocks of (tips, ops) for series, one block per pass.
+
+    stock and buffer are where the A nozzle goes, or a list with one per
+    pass. ops are otto.dispense ops plus ('mix', repetitions, volume, well).
+    The buffer goes in with disposal_volume extra per multi-dispense
+    aspiration, by default the pipette's min volume.
+    '''
+    if disposal_volume is None:
+        disposal_volume = min_volume(max_volume)
+    grouped = passes(series, channels)
+    stocks = _per_pass(stock, len(grouped))
+    buffers = _per_pass(buffer, len(grouped))
+    plan = []
+    for lanes, stock, buffer in zip(grouped, stocks, buffers):
+        plan.append((len(lanes), _chain(
+            lanes[0], series.steps, stock, buffer, series.volume,
+            series.factor, series.mix, max_volume, disposal_volume,
+            multi_dispense, discard)))
+    return plan
+
+
+def pairs(series, channels=CHANNELS):
+    '''Passes of a 384 as (odd rows, even rows) pairs, in passes() order.
+
+    Passes without a partner of the same size come as (pass, None).
+    '''
+    if series.axis != 'row' or _stride(series.plate, channels) != 2:
+        raise ValueError('pairing needs lanes along the rows of a plate '
+                         'with two rows per nozzle, like a 384')
+    grouped = passes(series, channels)
+    rows = {id(lane[0]): series.row + i
+            for i, lane in enumerate(series.wells())}
+    odd = [p for p in grouped if rows[id(p[0][0])] % 2 == 0]
+    even = [p for p in grouped if rows[id(p[0][0])] % 2 == 1]
+    paired = []
+    for i in range(max(len(odd), len(even))):
+        a = odd[i] if i < len(odd) else None
+        b = even[i] if i < len(even) else None
+        if a is not None and b is not None and len(a) == len(b):
+            paired.append((a, b))
+        else:
+            # a short partner would put the spare tips into other lanes
+            paired.extend((p, None) for p in (a, b) if p is not None)
+    return paired
+
+
+def plan_pair(series, stock, buffer, channels=CHANNELS, max_volume=300,
+              disposal_volume=None, shared_tips=None):
+    '''Blocks of (tips, ops) doing the odd and even row passes together.
+
+    The buffer of both goes in with one tip set, the dispenses of a trip
+    alternating between the two parities. With one stock for both
+    (shared_tips, the default for a single stock location) the pair is
+    one block: both first wells are filled from the same aspirations,
+    then the odd chain runs and the even one follows on the same tips,
+    carrying a trace of the most dilute odd well into the top even one.
+    With a stock per pass (a list, in passes() order) the odd chain keeps
+    the buffer tips and the even one gets its own. disposal_volume is as
+    in plan_dilution().
+    '''
+    if disposal_volume is None:
+        disposal_volume = min_volume(max_volume)
+    grouped = passes(series, channels)
+    stocks = _per_pass(stock, len(grouped))
+    buffers = _per_pass(buffer, len(grouped))
+    if shared_tips is None:
+        shared_tips = not isinstance(stock, (list, tuple))
+    index = {id(p[0][0]): i for i, p in enumerate(grouped)}
+    steps, volume = series.steps, series.volume
+    transfer = series.transfer
+    plan = []
+    for a, b in pairs(series, channels):
+        i = index[id(a[0][0])]
+        if b is None:
+            plan.append((len(a), _chain(
+                a[0], steps, stocks[i], buffers[i], volume, series.factor,
+                series.mix, max_volume, disposal_volume)))
+            continue
+        j = index[id(b[0][0])]
+        odd, even = a[0], b[0]
+        fill = []
+        for well_a, well_b in zip(odd[1:], even[1:]):
+            fill += [(buffers[i], well_a, volume), (buffers[j], well_b,
+                                                     volume)]
+        ops = compile_steps(fill, max_volume, disposal_volume)[0][1]
+        if not shared_tips:
+            ops += _chain(odd, steps, stocks[i], None, volume, series.factor,
+                          series.mix, max_volume, fill=False)
+            plan.append((len(a), ops))
+            plan.append((len(b), _chain(
+                even, steps, stocks[j], None, volume, series.factor,
+                series.mix, max_volume, fill=False)))
+            continue
+        ops += compile_steps([(stocks[i], odd[0], volume + transfer),
+                              (stocks[j], even[0], volume + transfer)],
+                             max_volume)[0][1]
+        # odd chain then even chain: only the last odd well, the most
+        # dilute, rubs off on the first even one. Both surpluses go at the
+        # end, the odd one is next door by then.
+        for lane in (odd, even):
+            ops += _chain(lane, steps, None, None, volume, series.factor,
+                          series.mix, max_volume, fill=False, discard=False)
+        held = 0
+        for lane in (even, odd):
+            pieces = int(math.ceil(transfer / max_volume - 1e-9))
+            for k in range(pieces):
+                if held + transfer / pieces > max_volume + 1e-9:
+                    ops.append(('blow_out', None))
+                    held = 0
+                ops.append(('aspirate', transfer / pieces, lane[steps - 1]))
+                held += transfer / pieces
+        plan.append((len(a), ops))
+    return plan
+
+
+def premix_wells(premix, grouped, channels=CHANNELS):
+    '''The premix well of every lane, in pass order.
+
+    premix has the well the A nozzle goes to for each pass; the lanes of a
+    pass take the wells under the nozzles from there.
+    '''
+    wells = []
+    for head, lanes in zip(_per_pass(premix, len(grouped)), grouped):
+        stride = max(_stride(head.parent, channels), 1)
+        for column in head.parent.columns():
+            if head in column:
+                start = column.index(head)
+                under = column[start:start + stride * len(lanes):stride]
+                break
+        if len(under) < len(lanes):
+            raise ValueError('{} lanes do not fit under {}'.format(
+                             len(lanes), head))
+        wells.extend(under)
+    return wells
+
+
+def plan_grid(series, stock, buffer, second, premix, factor, add,
+              second_buffer=None, channels=CHANNELS, max_volume=300,
+              disposal_volume=None, spare=10, mix=(3, None)):
+    '''A 2D titration: series, then a second species that varies by lane.
+
+    The second species is diluted factor-fold from lane to lane in premix
+    wells (see premix_wells) with a single tip, then every well of a lane
+    gets add µL of its lane's premix from above. Wells end with
+    series.volume + add µL; the first species is diluted by
+    volume / (volume + add) everywhere, the second by add / (volume + add)
+    on top of its premix level. disposal_volume is as in plan_dilution().
+    '''
+    if disposal_volume is None:
+        disposal_volume = min_volume(max_volume)
+    if series.axis != 'row':
+        raise ValueError('plan_grid needs lanes along rows')
+    grouped = passes(series, channels)
+    wells = premix_wells(premix, grouped, channels)
+    # premix levels follow the lanes down the plate, not the passes
+    lane_order = [id(lane[0]) for lane in series.wells()]
+    heads = [lane[0] for lanes in grouped for lane in lanes]
+    chain = [wells[heads.index(well)] for well in
+             sorted(heads, key=lambda w: lane_order.index(id(w)))]
+    length = series.steps + bool(series.blank)
+    level = add * length + disposal_volume + spare
+    plan = [(1, _chain(chain, len(chain), second, second_buffer or buffer,
+                       level, factor, mix, max_volume, disposal_volume))]
+    plan += plan_dilution(series, stock, buffer, channels, max_volume,
+                          disposal_volume)
+    for head, lanes in zip(_per_pass(premix, len(grouped)), grouped):
+        steps = [(head, well.top(), add) for well in lanes[0]]
+        plan.append((len(lanes), compile_steps(steps, max_volume,
+                                               disposal_volume)[0][1]))
+    return plan
+
+
+def run_plan(plan, pipette, pick_up=None, trash=None):
+    '''Run blocks; pick_up(tips) has to put that many tips on.
+
+    Discards go to trash, default the pipette's trash container, looked
+    up when the first one comes.
+    '''
+    for tips, ops in plan:
+        if pick_up is not None:
+            pick_up(tips)
+        else:
+            pipette.pick_up_tip()
+        for op in ops:
+            if op[0] == 'aspirate':
+                pipette.aspirate(op[1], op[2])
+            elif op[0] == 'dispense':
+                pipette.dispense(op[1], op[2])
+            elif op[0] == 'mix':
+                pipette.mix(op[1], op[2], op[3])
+            elif op[0] == 'touch_tip':
+                pipette.touch_tip(op[1])
+            elif op[1] is None:
+                trash = trash_well(pipette, trash)
+                pipette.blow_out(trash)
+            else:
+                pipette.blow_out(op[1])
+        pipette.drop_tip()
+
+
+def summary(plan):
+    return {'pickups': len(plan),
+            'tips': sum(tips for tips, ops in plan),
+            'aspirations': sum(1 for tips, ops in plan for op in ops
+                               if op[0] == 'aspirate'),
+            'mixes': sum(1 for tips, ops in plan for op in ops
+                         if op[0] == 'mix')}
+
+
+def _deck(plate, timing, labware_dir):
+    from otto.recording import RecordingContext
+    from otto.tips import TipAllocator
+
+    ctx = RecordingContext(labware_dir=labware_dir, timing=timing)
+    racks = [ctx.load_labware('opentrons_96_tiprack_300ul', slot)
+             for slot in (4, 1)]
+    deck = {
+        'plate': ctx.load_labware(plate, 5),
+        'source': ctx.load_labware('costar_96_wellplate_200ul', 2),
+        'trough': ctx.load_labware('nest_12_reservoir_15ml', 3),
+        'premix': ctx.load_labware('nest_96_wellplate_2ml_deep', 6),
+        'pipette': ctx.load_instrument('p300_multi_gen2', 'left',
+                                       tip_racks=racks),
+    }
+    tips = TipAllocator([deck['pipette']], simulating=True)
+    deck['pick_up'] = lambda n: tips.pick_up(deck['pipette'], n)
+    return ctx, deck
+
+
+def _build(args, ctx, deck, mode):
+    series = Series(deck['plate'], args.start, args.steps, args.lanes,
+                    args.axis, args.factor, args.volume,
+                    (args.mix[0], args.mix[1] or None), args.blank)
+    channels = 1 if mode == 'single tip' else CHANNELS
+    count = len(passes(series, channels))
+    source = deck['source']
+    # a stock column per pass (a well for single tip lanes), and the same
+    # on the deep well plate for the premixes of a grid
+    stride = 8 if channels > 1 and series.axis == 'row' else 1
+    stocks = [source.wells()[p * stride] for p in range(count)]
+    if args.pair and not args.own_stocks:
+        stocks = stocks[0]
+    buffer = deck['trough']['A1']
+    if mode == 'paired':
+        return series, plan_pair(series, stocks, buffer,
+                                 disposal_volume=args.disposal)
+    if args.grid is None:
+        return series, plan_dilution(series, stocks, buffer, channels,
+                                     disposal_volume=args.disposal,
+                                     multi_dispense=mode != 'single tip')
+    premix = [deck['premix'].wells()[p * stride] for p in range(count)]
+    return series, plan_grid(series, stocks, buffer, deck['trough']['A2'],
+                             premix, args.grid, args.add, channels=channels,
+                             disposal_volume=args.disposal)
+
+
+def main(argv=None):
+    from otto.runtime import TimeModel, clock
+
+    parser = argparse.ArgumentParser(
+        description='Plan a serial dilution and compare it with doing one '
+                    'lane at a time.')
+    parser.add_argument('plate', help='labware load name')
+    parser.add_argument('--start', default='A1')
+    parser.add_argument('-n', '--steps', type=int, default=12)
+    parser.add_argument('--lanes', type=int, default=8)
+    parser.add_argument('--axis', choices=('row', 'column'), default='row')
+    parser.add_argument('-f', '--factor', type=float, default=2)
+    parser.add_argument('-v', '--volume', type=float, default=20,
+                        help='µL every well ends with')
+    parser.add_argument('--mix', type=float, nargs=2, default=(3, 0),
+                        metavar=('REPS', 'UL'),
+                        help='mix after every transfer, 0 µL for the '
+                             'transfer volume')
+    parser.add_argument('--blank', action='store_true')
+    parser.add_argument('-d', '--disposal', type=float,
+                        help="µL extra per multi-dispense aspiration "
+                             "(default the pipette's min volume)")
+    parser.add_argument('--grid', type=float, metavar='FACTOR',
+                        help='2D: second species diluted FACTOR-fold by lane')
+    parser.add_argument('--add', type=float, default=10,
+                        help='µL of second species premix per well')
+    parser.add_argument('--pair', action='store_true',
+                        help='384: odd and even rows together, against one '
+                             'parity at a time')
+    parser.add_argument('--own-stocks', action='store_true',
+                        help='with --pair, a stock column per pass')
+    parser.add_argument('-L', '--labware', default=CUSTOM_LABWARE)
+    args = parser.parse_args(argv)
+    args.mix = (int(args.mix[0]), args.mix[1])
+    if args.pair and args.grid is not None:
+        parser.error('--pair and --grid do not go together')
+    modes = ('paired', 'by parity') if args.pair else (
+             'planned', 'single tip')
+    results = []
+    for mode in modes:
+        ctx, deck = _deck(args.plate, TimeModel(), args.labware)
+        series, plan = _build(args, ctx, deck, mode)
+        run_plan(plan, deck['pipette'], deck['pick_up'])
+        results.append((mode, summary(plan), ctx.clock))
+    lanes = series.wells()
+    print('{} x {} well series on {} from {}, {:g}-fold, {:g} µL '
+          '(+{:g} µL transfers)'.format(
+              len(lanes), len(lanes[0]), series.plate, series.start,
+              series.factor, series.volume, series.transfer))
+    for label, numbers, seconds in results:
+        print('  {:<13} {} pickups, {} tips, {} aspirations, {} mixes, '
+              '{}'.format(label, numbers['pickups'], numbers['tips'],
+                          numbers['aspirations'], numbers['mixes'],
+                          clock(seconds)))
+    saved = results[1][2] - results[0][2]
+    print('  saves {} ({:.0f}%)'.format(clock(saved),
+                                        saved / results[1][2] * 100))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
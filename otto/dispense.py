@@ -0,0 +1,237 @@
+'''Multi-dispense compiler.
+
+Turns a list of one-to-one (source, dest, volume) steps, like the loops of
+transfer(20, buffer, well, new_tip='never') in the HTS protocols, into as
+few aspirations as the tip allows:
+
+    steps = [(buffer, plate.rows()[0][col], 20) for col in range(1, 24)]
+    program = compile_steps(steps, max_volume=300)   # 20 µL disposal
+    run_program(program, p300m)
+
+Steps can carry a fourth item, a tip context. Steps in different contexts
+never share an aspiration, and run_program(..., pick_up=...) changes tips
+between contexts. Within a context steps are grouped by source, but never
+across a step that fills one of the sources or drains one of the
+destinations, so serial dilutions keep their order.
+'''
+
+import argparse
+import math
+import sys
+
+from otto.labware import CUSTOM_LABWARE
+
+
+def well_of(location):
+    '''The well a location points into (a well is its own well).'''
+    return getattr(location, 'labware', location)
+
+
+def _segments(steps):
+    '''Split steps into runs that can be reordered freely.'''
+    segment, sources, dests = [], set(), set()
+    for step in steps:
+        source, dest = id(well_of(step[0])), id(well_of(step[1]))
+        if source in dests or dest in sources:
+            yield segment
+            segment, sources, dests = [], set(), set()
+        segment.append(step)
+        sources.add(source)
+        dests.add(dest)
+    if segment:
+        yield segment
+
+
+def _contexts(steps):
+    current, context = [], None
+    for step in steps:
+        step = tuple(step) + (None,) * (4 - len(step))
+        if current and step[3] != context:
+            yield context, current
+            current = []
+        context = step[3]
+        current.append(step)
+    if current:
+        yield context, current
+
+
+def min_volume(max_volume):
+    '''Min volume of the smallest pipette taking max_volume, the disposal
+    volume distribute() uses by default.'''
+    from otto.recording import PIPETTES
+
+    fits = [(top, low) for channels, low, top, rate in PIPETTES.values()
+            if top >= max_volume - 1e-9]
+    return min(fits)[1] if fits else 0
+
+
+def compile_steps(steps, max_volume=300, disposal_volume=None, blow_out=None,
+                  touch_tip=False):
+    '''Compile steps into (context, ops) blocks.
+
+    ops are ('aspirate', volume, location), ('dispense', volume, location),
+    ('touch_tip', location) and ('blow_out', location). Aspirations feeding
+    more than one dispense take disposal_volume extra, by default the
+    pipette's min volume, blown out back into the source unless blow_out
+    says 'trash' or 'last' (the last destination of the aspiration).
+    '''
+    if disposal_volume is None:
+        disposal_volume = min_volume(max_volume)
+    if disposal_volume >= max_volume:
+        raise ValueError('disposal volume leaves no room in the tip')
+    if blow_out is None and disposal_volume:
+        blow_out = 'source'
+    program = []
+    for context, context_steps in _contexts(steps):
+        ops = []
+        for segment in _segments(context_steps):
+            groups = []
+            for source, dest, volume, _ in segment:
+                key = id(well_of(source))
+                for group in groups:
+                    if group[0] == key:
+                        break
+                else:
+                    group = (key, source, [])
+                    groups.append(group)
+                pieces = int(math.ceil(volume / max_volume - 1e-9))
+                group[2].extend([(dest, volume / pieces)] * pieces)
+            for key, source, dispenses in groups:
+                trip = []
+                for dest, volume in dispenses:
+                    total = sum(v for d, v in trip) + volume
+                    if trip and total + disposal_volume > max_volume + 1e-9:
+                        ops.extend(_trip(source, trip, disposal_volume,
+                                         blow_out, touch_tip))
+                        trip = []
+                    trip.append((dest, volume))
+                if trip:
+                    ops.extend(_trip(source, trip, disposal_volume, blow_out,
+                                     touch_tip))
+        program.append((context, ops))
+    return program
+
+
+def _trip(source, trip, disposal_volume, blow_out, touch_tip):
+    # a single dispense has nothing to protect, it goes without disposal
+    if len(trip) == 1:
+        disposal_volume = 0
+        blow_out = blow_out if blow_out != 'source' else None
+    ops = [('aspirate', sum(v for d, v in trip) + disposal_volume, source)]
+    for dest, volume in trip:
+        ops.append(('dispense', volume, dest))
+        if touch_tip:
+            ops.append(('touch_tip', well_of(dest)))
+    if blow_out == 'source':
+        ops.append(('blow_out', source))
+    elif blow_out == 'last':
+        ops.append(('blow_out', trip[-1][0]))
+    elif blow_out == 'trash':
+        ops.append(('blow_out', None))
+    return ops
+
+
+def trash_well(pipette, trash=None):
+    '''Where ('blow_out', None) ops go: trash, or the pipette's trash.
+
+    From apiLevel 2.16 the trash is a TrashBin without wells, and goes to
+    blow_out() as it is.
+    '''
+    if trash is not None:
+        return trash
+    container = pipette.trash_container
+    if not hasattr(container, 'wells'):
+        return container
+    return container.wells()[0]
+
+
+def run_program(program, pipette, pick_up=None, trash=None):
+    '''Run compiled blocks, changing tips between them if pick_up is given.
+
+    Blow outs to the trash go to trash, default the pipette's trash
+    container, looked up when the first one comes.
+    '''
+    for context, ops in program:
+        if pick_up is not None:
+            pick_up()
+        for op in ops:
+            if op[0] == 'aspirate':
+                pipette.aspirate(op[1], op[2])
+            elif op[0] == 'dispense':
+                pipette.dispense(op[1], op[2])
+            elif op[0] == 'touch_tip':
+                pipette.touch_tip(op[1])
+            elif op[1] is None:
+                trash = trash_well(pipette, trash)
+                pipette.blow_out(trash)
+            else:
+                pipette.blow_out(op[1])
+        if pick_up is not None:
+            pipette.drop_tip()
+
+
+def aspirations(program):
+    return sum(1 for context, ops in program for op in ops
+               if op[0] == 'aspirate')
+
+
+def steps_from_commands(commands):
+    '''One-to-one steps out of a recorded run.
+
+    An aspirate followed by one dispense of the same volume (touch_tip and
+    blow_out in between allowed) is a step; its tip context is the pickup
+    it happened under. Mixes and multi-dispenses are left alone.
+    '''
+    steps = []
+    context = None
+    pending = None
+    for command in commands:
+        if command.name == 'pick_up_tip':
+            context = command.step
+            pending = None
+        elif command.name == 'aspirate':
+            pending = command
+        elif command.name == 'dispense' and pending is not None:
+            if abs(command.volume - pending.volume) < 1e-6:
+                steps.append((pending.well, command.well, command.volume,
+                              (command.pipette.name, context)))
+            pending = None
+        elif command.name not in ('touch_tip', 'blow_out'):
+            pending = None
+    return steps
+
+
+def main(argv=None):
+    from otto.budget import parse_params
+    from otto.recording import record
+
+    parser = argparse.ArgumentParser(
+        description='Aspirations a protocol could save with multi-dispense.')
+    parser.add_argument('protocol', nargs='+')
+    parser.add_argument('-p', '--param', action='append',
+                        help='parameter override, name=value')
+    parser.add_argument('-d', '--disposal', type=float,
+                        help="µL extra per multi-dispense aspiration "
+                             "(default the pipette's min volume)")
+    parser.add_argument('-L', '--labware', default=CUSTOM_LABWARE)
+    args = parser.parse_args(argv)
+    for path in args.protocol:
+        ctx = record(path, parse_params(args.param), args.labware)
+        steps = steps_from_commands(ctx.commands)
+        pipettes = {pipette.name: pipette for pipette in ctx.pipettes()}
+        before = after = 0
+        for name, pipette in sorted(pipettes.items()):
+            mine = [s for s in steps if s[3][0] == name]
+            before += len(mine)
+            disposal = args.disposal
+            if disposal is None:
+                disposal = pipette.min_volume
+            after += aspirations(compile_steps(mine, pipette.max_volume,
+                                               disposal))
+        print('{}: {} one-to-one aspirations, {} with multi-dispense'.format(
+              path, before, after))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
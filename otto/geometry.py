@@ -0,0 +1,155 @@
+'''Well geometry index for labware definitions.
+
+    python -m otto.geometry corning3575_384well_alt
+
+index(definition) turns a definition into numpy arrays, once per
+definition: well bottoms and centres (relative to the slot, corner offset
+included), depths, volumes and sizes, plus the row/column grid of well
+indexes and its parity views. Planners and the recording context look
+wells up and measure distances with array operations instead of walking
+the JSON or rebuilding well lists:
+
+    geo = index(load_definition('corning3575_384well_alt'))
+    odd = geo.parity(0)                  # rows A, C, E ... as well indexes
+    geo.center[odd[:, 1:12]]             # 8 x 11 x 3
+    geo.at(x, y)                         # well under a point, -1 for none
+'''
+
+import argparse
+import sys
+
+import numpy as np
+
+from otto.labware import CUSTOM_LABWARE, load_definition
+
+_index = {}
+
+
+class Geometry:
+    '''Per well arrays of one labware definition, in definition order.'''
+
+    def __init__(self, definition):
+        corner = definition['cornerOffsetFromSlot']
+        self.load_name = definition['parameters']['loadName']
+        self.names = [name for column in definition['ordering']
+                      for name in column]
+        self.lookup = {name: i for i, name in enumerate(self.names)}
+        specs = [definition['wells'][name] for name in self.names]
+        self.bottom = np.array([(s['x'] + corner['x'], s['y'] + corner['y'],
+                                 s['z'] + corner['z']) for s in specs])
+        self.depth = np.array([s['depth'] for s in specs], dtype=float)
+        self.max_volume = np.array([s['totalLiquidVolume'] for s in specs],
+                                   dtype=float)
+        diameter = [s.get('diameter') for s in specs]
+        self.circular = np.array([d is not None for d in diameter])
+        self.diameter = np.array([np.nan if d is None else d
+                                  for d in diameter], dtype=float)
+        self.width = np.array([s.get('xDimension', s.get('diameter'))
+                               for s in specs], dtype=float)
+        self.length = np.array([s.get('yDimension', s.get('diameter'))
+                                for s in specs], dtype=float)
+        self.center = self.bottom + np.stack(
+            [np.zeros_like(self.depth), np.zeros_like(self.depth),
+             self.depth / 2], axis=1)
+        self.top = self.bottom[:, 2] + self.depth
+        # rows by letter like Labware.rows(), columns in definition order
+        self.row_names = sorted({name[0] for name in self.names})
+        self.column = np.array([c for c, column in
+                                enumerate(definition['ordering'])
+                                for name in column])
+        self.row = np.array([self.row_names.index(name[0])
+                             for name in self.names])
+        self.grid = np.full((len(self.row_names),
+                             len(definition['ordering'])), -1)
+        self.grid[self.row, self.column] = np.arange(len(self.names))
+        # round wells are their bounding box and a radius, square ones
+        # only the box
+        self._half_width = self.width / 2 + 1e-6
+        self._half_length = self.length / 2 + 1e-6
+        self._radius2 = np.where(self.circular, (self.diameter / 2) ** 2,
+                                 np.inf) + 1e-6
+        self._at = {}
+
+    def __len__(self):
+        return len(self.names)
+
+    def index(self, *names):
+        '''Well indexes of well names.'''
+        return np.array([self.lookup[name] for name in names])
+
+    def rows(self):
+        '''rows x columns of well indexes, -1 where a row is short.'''
+        return self.grid
+
+    def columns(self):
+        return self.grid.T
+
+    def parity(self, which, stride=2):
+        '''Every stride-th row from row which: the rows a multichannel
+        reaches at once on a plate with stride rows per nozzle.'''
+        return self.grid[which::stride]
+
+    def at(self, x, y):
+        '''Index of the well whose opening (x, y) falls in, -1 for none.
+
+        x and y are relative to the slot and can be arrays. Single points
+        are remembered, the head keeps going back to the same ones.
+        '''
+        if np.ndim(x) == 0 and np.ndim(y) == 0:
+            key = (float(x), float(y))
+            if key not in self._at:
+                found = np.flatnonzero(self._inside(*key))
+                self._at[key] = int(found[0]) if len(found) else -1
+            return self._at[key]
+        inside = self._inside(np.asarray(x, dtype=float)[..., None],
+                              np.asarray(y, dtype=float)[..., None])
+        return np.where(inside.any(axis=-1), inside.argmax(axis=-1), -1)
+
+    def _inside(self, x, y):
+        dx = np.abs(x - self.bottom[:, 0])
+        dy = np.abs(y - self.bottom[:, 1])
+        return (dx <= self._half_width) & (dy <= self._half_length) & (
+            dx * dx + dy * dy <= self._radius2)
+
+    def distances(self, a, b=None):
+        '''xy distances in mm between wells a and b (default all pairs).'''
+        a = self.bottom[np.asarray(a), :2]
+        b = a if b is None else self.bottom[np.asarray(b), :2]
+        return np.linalg.norm(a[..., :, None, :] - b[..., None, :, :],
+                              axis=-1)
+
+
+def index(definition):
+    '''The Geometry of a definition, built the first time it is asked for.'''
+    key = id(definition)
+    if key not in _index:
+        # keep the definition so its id is not reused
+        _index[key] = (definition, Geometry(definition))
+    return _index[key][1]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Well geometry of a labware definition.')
+    parser.add_argument('load_name', nargs='+')
+    parser.add_argument('-L', '--labware', default=CUSTOM_LABWARE)
+    args = parser.parse_args(argv)
+    for load_name in args.load_name:
+        geo = index(load_definition(load_name, labware_dir=args.labware))
+        print('{}: {} wells, {} rows x {} columns'.format(
+              load_name, len(geo), *geo.grid.shape))
+        pitch = geo.distances(geo.grid[0, :2])[0, 1] if (
+            geo.grid.shape[1] > 1) else float('nan')
+        print('  pitch {:.2f} mm, depth {:g}-{:g} mm, {:g}-{:g} µL, '
+              'bottom z {:g}-{:g} mm'.format(
+                  pitch, geo.depth.min(), geo.depth.max(),
+                  geo.max_volume.min(), geo.max_volume.max(),
+                  geo.bottom[:, 2].min(), geo.bottom[:, 2].max()))
+        if (geo.grid < 0).any():
+            print('  {} empty grid positions'.format(int((geo.grid < 0)
+                                                         .sum())))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
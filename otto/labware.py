@@ -0,0 +1,57 @@
+'''Labware definitions for the planning tools.
+
+Custom definitions come from custom_labware_definitions in this repo, the
+rest from the definitions shipped with the opentrons package.
+'''
+
+import json
+import os
+
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CUSTOM_LABWARE = os.path.join(REPO, 'custom_labware_definitions')
+
+_definitions = {}
+_custom = {}
+
+
+def definition_files(labware_dir=CUSTOM_LABWARE):
+    '''{load name: [json files declaring it]}, the one in use first.
+
+    Copies like old_costar_96_wellplate_200ul.json keep the load name of
+    the definition they were made from; the file named after the load name
+    is the one that counts, otherwise the first by file name.
+    '''
+    files = {}
+    for name in sorted(os.listdir(labware_dir)):
+        if name.endswith('.json'):
+            path = os.path.join(labware_dir, name)
+            with open(path) as f:
+                load_name = json.load(f)['parameters']['loadName']
+            files.setdefault(load_name, []).append(path)
+    for load_name, paths in files.items():
+        paths.sort(key=lambda p: os.path.basename(p) != load_name + '.json')
+    return files
+
+
+def custom_definitions(labware_dir=CUSTOM_LABWARE):
+    '''Every definition in labware_dir, by load name.'''
+    if labware_dir not in _custom:
+        found = {}
+        for load_name, paths in definition_files(labware_dir).items():
+            with open(paths[0]) as f:
+                found[load_name] = json.load(f)
+        _custom[labware_dir] = found
+    return _custom[labware_dir]
+
+
+def load_definition(load_name, version=None, labware_dir=CUSTOM_LABWARE):
+    key = (load_name, labware_dir)
+    if key not in _definitions:
+        custom = custom_definitions(labware_dir)
+        if load_name in custom:
+            _definitions[key] = custom[load_name]
+        else:
+            from opentrons_shared_data.labware import load_definition as ot
+            _definitions[key] = ot(load_name, version or 1)
+    return _definitions[key]
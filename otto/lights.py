@@ -0,0 +1,81 @@
+'''Rail light strobe that doesn't hold up the run.
+
+Drop-in for the strobe() copied into the protocols, which sleeps through
+2 * blinks half periods before the robot does anything else:
+
+    from otto.lights import strobe
+
+    strobe(12, 8, True, protocol)     # blinks while setup and homing go on
+    ...
+    strobe(12, 8, False, protocol, wait=True)
+
+The pattern plays on a background thread. A new strobe() stops the one
+still playing, and wait=True blocks until the pattern is done, which the
+last strobe of a run wants so the lights end up as asked. When simulating
+there is nothing to see, the lights are just set to leave_on.
+
+Only legacy contexts (apiLevel below 2.14) get the thread. From 2.14 every
+set_rail_lights() is a protocol engine command that waits behind the
+motion queued before it, so a strobe can't overlap homing or moves, and
+the context is not safe to call from another thread: the pattern plays
+in line there, holding up the run like the protocols' own strobe().
+'''
+
+import threading
+
+ENGINE = (2, 14)     # apiLevel from which the context runs on the engine
+
+
+class Strobe(threading.Thread):
+    def __init__(self, blinks, hz, leave_on, protocol):
+        threading.Thread.__init__(self, name='strobe', daemon=True)
+        self.blinks = blinks
+        self.period = 1/hz
+        self.leave_on = leave_on
+        self.protocol = protocol
+        self._stop_event = threading.Event()
+
+    def run(self):
+        for i in range(self.blinks):
+            for on in (True, False):
+                if self._stop_event.is_set():
+                    return
+                self.protocol.set_rail_lights(on)
+                self._stop_event.wait(self.period)
+        self.protocol.set_rail_lights(self.leave_on)
+
+    def stop(self):
+        '''Stop blinking, leaving the lights as they are.'''
+        self._stop_event.set()
+        self.join()
+
+
+_playing = None
+
+
+def _engine(protocol):
+    version = getattr(protocol, 'api_version', None)
+    return version is not None and tuple(version) >= ENGINE
+
+
+def strobe(blinks, hz, leave_on, protocol, wait=False):
+    '''Blink the rail lights blinks times at hz, then leave them on or off.
+
+    Returns the Strobe thread, or None when simulating or on an engine
+    context, where the pattern has played by the time it returns.
+    '''
+    global _playing
+    if _playing is not None and _playing.is_alive():
+        _playing.stop()
+    _playing = None
+    if protocol.is_simulating():
+        protocol.set_rail_lights(leave_on)
+        return None
+    if _engine(protocol):
+        Strobe(blinks, hz, leave_on, protocol).run()
+        return None
+    _playing = Strobe(blinks, hz, leave_on, protocol)
+    _playing.start()
+    if wait:
+        _playing.join()
+    return _playing
@@ -0,0 +1,129 @@
+'''Reagent assembly planner for make_mixes() style protocols.
+
+Takes the mixes the salt screens build,
+
+    hpd = {'comps': [edta, high_salt, dna, protein, buff], 'vol': 150,
+           'loc': temp_buffs.rows()[0][2].top()}
+
+and plans the component additions so that everything that cannot spoil a
+stock (water, buffer, salt, edta) goes in first with one shared tip, then
+each contaminating component (protein, DNA) with its own tip. Additions of
+the same component are packed into multi-dispense aspirations as far as
+the tip allows, with the pipette's min volume on top that goes back into
+the stock at the end of the trip.
+
+    plan = plan_mixes(mixes, dedicated=[protein, dna, dna_extra])
+    make_mixes(plan, p300m, lambda: tips.pick_up(p300m, 1))
+
+Every component gets vol/parts of a mix, parts defaulting to the number of
+components, or give the mix a 'vols' list parallel to 'comps'.
+'''
+
+import math
+
+
+def _index(items, item):
+    for i, other in enumerate(items):
+        if other is item or other == item:
+            return i
+    return -1
+
+
+def additions(mixes, parts=None):
+    '''(component, [(loc, volume), ...]) in first seen component order.'''
+    components = []
+    dispenses = []
+    for mix in mixes:
+        vols = mix.get('vols')
+        if vols is None:
+            share = mix['vol'] / (parts or len(mix['comps']))
+            vols = [share] * len(mix['comps'])
+        for component, volume in zip(mix['comps'], vols):
+            i = _index(components, component)
+            if i < 0:
+                components.append(component)
+                dispenses.append([])
+            dispenses[i].append((mix['loc'], volume))
+    return list(zip(components, dispenses))
+
+
+def pack(dispenses, max_volume, disposal_volume=0):
+    '''Pack (loc, volume) dispenses into as few aspirations as fit a tip.
+
+    Dispenses bigger than a tip are split evenly first, then packed first
+    fit decreasing. Returns a list of trips, each a list of dispenses.
+    '''
+    room = max_volume - disposal_volume
+    if room <= 0:
+        raise ValueError('disposal volume leaves no room in the tip')
+    chunks = []
+    for order, (loc, volume) in enumerate(dispenses):
+        pieces = int(math.ceil(volume / room - 1e-9))
+        for i in range(pieces):
+            chunks.append((order, loc, volume / pieces))
+    trips = []
+    for order, loc, volume in sorted(chunks, key=lambda c: -c[2]):
+        for trip in trips:
+            if trip[0] + volume <= room + 1e-9:
+                trip[0] += volume
+                trip[1].append((order, loc, volume))
+                break
+        else:
+            trips.append([volume, [(order, loc, volume)]])
+    # dispense each trip in the order the mixes were given
+    return [[(loc, volume) for order, loc, volume in
+             sorted(trip[1], key=lambda d: d[0])]
+            for trip in trips]
+
+
+def plan_mixes(mixes, dedicated=(), max_volume=300, disposal_volume=None,
+               parts=None):
+    '''Tip groups for assembling mixes.
+
+    Returns a list of {'components': [...], 'trips': [(source, disposal,
+    [(loc, volume), ...]), ...]}, one entry per tip, shared tip first.
+    Trips into more than one mix take disposal_volume extra, by default
+    the pipette's min volume, and blow it back into the source.
+    '''
+    from otto.dispense import min_volume
+
+    if disposal_volume is None:
+        disposal_volume = min_volume(max_volume)
+    shared = {'components': [], 'trips': []}
+    own = []
+    for component, dispenses in additions(mixes, parts):
+        trips = [(component, disposal_volume if len(trip) > 1 else 0, trip)
+                 for trip in pack(dispenses, max_volume, disposal_volume)]
+        if _index(list(dedicated), component) < 0:
+            shared['components'].append(component)
+            shared['trips'].extend(trips)
+        else:
+            own.append({'components': [component], 'trips': trips})
+    return ([shared] if shared['trips'] else []) + own
+
+
+def make_mixes(plan, pipette, pick_up, touch_tip=True):
+    '''Run a plan. pick_up() has to put a tip on the pipette.
+
+    Every trip ends with a blow out, of the disposal volume back into the
+    source, or into the last mix of a trip without one.
+    '''
+    for group in plan:
+        pick_up()
+        for source, disposal, dispenses in group['trips']:
+            pipette.aspirate(sum(v for loc, v in dispenses) + disposal, source)
+            for loc, volume in dispenses:
+                pipette.dispense(volume, loc)
+                if touch_tip:
+                    pipette.touch_tip()
+            pipette.blow_out(source if disposal else dispenses[-1][0])
+        pipette.drop_tip()
+
+
+def summary(plan, mixes, parts=None):
+    '''Tips and aspirations of a plan next to one tip per component.'''
+    added = additions(mixes, parts)
+    return {'tips': len(plan),
+            'aspirations': sum(len(group['trips']) for group in plan),
+            'naive_tips': len(added),
+            'naive_aspirations': sum(len(d) for c, d in added)}
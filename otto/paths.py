@@ -0,0 +1,209 @@
+'''Dispense ordering to cut gantry travel.
+
+Reorders independent dispenses (say the dispenses of one multi-dispense
+aspiration) with nearest neighbour followed by 2-opt over the well
+positions from the labware definitions. Ordering constraints are given as
+(i, j) index pairs meaning dispense i has to happen before dispense j.
+
+    order = best_order([loc for loc, volume in trip], start=source)
+    trip = [trip[i] for i in order]
+
+python -m otto.paths <protocol.py> reports the travel a protocol would save
+if every multi-dispense in it was reordered.
+'''
+
+import argparse
+import math
+import sys
+
+from otto.labware import CUSTOM_LABWARE
+
+# OT-2 default gantry speed, mm/s
+SPEED = 400.0
+
+
+def position(location):
+    '''x, y of a location or well.'''
+    point = getattr(location, 'point', None)
+    if point is None:
+        point = location.top().point
+    return point[0], point[1]
+
+
+def distance(a, b):
+    return math.hypot(a[0] - b[0], a[1] - b[1])
+
+
+def travel(points, start=None, end=None):
+    path = ([start] if start is not None else []) + list(points) + (
+           [end] if end is not None else [])
+    return sum(distance(a, b) for a, b in zip(path, path[1:]))
+
+
+def _valid(order, constraints):
+    where = {item: i for i, item in enumerate(order)}
+    return all(where[a] < where[b] for a, b in constraints)
+
+
+def nearest_neighbour(points, start=None, constraints=()):
+    before = {}
+    for a, b in constraints:
+        before.setdefault(b, set()).add(a)
+    left = list(range(len(points)))
+    done = set()
+    order = []
+    here = start
+    while left:
+        ready = [i for i in left if before.get(i, set()) <= done]
+        if not ready:
+            raise ValueError('ordering constraints have a cycle')
+        if here is None:
+            pick = ready[0]
+        else:
+            pick = min(ready, key=lambda i: distance(here, points[i]))
+        order.append(pick)
+        done.add(pick)
+        left.remove(pick)
+        here = points[pick]
+    return order
+
+
+def two_opt(order, points, start=None, end=None, constraints=()):
+    '''Reverse segments while that shortens the path and keeps constraints.'''
+    def cost(o):
+        return travel([points[i] for i in o], start, end)
+
+    best = list(order)
+    best_cost = cost(best)
+    improved = True
+    while improved:
+        improved = False
+        for i in range(len(best) - 1):
+            for j in range(i + 2, len(best) + 1):
+                candidate = best[:i] + best[i:j][::-1] + best[j:]
+                if constraints and not _valid(candidate, constraints):
+                    continue
+                candidate_cost = cost(candidate)
+                if candidate_cost < best_cost - 1e-9:
+                    best, best_cost = candidate, candidate_cost
+                    improved = True
+    return best
+
+
+def best_order(locations, start=None, end=None, constraints=()):
+    '''Index order of locations with the shortest travel found.'''
+    points = [position(loc) for loc in locations]
+    start = position(start) if start is not None else None
+    end = position(end) if end is not None else None
+    order = nearest_neighbour(points, start, constraints)
+    order = two_opt(order, points, start, end, constraints)
+    # never hand back something worse than what came in
+    given = list(range(len(points)))
+    if travel([points[i] for i in given], start, end) <= travel(
+            [points[i] for i in order], start, end):
+        return given
+    return order
+
+
+def optimize_program(program):
+    '''Reorder the dispenses of every aspiration of an otto.dispense program.
+
+    Returns the new program and the travel saved in mm.
+    '''
+    saved = 0.0
+    optimized = []
+    for context, ops in program:
+        new_ops = []
+        i = 0
+        while i < len(ops):
+            new_ops.append(ops[i])
+            if ops[i][0] != 'aspirate':
+                i += 1
+                continue
+            source = ops[i][2]
+            j = i + 1
+            dispenses = []
+            while j < len(ops) and ops[j][0] in ('dispense', 'touch_tip'):
+                if ops[j][0] == 'dispense':
+                    dispenses.append([ops[j]])
+                else:
+                    dispenses[-1].append(ops[j])
+                j += 1
+            locations = [d[0][2] for d in dispenses]
+            order = best_order(locations, start=source)
+            points = [position(loc) for loc in locations]
+            saved += travel(points, position(source)) - travel(
+                [points[k] for k in order], position(source))
+            for k in order:
+                new_ops.extend(dispenses[k])
+            i = j
+        optimized.append((context, new_ops))
+    return optimized, saved
+
+
+def dispense_runs(commands):
+    '''Runs of dispenses that follow one aspiration in a recorded run.'''
+    runs = []
+    source = None
+    run = []
+    for command in commands:
+        if command.name == 'aspirate':
+            if len(run) > 1:
+                runs.append((source, run))
+            source, run = command, []
+        elif command.name == 'dispense' and source is not None:
+            run.append(command)
+        elif command.name not in ('touch_tip',):
+            if len(run) > 1:
+                runs.append((source, run))
+            source, run = None, []
+    if len(run) > 1:
+        runs.append((source, run))
+    return runs
+
+
+def travel_saved(commands):
+    '''mm of travel saved by reordering every multi-dispense, and run count.'''
+    saved = 0.0
+    runs = dispense_runs(commands)
+    for source, run in runs:
+        start = source.point[:2]
+        points = [command.point[:2] for command in run]
+        order = two_opt(nearest_neighbour(points, start), points, start)
+        saved += max(0.0, travel(points, start) -
+                     travel([points[i] for i in order], start))
+    return saved, len(runs)
+
+
+def main(argv=None):
+    from otto.budget import parse_params
+    from otto.dispense import compile_steps, steps_from_commands
+    from otto.recording import record
+
+    parser = argparse.ArgumentParser(
+        description='Travel saved by reordering multi-dispenses.')
+    parser.add_argument('protocol', nargs='+')
+    parser.add_argument('-p', '--param', action='append',
+                        help='parameter override, name=value')
+    parser.add_argument('-L', '--labware', default=CUSTOM_LABWARE)
+    args = parser.parse_args(argv)
+    for path in args.protocol:
+        ctx = record(path, parse_params(args.param), args.labware)
+        saved, runs = travel_saved(ctx.commands)
+        print('{}: {} multi-dispense runs, {:.0f} mm ({:.1f} s) of travel '
+              'saved'.format(path, runs, saved, saved / SPEED))
+        # and what reordering adds once one-to-one steps are compiled
+        steps = steps_from_commands(ctx.commands)
+        compiled = 0.0
+        for pipette in ctx.pipettes():
+            mine = [s for s in steps if s[3][0] == pipette.name]
+            program = compile_steps(mine, pipette.max_volume,
+                                    pipette.min_volume)
+            compiled += optimize_program(program)[1]
+        print('  after otto.dispense: {:.0f} mm ({:.1f} s) more'.format(
+              compiled, compiled / SPEED))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,277 @@
+'''Multi-plate batch executor.
+
+    python -m otto.plates -n 6
+
+HTS_compound_dilution_6plates does one plate at a time: a tip, eleven
+transfer(100, ...) calls from that plate's own DMSO trough, the dilution,
+the next plate. plan_plates() takes a routine for one plate and the plates
+to do it on and plans all of them together instead:
+
+    plan = plan_plates(plates, compound_dilution, dmso_troughs)
+    run_plan(plan, pipette)        # otto.dilutions
+
+A routine returns what the plate needs of the shared reagent, as (well,
+volume) dispenses, and the ops that follow with the plate's own tip (an
+otto.dilutions plan block). The reagent dispenses of every plate are put
+in one route, plate after plate with each plate's columns run in the
+direction that starts nearest, and packed into full tips with a disposal
+volume on top, so one aspiration feeds columns of more than one plate.
+Troughs of the same reagent are taken as one pool, every trip drawing on
+the one with the most of its plates' share left and topping up from the
+next when that runs out, so no trough gives more than its own plates
+take. The fill tip only ever touches reagent and goes on to the plate the
+fill ended on; the other plates follow in the order with the least travel.
+
+plan_loop() is the one plate at a time version, for comparison.
+'''
+
+import argparse
+import sys
+
+from otto.dispense import compile_steps
+from otto.labware import CUSTOM_LABWARE
+
+CHANNELS = 8
+
+
+def compound_dilution(plate, volume=100, columns=11, mix=(5, None)):
+    '''The HTS_compound_dilution routine: volume µL of reagent into the
+    columns after the first, then a 1:2 series along them from column 1,
+    mixing with the transfer volume unless mix says otherwise.'''
+    row = plate.rows()[0]
+    lane = row[:columns + 1]
+    fills = [(well, volume) for well in lane[1:]]
+    work = []
+    for source, dest in zip(lane, lane[1:]):
+        work.append(('aspirate', volume, source))
+        work.append(('dispense', volume, dest))
+        if mix:
+            work.append(('mix', mix[0], mix[1] or volume, dest))
+    return fills, work
+
+
+def _sources(reagent, count):
+    if isinstance(reagent, (list, tuple)):
+        if len(reagent) < count:
+            raise ValueError('{} plates but {} reagent wells given'.format(
+                             count, len(reagent)))
+        return list(reagent[:count])
+    return [reagent] * count
+
+
+def _route(jobs, start):
+    '''Plate order and fill direction for one pass over all the plates.'''
+    from otto.paths import best_order, distance, position
+
+    order = best_order([fills[0][0] for fills, work in jobs], start=start)
+    here = position(start)
+    route = []
+    for i in order:
+        fills = jobs[i][0]
+        if distance(here, position(fills[-1][0])) < distance(
+                here, position(fills[0][0])):
+            fills = fills[::-1]
+        route.extend(fills)
+        here = position(fills[-1][0])
+    return order, route
+
+
+def _trips(route, max_volume, disposal_volume):
+    room = max_volume - disposal_volume
+    if room <= 0:
+        raise ValueError('disposal volume leaves no room in the tip')
+    trips, trip = [], []
+    for well, volume in route:
+        if volume > room + 1e-9:
+            raise ValueError('{:g} µL into {} does not fit a tip'.format(
+                             volume, well))
+        if trip and sum(v for w, v in trip) + volume > room + 1e-9:
+            trips.append(trip)
+            trip = []
+        trip.append((well, volume))
+    if trip:
+        trips.append(trip)
+    return trips
+
+
+def _draw(pool, volume):
+    '''[(source, volume)] taking volume from the pool, the fullest first,
+    never more than a source's share.'''
+    taken = []
+    while volume > 1e-9:
+        entry = max(pool, key=lambda e: e[1])
+        if entry[1] <= 1e-9:
+            raise ValueError('the reagent wells are short of what the plates '
+                             'need')
+        take = min(volume, entry[1])
+        entry[1] -= take
+        volume -= take
+        taken.append((entry[0], take))
+    return taken
+
+
+def _fill_trip(trip, pool, disposal_volume):
+    '''Ops of one fill trip, aspirating from as many sources as it takes.
+
+    The disposal volume comes with the last aspiration and goes back
+    there; a single dispense goes without, as in otto.dispense.
+    '''
+    taken = _draw(pool, sum(volume for well, volume in trip))
+    disposal = disposal_volume if len(trip) > 1 else 0
+    ops = [('aspirate', volume, source) for source, volume in taken]
+    ops[-1] = ('aspirate', taken[-1][1] + disposal, taken[-1][0])
+    ops += [('dispense', volume, well) for well, volume in trip]
+    if disposal:
+        ops.append(('blow_out', taken[-1][0]))
+    return ops
+
+
+def plan_plates(plates, routine=compound_dilution, reagent=None,
+                max_volume=300, disposal_volume=20, channels=CHANNELS):
+    '''Blocks of (tips, ops) doing routine on every plate, fills shared.
+
+    reagent is one well or a list, one per plate, of the same reagent.
+    disposal_volume goes on top of every multi-dispense aspiration and
+    back into the source, by default a p300's min volume like the API's
+    distribute().
+    '''
+    from otto.paths import best_order
+
+    jobs = [routine(plate) for plate in plates]
+    sources = _sources(reagent, len(plates))
+    pool = []
+    for source, (fills, work) in zip(sources, jobs):
+        share = sum(volume for well, volume in fills)
+        for entry in pool:
+            if entry[0] is source:
+                entry[1] += share
+                break
+        else:
+            pool.append([source, share])
+    order, route = _route(jobs, sources[0])
+    fill = []
+    for trip in _trips(route, max_volume, disposal_volume):
+        fill += _fill_trip(trip, pool, disposal_volume)
+    # the fill tip goes on with the plate the fill ended on
+    first = order[-1]
+    rest = [i for i in range(len(plates)) if i != first]
+    rest = [rest[i] for i in best_order(
+        [jobs[i][0][0][0] for i in rest], start=jobs[first][0][0][0])]
+    plan = [(channels, fill + jobs[first][1])]
+    plan += [(channels, jobs[i][1]) for i in rest]
+    return plan
+
+
+def plan_loop(plates, routine=compound_dilution, reagent=None,
+              max_volume=300, channels=CHANNELS):
+    '''One plate at a time, one aspiration per dispense from its own
+    reagent well, like the protocols' for loop.'''
+    plan = []
+    for plate, source in zip(plates, _sources(reagent, len(plates))):
+        fills, work = routine(plate)
+        ops = []
+        for well, volume in fills:
+            ops += compile_steps([(source, well, volume)], max_volume)[0][1]
+        plan.append((channels, ops + work))
+    return plan
+
+
+def draws(plan, sources):
+    '''µL per channel taken from each of sources, {well: volume}, less
+    what is blown back into it.'''
+    drawn = {source: 0.0 for source in sources}
+    held = 0.0
+    for tips, ops in plan:
+        for op in ops:
+            if op[0] == 'aspirate':
+                held += op[1]
+                if op[2] in drawn:
+                    drawn[op[2]] += op[1]
+            elif op[0] == 'dispense':
+                held -= op[1]
+            elif op[0] == 'blow_out':
+                if op[1] in drawn:
+                    drawn[op[1]] -= held
+                held = 0.0
+    return drawn
+
+
+def _deck(count, timing, labware_dir):
+    from otto.recording import RecordingContext
+
+    if not 1 <= count <= 6:
+        raise ValueError('plates go on slots 1-6, not {}'.format(count))
+    ctx = RecordingContext(labware_dir=labware_dir, timing=timing)
+    plates = [ctx.load_labware('costar_96_wellplate_200ul', slot)
+              for slot in range(1, count + 1)]
+    trough = ctx.load_labware('nest_12_reservoir_15ml', '8')
+    racks = [ctx.load_labware('opentrons_96_tiprack_300ul', '7')]
+    pipette = ctx.load_instrument('p300_multi_gen2', 'left',
+                                  tip_racks=racks)
+    return ctx, plates, trough.wells()[:count], pipette
+
+
+def main(argv=None):
+    from otto.diff import compare, well_key
+    from otto.dilutions import run_plan, summary
+    from otto.runtime import TimeModel, clock
+
+    parser = argparse.ArgumentParser(
+        description='HTS compound dilution on several plates at once '
+                    'against one plate at a time.')
+    parser.add_argument('-n', '--plates', type=int, default=6)
+    parser.add_argument('-v', '--volume', type=float, default=100,
+                        help='µL of DMSO per well and per transfer')
+    parser.add_argument('--columns', type=int, default=11,
+                        help='dilution steps after column 1')
+    parser.add_argument('-d', '--disposal', type=float,
+                        help="µL extra per multi-dispense aspiration "
+                             "(default the pipette's min volume)")
+    parser.add_argument('-L', '--labware', default=CUSTOM_LABWARE)
+    args = parser.parse_args(argv)
+
+    def routine(plate):
+        return compound_dilution(plate, args.volume, args.columns)
+
+    runs = []
+    for mode in ('batched', 'one at a time'):
+        ctx, plates, troughs, pipette = _deck(args.plates, TimeModel(),
+                                              args.labware)
+        if mode == 'batched':
+            disposal = args.disposal
+            if disposal is None:
+                disposal = pipette.min_volume
+            plan = plan_plates(plates, routine, troughs,
+                               pipette.max_volume, disposal)
+        else:
+            plan = plan_loop(plates, routine, troughs)
+        run_plan(plan, pipette)
+        runs.append((mode, ctx, plan, troughs))
+    print('{} plates, {:g} µL, {} dilution steps'.format(
+          args.plates, args.volume, args.columns))
+    result = compare(runs[1][1], runs[0][1])
+    for (mode, ctx, plan, troughs), distance in zip(
+            runs, result['travel'][::-1]):
+        numbers = summary(plan)
+        print('  {:<13} {} tips, {} aspirations, {:.0f} mm, {}, {:.1f} '
+              'plates/h'.format(mode, numbers['tips'],
+                                numbers['aspirations'], distance,
+                                clock(ctx.clock),
+                                args.plates / ctx.clock * 3600))
+        print('    draws {}'.format(', '.join(
+              '{} {:g}'.format(well.well_name, volume)
+              for well, volume in draws(plan, troughs).items())))
+    # the troughs are one pool, only the plates have to come out the same
+    pooled = {well_key(well) for well in runs[0][3]}
+    changed = [c for c in result['volumes'] if c[0] not in pooled]
+    if changed:
+        print('  final volumes: {} plate well(s) differ'.format(
+              len(changed)))
+        return 1
+    print('  final volumes: same in all {} plate wells'.format(
+          result['wells'][0] - len(pooled)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
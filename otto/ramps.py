@@ -0,0 +1,179 @@
+'''Temperature module pre-ramp planner.
+
+    python -m otto.ramps shawn_scripts/production/rna_refolding/rna_refolding.py
+
+tempdeck.set_temperature() blocks until the block is at temperature, so
+every ramp in a protocol is dead time. From a timed dry run (otto.runtime)
+this works out, for every set_temperature(), where to issue
+start_set_temperature() instead so the block arrives just as it is needed,
+and where the matching await_temperature() goes. The ramp is then hidden
+behind whatever pipetting happens in between.
+
+The block is needed at its old temperature until the last command before
+the set that uses it, and at the new one from the first command after the
+set that uses it. With --needed touch (the default) any pipetting into the
+module's labware uses the block, with --needed wait only delays and
+incubate() waits do, for protocols that don't mind adding reagents while
+the block is still ramping.
+'''
+
+import argparse
+import linecache
+import sys
+
+from otto.labware import CUSTOM_LABWARE
+from otto.runtime import COOL_RATE, HEAT_RATE, Block, clock
+
+WAITS = ('delay', 'sleep', 'pause')
+TEMPERATURE = ('set_temperature', 'start_set_temperature',
+               'await_temperature', 'deactivate')
+
+
+def _uses(command, module, needed):
+    if command.name in WAITS:
+        return True
+    if needed == 'touch' and command.well is not None:
+        return getattr(command.well, 'parent', None) is module.labware
+    return False
+
+
+def block_at(commands, module, t):
+    '''Modelled temperature of module at time t of a timed run.'''
+    block = Block()
+    for command in commands:
+        if command.start > t:
+            break
+        if command.target is not module:
+            continue
+        if command.name in ('set_temperature', 'start_set_temperature'):
+            block.set(command.start, command.value)
+        elif command.name == 'deactivate':
+            block.set(command.start, None)
+    return block.now(t)
+
+
+def plan_ramps(ctx, needed='touch'):
+    '''One entry per set_temperature() of a timed run, see otto.runtime.
+
+    Each entry has the set command, the command to issue
+    start_set_temperature() before, the command to await before, the
+    modelled ramp and the seconds saved.
+    '''
+    commands = ctx.commands
+    plans = []
+    for i, command in enumerate(commands):
+        if command.name != 'set_temperature':
+            continue
+        module = command.target
+        # last use of the old temperature, or the last temperature change;
+        # waits only use the block while it holds a temperature
+        first = 0
+        holding = False
+        for j in range(i - 1, -1, -1):
+            other = commands[j]
+            if other.target is module and other.name in TEMPERATURE + (
+                    'load_module',):
+                holding = other.name in ('set_temperature',
+                                         'start_set_temperature')
+                first = j + 1
+                break
+        for j in range(i - 1, first - 1, -1):
+            other = commands[j]
+            if other.name in WAITS and not holding:
+                continue
+            if _uses(other, module, needed):
+                first = j + 1
+                break
+        # first use of the new temperature
+        last = len(commands)
+        for j in range(i + 1, len(commands)):
+            other = commands[j]
+            if _uses(other, module, needed) or (
+                    other.target is module and other.name in TEMPERATURE):
+                last = j
+                break
+        work = [commands[j] for j in range(first, last) if j != i]
+        hideable = sum(other.duration for other in work)
+        start = commands[first].start if first < len(commands) else (
+                command.start)
+        temp = block_at(commands, module, start)
+        ramp_time = abs(command.value - temp) / (
+                    HEAT_RATE if command.value > temp else COOL_RATE)
+        # issue once only ramp_time of work is left before the use
+        issue = command
+        left = hideable
+        for other in work:
+            if left <= ramp_time:
+                issue = other
+                break
+            left -= other.duration
+        wait = max(0.0, ramp_time - hideable)
+        plans.append({
+            'set': command,
+            'module': module,
+            'target': command.value,
+            'ramp': ramp_time,
+            'issue': issue,
+            'await': commands[last] if last < len(commands) else None,
+            'hidden': min(ramp_time, hideable),
+            'saved': max(0.0, command.duration - wait),
+        })
+    return plans
+
+
+def _where(ctx, command):
+    if command is None:
+        return 'the end of the run'
+    if not command.line:
+        return 'step {}'.format(command.step)
+    return 'line {} ({})'.format(command.line, linecache.getline(
+        ctx.source, command.line).strip())
+
+
+def report(path, ctx, needed='touch'):
+    lines = [path]
+    total = 0.0
+    for plan in plan_ramps(ctx, needed):
+        command = plan['set']
+        lines.append('  line {}: {} -> {} C, {} blocking'.format(
+                     command.line, plan['module'], plan['target'],
+                     clock(command.duration)))
+        if plan['saved'] < 1:
+            lines.append('    nothing to hide it behind')
+            continue
+        total += plan['saved']
+        lines.append('    start_set_temperature({}) before {}'.format(
+                     plan['target'], _where(ctx, plan['issue'])))
+        lines.append('    await_temperature({}) before {}'.format(
+                     plan['target'], _where(ctx, plan['await'])))
+        lines.append('    saves {}'.format(clock(plan['saved'])))
+    lines.append('  total saved: {} of {}'.format(clock(total),
+                                                   clock(ctx.clock)))
+    if ctx.error is not None:
+        lines.append('  protocol failed at line {}: {!r}'.format(
+                     ctx.error_line, ctx.error))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    from otto.budget import parse_params
+    from otto.runtime import estimate
+
+    parser = argparse.ArgumentParser(
+        description='Where to start temperature ramps early.')
+    parser.add_argument('protocol', nargs='+')
+    parser.add_argument('-p', '--param', action='append',
+                        help='parameter override, name=value')
+    parser.add_argument('-L', '--labware', default=CUSTOM_LABWARE)
+    parser.add_argument('--needed', choices=('touch', 'wait'),
+                        default='touch',
+                        help='what needs the block at temperature')
+    args = parser.parse_args(argv)
+    for path in args.protocol:
+        ctx = estimate(path, parse_params(args.param), args.labware)
+        print(report(path, ctx, args.needed))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,128 @@
+'''Reagent loading sheet for a protocol and parameter set.
+
+    python -m otto.reagents shawn_scripts/production/crosslinking/crosslinking_multi.py -p num_samples=12
+
+Replays the run through an otto.volumes ledger with every well starting
+empty; the deepest a well goes below zero is what the operator has to put
+in it. Wells that are filled by the robot before they are drawn from
+(mixes, dilution series) need nothing. Each source gets the dead volume
+of its labware on top, rounded up, and is checked against what the
+protocol declares with load_liquid() and what the well holds.
+'''
+
+import argparse
+import math
+import sys
+
+import numpy as np
+
+from otto.labware import CUSTOM_LABWARE
+
+# volume left behind in a well the pipette can't get at, µL
+DEAD_VOLUME = {
+    'nest_12_reservoir_15ml': 1000,
+    'axygen_12_reservoir_5000ul': 500,
+    'opentrons_6_tuberack_falcon_50ml_conical': 2000,
+    'opentrons_15_tuberack_falcon_15ml_conical': 1000,
+    'opentrons_24_tuberack_eppendorf_1.5ml_safelock_snapcap': 20,
+    'opentrons_24_aluminumblock_nest_1.5ml_snapcap': 20,
+    'nest_96_wellplate_2ml_deep': 50,
+    'costar_96_wellplate_200ul': 10,
+    'opentrons_96_aluminumblock_generic_pcr_strip_200ul': 5,
+    'opentrons_96_aluminumblock_nest_wellplate_100ul': 5,
+    'corning3575_384well_alt': 5,
+}
+DEAD_FRACTION = 0.05   # of the well, for labware not listed
+
+
+def dead_volume(well):
+    dead = DEAD_VOLUME.get(well.parent.load_name)
+    if dead is None:
+        dead = well.max_volume * DEAD_FRACTION
+    return dead
+
+
+def round_up(volume):
+    '''Up to a volume you can pipette by hand: 10 µL, 100 µL or 0.5 mL.'''
+    step = 10 if volume < 1000 else 100 if volume < 5000 else 500
+    return int(math.ceil(volume / step - 1e-9) * step)
+
+
+def loading_sheet(ctx):
+    '''One entry per well the operator has to fill, in deck order.'''
+    from otto.volumes import Ledger
+
+    ledger = Ledger.from_run(ctx, liquids=False)
+    sheet = []
+    for labware in ledger.labware:
+        low = ledger.low[id(labware)]
+        wells = labware.wells()
+        for i in np.flatnonzero(low < -1e-6):
+            well = wells[i]
+            used = float(-low[i])
+            dead = dead_volume(well)
+            declared = sum(v for liquid, v in well.liquids)
+            sheet.append({
+                'well': well,
+                'liquid': ', '.join(liquid.name for liquid, v in well.liquids
+                                    if liquid is not None) or None,
+                'used': used,
+                'dead': dead,
+                'load': round_up(used + dead),
+                'declared': declared if well.liquids else None,
+                'max_volume': well.max_volume,
+            })
+    sheet.sort(key=lambda e: (str(e['well'].parent.parent),
+                              e['well'].parent.load_name, e['well'].index))
+    return sheet
+
+
+def report(path, ctx):
+    lines = [path]
+    current = None
+    for entry in loading_sheet(ctx):
+        well = entry['well']
+        if well.parent is not current:
+            current = well.parent
+            lines.append('  {}'.format(current))
+        notes = []
+        if entry['load'] > entry['max_volume']:
+            notes.append('more than the {:g} µL well holds'.format(
+                         entry['max_volume']))
+        if entry['declared'] is not None:
+            if entry['declared'] < entry['used'] + entry['dead']:
+                notes.append('load_liquid() says {:g}, runs dry'.format(
+                             entry['declared']))
+            elif entry['declared'] > entry['load'] * 1.5:
+                notes.append('load_liquid() says {:g}'.format(
+                             entry['declared']))
+        lines.append('    {:<4} {:<20} load {:>6} µL  (uses {:.1f} + {:g} '
+                     'dead){}'.format(
+                         well.well_name, (entry['liquid'] or '')[:20],
+                         entry['load'], entry['used'], entry['dead'],
+                         '  ! ' + '; '.join(notes) if notes else ''))
+    if ctx.error is not None:
+        lines.append('  protocol failed at line {}: {!r}'.format(
+                     ctx.error_line, ctx.error))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    from otto.budget import parse_params
+    from otto.recording import record
+
+    parser = argparse.ArgumentParser(
+        description='What to load where, and how much, for a run.')
+    parser.add_argument('protocol', nargs='+')
+    parser.add_argument('-p', '--param', action='append',
+                        help='parameter override, name=value')
+    parser.add_argument('-L', '--labware', default=CUSTOM_LABWARE)
+    args = parser.parse_args(argv)
+    for path in args.protocol:
+        ctx = record(path, parse_params(args.param), args.labware)
+        print(report(path, ctx))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
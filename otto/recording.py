@@ -0,0 +1,981 @@
+'''Recording stand-in for the protocol context.
+
+RecordingContext can be passed to any run(protocol) in this repo. It keeps
+track of labware, tips and pipette contents the way the robot would and
+records every call as a Command instead of moving anything, which makes a
+dry run of a protocol take a fraction of a second:
+
+    ctx = record('shawn_scripts/production/bca/pierce_bca.py',
+                 params={'num_samples': 12})
+    for command in ctx.commands:
+        ...
+
+Protocol errors (bad indexes, out of range volumes) do not propagate; they
+end up in ctx.error with the protocol line they came from.
+'''
+
+import contextlib
+import importlib.util
+import io
+import math
+import os
+import sys
+import time
+import traceback
+from collections import namedtuple
+
+from otto.geometry import index
+from otto.labware import CUSTOM_LABWARE, load_definition
+
+
+# channels, min volume, max volume, default flow rate (µL/s)
+PIPETTES = {
+    'p20_single_gen2': (1, 1, 20, 7.56),
+    'p20_multi_gen2': (8, 1, 20, 7.6),
+    'p300_single_gen2': (1, 20, 300, 92.86),
+    'p300_multi_gen2': (8, 20, 300, 94),
+    'p1000_single_gen2': (1, 100, 1000, 274.7),
+}
+
+# labware origin on top of a module, relative to the slot
+MODULES = {
+    'temperature module gen2': (-1.45, -0.15, 80.09),
+    'temperature module': (-0.15, -0.15, 80.09),
+    'magnetic module gen2': (-1.175, -0.125, 82.25),
+    'magnetic module': (0.125, -0.125, 82.25),
+}
+
+TRASH = {
+    'parameters': {'loadName': 'fixed_trash', 'isTiprack': False},
+    'ordering': [['A1']],
+    'cornerOffsetFromSlot': {'x': 0, 'y': 0, 'z': 0},
+    'dimensions': {'xDimension': 172.86, 'yDimension': 165.86,
+                   'zDimension': 82},
+    'wells': {'A1': {'depth': 58, 'shape': 'rectangular', 'x': 82.84,
+                     'y': 80, 'z': 24, 'xDimension': 107.11,
+                     'yDimension': 165.67, 'totalLiquidVolume': 1100000}},
+}
+
+
+def slot_origin(slot):
+    slot = int(slot)
+    return ((slot-1) % 3 * 132.5, (slot-1) // 3 * 90.5, 0.0)
+
+
+class Point(namedtuple('Point', 'x y z')):
+    def __add__(self, other):
+        return Point(self.x + other.x, self.y + other.y, self.z + other.z)
+
+
+class Location:
+    def __init__(self, point, labware):
+        self.point = point
+        self.labware = labware
+
+    def move(self, point):
+        return Location(self.point + point, self.labware)
+
+    def __repr__(self):
+        return 'Location({}, {})'.format(tuple(self.point), self.labware)
+
+
+class Well:
+    def __init__(self, labware, name, index, spec, origin):
+        self.parent = labware
+        self.well_name = name
+        self.index = index
+        self.depth = spec['depth']
+        self.max_volume = spec['totalLiquidVolume']
+        self.diameter = spec.get('diameter')
+        self.width = spec.get('xDimension', self.diameter)
+        self.length = spec.get('yDimension', self.diameter)
+        self.bottom_point = Point(origin[0] + spec['x'], origin[1] + spec['y'],
+                                  origin[2] + spec['z'])
+        self.liquids = []
+
+    @property
+    def display_name(self):
+        return '{} of {}'.format(self.well_name, self.parent)
+
+    @property
+    def has_tip(self):
+        return self.parent.tips[self.index]
+
+    def top(self, z=0.0):
+        return Location(self.bottom_point + Point(0, 0, self.depth + z), self)
+
+    def bottom(self, z=0.0):
+        return Location(self.bottom_point + Point(0, 0, z), self)
+
+    def center(self):
+        return Location(self.bottom_point + Point(0, 0, self.depth/2), self)
+
+    def load_liquid(self, liquid, volume):
+        self.liquids.append((liquid, volume))
+
+    def __repr__(self):
+        return self.display_name
+
+
+def _pick(by_name, ordered, names):
+    '''What wells()/rows()/columns() give for names: all of ordered, or
+    the items at int indexes, or by name, never a mix, like the API.'''
+    if not names:
+        return ordered
+    if all(isinstance(name, int) for name in names):
+        return [ordered[name] for name in names]
+    if all(isinstance(name, str) for name in names):
+        return [by_name[name] for name in names]
+    raise TypeError('wells, rows and columns take all ints or all strs, '
+                    'not {}'.format(names))
+
+
+class Labware:
+    def __init__(self, definition, parent, origin, virtual=False):
+        self.definition = definition
+        self.load_name = definition['parameters']['loadName']
+        self.name = self.load_name
+        self.parent = parent
+        self.virtual = virtual
+        self.origin = origin
+        self.is_tiprack = definition['parameters'].get('isTiprack', False)
+        self.geometry = index(definition)
+        corner = definition['cornerOffsetFromSlot']
+        origin = (origin[0] + corner['x'], origin[1] + corner['y'],
+                  origin[2] + corner['z'])
+        self._columns = []
+        self._wells = []
+        for column in definition['ordering']:
+            self._columns.append([])
+            for name in column:
+                well = Well(self, name, len(self._wells),
+                            definition['wells'][name], origin)
+                self._wells.append(well)
+                self._columns[-1].append(well)
+        self._by_name = {well.well_name: well for well in self._wells}
+        row_names = sorted({name[0] for name in self._by_name})
+        self._rows = [[well for well in self._wells if well.well_name[0] == r]
+                      for r in row_names]
+        self._row_names = row_names
+        self.tips = [self.is_tiprack] * len(self._wells)
+        self.tip_volume = self._wells[0].max_volume if self.is_tiprack else 0
+
+    def wells(self, *names):
+        return _pick(self.wells_by_name(), list(self._wells), names)
+
+    def rows(self, *names):
+        return _pick(self.rows_by_name(), [list(r) for r in self._rows],
+                     names)
+
+    def columns(self, *names):
+        return _pick(self.columns_by_name(),
+                     [list(column) for column in self._columns], names)
+
+    def wells_by_name(self):
+        return dict(self._by_name)
+
+    def rows_by_name(self):
+        return {r: list(row) for r, row in zip(self._row_names, self._rows)}
+
+    def columns_by_name(self):
+        return {column[0].well_name[1:]: list(column)
+                for column in self._columns}
+
+    def well(self, idx):
+        return self[idx] if isinstance(idx, str) else self._wells[idx]
+
+    def __getitem__(self, name):
+        return self._by_name[name]
+
+    def well_at(self, x, y):
+        '''The well whose opening x, y falls in, or None.'''
+        found = self.geometry.at(x - self.origin[0], y - self.origin[1])
+        return self._wells[found] if found >= 0 else None
+
+    def reset(self):
+        self.tips = [self.is_tiprack] * len(self._wells)
+
+    def set_offset(self, x, y, z):
+        pass
+
+    def __repr__(self):
+        return '{} on {}'.format(self.load_name, self.parent)
+
+
+class Liquid:
+    def __init__(self, name, description=None, display_color=None):
+        self.name = name
+        self.description = description
+        self.display_color = display_color
+
+
+class Command:
+    '''One recorded call. Unused fields stay None.'''
+
+    __slots__ = ('step', 'name', 'pipette', 'volume', 'well', 'point',
+                 'tips', 'value', 'target', 'line', 'group', 'func', 'stage',
+                 'rate', 'start', 'duration')
+
+    def __init__(self, step, name, pipette=None, volume=None, well=None,
+                 point=None, tips=None, value=None, target=None, line=None,
+                 group=None, func=None, stage=None, rate=None):
+        self.step = step
+        self.name = name
+        self.pipette = pipette
+        self.volume = volume
+        self.well = well
+        self.point = point
+        self.tips = tips
+        self.value = value
+        self.target = target
+        self.line = line
+        self.group = group
+        self.func = func
+        self.stage = stage
+        self.rate = rate
+        self.start = 0.0
+        self.duration = 0.0
+
+    def __repr__(self):
+        where = ' {}'.format(self.well) if self.well is not None else ''
+        vol = ' {:g}µL'.format(self.volume) if self.volume is not None else ''
+        return '{} {}{}{}'.format(self.step, self.name, vol, where)
+
+
+class FlowRates:
+    def __init__(self, rate):
+        self.aspirate = rate
+        self.dispense = rate
+        self.blow_out = rate
+
+
+class Clearances:
+    def __init__(self):
+        self.aspirate = 1.0
+        self.dispense = 1.0
+
+
+def _as_location(location):
+    if isinstance(location, Well):
+        return location.top()
+    return location
+
+
+def _well_of(location):
+    if isinstance(location, Well):
+        return location
+    if isinstance(location, Location):
+        return location.labware
+    return None
+
+
+def _flatten(wells):
+    if isinstance(wells, (list, tuple)):
+        flat = []
+        for item in wells:
+            flat.extend(_flatten(item))
+        return flat
+    return [wells]
+
+
+class Pipette:
+    def __init__(self, ctx, name, mount, tip_racks):
+        self._ctx = ctx
+        self.name = name
+        self.mount = mount
+        self.tip_racks = list(tip_racks or [])
+        channels, min_volume, max_volume, rate = PIPETTES[name]
+        self.channels = channels
+        self.min_volume = min_volume
+        self._max_volume = max_volume
+        self.flow_rate = FlowRates(rate)
+        self.well_bottom_clearance = Clearances()
+        self.default_speed = 400.0
+        self.current_volume = 0.0
+        self.tips = 0
+        self.tip_rack = None
+        self.virtual_racks = []
+        self._tip_well = None
+        self._under = {}
+        self._location = None
+        self._group = None
+
+    @property
+    def has_tip(self):
+        return self.tips > 0
+
+    @property
+    def max_volume(self):
+        if self.tip_rack is not None and self.tip_rack.tip_volume:
+            return min(self._max_volume, self.tip_rack.tip_volume)
+        return self._max_volume
+
+    @property
+    def trash_container(self):
+        return self._ctx.fixed_trash
+
+    @property
+    def hw_pipette(self):
+        return {'channels': self.channels, 'max_volume': self.max_volume}
+
+    def _record(self, name, volume=None, location=None, value=None,
+                rate=None):
+        if location is not None:
+            self._location = location
+        else:
+            location = self._location
+        well = _well_of(location)
+        point = location.point if isinstance(location, Location) else (
+            location.top().point if isinstance(location, Well) else None)
+        return self._ctx._record(name, pipette=self, volume=volume, well=well,
+                                 point=point, tips=self.tips, value=value,
+                                 group=self._group, rate=rate)
+
+    def wells_under(self, well, tips=None):
+        '''Wells under the nozzles carrying tips when the A nozzle is at well.
+
+        A multichannel going into a reservoir lists the trough once per tip.
+        On labware with the centerMultichannelOnWells quirk (the
+        reservoirs) the API centres the nozzles on the well instead of the
+        A nozzle.
+        '''
+        tips = self.tips if tips is None else tips
+        if self.channels == 1 or tips <= 1 or not isinstance(well, Well):
+            return [well]
+        key = (id(well), tips)
+        if key not in self._under:
+            x, y = well.bottom_point.x, well.bottom_point.y
+            quirks = well.parent.definition['parameters'].get('quirks', [])
+            if 'centerMultichannelOnWells' in quirks:
+                y += 9.0 * (self.channels - 1) / 2
+            found = [well.parent.well_at(x, y - 9.0*k) for k in range(tips)]
+            self._under[key] = [w for w in found if w is not None]
+        return self._under[key]
+
+    # tips
+
+    def _column_tips(self, rack, well):
+        # wells under the nozzles when the A nozzle goes to well
+        column = rack._columns[int(well.well_name[1:]) - 1]
+        row = column.index(well)
+        return column[row:row + self.channels]
+
+    def _next_tip(self, racks):
+        need = self.channels
+        for rack in racks:
+            for column in rack._columns:
+                for row in range(0, len(column) - need + 1):
+                    if all(rack.tips[w.index] for w in column[row:row+need]):
+                        return rack, column[row]
+        return None, None
+
+    def pick_up_tip(self, location=None, presses=None, increment=None,
+                    prep_after=None):
+        if self.has_tip:
+            raise RuntimeError('{} already has a tip'.format(self.name))
+        if location is None or isinstance(location, Labware):
+            racks = [location] if location is not None else self.tip_racks
+            if not racks:
+                raise RuntimeError('{} has no tip_racks'.format(self.name))
+            rack, well = self._next_tip(racks + self.virtual_racks)
+            if rack is None:
+                # out of tips, keep counting on a rack that is not there
+                first = racks[0]
+                rack = Labware(first.definition, first.parent, first.origin,
+                               virtual=True)
+                self.virtual_racks.append(rack)
+                rack, well = self._next_tip([rack])
+                self._ctx._shortage(self, self.channels)
+        else:
+            well = _well_of(location)
+            rack = well.parent
+        # nozzles over already used rows just come up empty, that is how
+        # the protocols do partial pickups; only an empty A nozzle is a miss
+        wells = self._column_tips(rack, well)
+        picked = sum(1 for w in wells if rack.tips[w.index])
+        if not rack.tips[well.index]:
+            self._ctx._shortage(self, 1)
+            picked = max(picked, 1)
+        for w in wells:
+            rack.tips[w.index] = False
+        self.tips = picked
+        self.tip_rack = rack
+        self._tip_well = well
+        self._record('pick_up_tip', location=well.top())
+        return self
+
+    def drop_tip(self, location=None, home_after=None):
+        self._record('drop_tip', volume=self.current_volume,
+                     location=location or self._ctx.fixed_trash['A1'].top())
+        self.tips = 0
+        self.current_volume = 0.0
+        return self
+
+    def return_tip(self, home_after=None):
+        # return_tip only tracks the last tip, so put it back as one column
+        well = self._tip_well
+        self._record('return_tip', volume=self.current_volume,
+                     location=well.top())
+        for w in self._column_tips(well.parent, well):
+            well.parent.tips[w.index] = True
+        self.tips = 0
+        self.current_volume = 0.0
+        return self
+
+    # liquid handling
+
+    def _default_location(self, location, clearance):
+        if isinstance(location, Well):
+            return location.bottom(clearance)
+        return location
+
+    def aspirate(self, volume=None, location=None, rate=1.0):
+        if not self.has_tip:
+            raise RuntimeError('{} cannot aspirate without a tip'.format(
+                               self.name))
+        if volume is None or volume == 0:
+            volume = self.max_volume - self.current_volume
+        if self.current_volume + volume > self.max_volume + 1e-6:
+            raise ValueError('cannot aspirate {}µL with {}µL already in a '
+                             '{}µL tip'.format(volume, self.current_volume,
+                                               self.max_volume))
+        location = self._default_location(location,
+                                          self.well_bottom_clearance.aspirate)
+        self.current_volume += volume
+        self._record('aspirate', volume, location,
+                     rate=self.flow_rate.aspirate * rate)
+        return self
+
+    def dispense(self, volume=None, location=None, rate=1.0, push_out=None):
+        if volume is None or volume == 0:
+            volume = self.current_volume
+        volume = min(volume, self.current_volume)
+        location = self._default_location(location,
+                                          self.well_bottom_clearance.dispense)
+        self.current_volume -= volume
+        self._record('dispense', volume, location,
+                     rate=self.flow_rate.dispense * rate)
+        return self
+
+    def blow_out(self, location=None):
+        self._record('blow_out', self.current_volume, _as_location(location),
+                     rate=self.flow_rate.blow_out)
+        self.current_volume = 0.0
+        return self
+
+    def touch_tip(self, location=None, radius=1.0, v_offset=-1.0,
+                  speed=60.0):
+        self._record('touch_tip', location=_as_location(location))
+        return self
+
+    def mix(self, repetitions=1, volume=None, location=None, rate=1.0):
+        if volume is None or volume == 0:
+            volume = self.max_volume
+        location = self._default_location(location,
+                                          self.well_bottom_clearance.aspirate)
+        # one aspirate and dispense cycle moves volume at this rate
+        cycle = 1 / (1 / self.flow_rate.aspirate + 1 / self.flow_rate.dispense)
+        self._record('mix', volume, location, value=repetitions,
+                     rate=cycle * rate)
+        return self
+
+    def air_gap(self, volume=None, height=None):
+        self._record('air_gap', volume)
+        return self
+
+    def move_to(self, location, force_direct=False, minimum_z_height=None,
+                speed=None, publish=True):
+        self._record('move_to', location=_as_location(location))
+        return self
+
+    def home(self):
+        self._ctx._record('home', pipette=self)
+        return self
+
+    # complex commands, planned like the opentrons transfer planner
+
+    def transfer(self, volume, source, dest, trash=True, **kwargs):
+        return self._complex('transfer', volume, source, dest, trash=trash,
+                             **kwargs)
+
+    def distribute(self, volume, source, dest, *args, **kwargs):
+        kwargs.setdefault('disposal_volume', self.min_volume)
+        return self._complex('distribute', volume, source, dest, **kwargs)
+
+    def consolidate(self, volume, source, dest, *args, **kwargs):
+        return self._complex('consolidate', volume, source, dest, **kwargs)
+
+    def _first_rows(self, wells):
+        '''What a multichannel keeps of a well list, like the API's
+        TransferPlan: wells the A nozzle goes to, the first row (the first
+        two on a 384). A single well is left alone.'''
+        if self.channels == 1 or len(wells) < 2:
+            return wells
+        kept = []
+        for well in wells:
+            if isinstance(well, Well) and well.parent is not None:
+                rows = well.parent.rows()
+                first = rows[:max(1, len(rows) // self.channels)]
+                if not any(well is w for row in first for w in row):
+                    continue
+            kept.append(well)
+        return kept
+
+    def _complex(self, mode, volume, source, dest, new_tip='once',
+                 mix_before=None, mix_after=None, touch_tip=False,
+                 blow_out=False, blowout_location=None, disposal_volume=0,
+                 trash=True, **kwargs):
+        sources = self._first_rows(_flatten(source))
+        dests = self._first_rows(_flatten(dest))
+        if len(sources) == 1 and len(dests) > 1:
+            sources = sources * len(dests)
+        elif len(dests) == 1 and len(sources) > 1:
+            dests = dests * len(sources)
+        if len(sources) != len(dests):
+            raise ValueError('{} needs as many sources as destinations '
+                             '({} vs {})'.format(mode, len(sources),
+                                                 len(dests)))
+        if isinstance(volume, (list, tuple)) and len(volume) == len(dests):
+            volumes = list(volume)
+        elif isinstance(volume, tuple):
+            # (start, end) gradient
+            steps = max(len(dests) - 1, 1)
+            volumes = [volume[0] + (volume[1]-volume[0])*i/steps
+                       for i in range(len(dests))]
+        else:
+            volumes = [volume] * len(dests)
+
+        group = self._ctx._record(mode, pipette=self, volume=sum(volumes),
+                                  value=len(dests)).step
+        self._group = group
+        try:
+            if new_tip == 'once':
+                self.pick_up_tip()
+            if mode == 'distribute':
+                self._distribute(volumes, sources[0], dests, new_tip,
+                                 mix_before, touch_tip, disposal_volume,
+                                 blow_out, blowout_location)
+            elif mode == 'consolidate':
+                self._consolidate(volumes, sources, dests[0], new_tip,
+                                  mix_after, blow_out, blowout_location)
+            else:
+                self._transfer(volumes, sources, dests, new_tip, mix_before,
+                               mix_after, touch_tip, blow_out,
+                               blowout_location)
+            if new_tip == 'once':
+                self.drop_tip() if trash else self.return_tip()
+        finally:
+            self._group = None
+        return self
+
+    def _blow(self, blow_out, blowout_location, source, dest):
+        if blowout_location == 'destination well':
+            self.blow_out(dest)
+        elif blowout_location == 'source well':
+            self.blow_out(source)
+        elif blow_out or blowout_location == 'trash':
+            self.blow_out(self._ctx.fixed_trash['A1'])
+
+    def _transfer(self, volumes, sources, dests, new_tip, mix_before,
+                  mix_after, touch_tip, blow_out, blowout_location):
+        limit = self.max_volume
+        for volume, source, dest in zip(volumes, sources, dests):
+            if volume <= 0:
+                continue
+            chunks = int(math.ceil(volume / limit - 1e-9))
+            for i in range(chunks):
+                if new_tip == 'always':
+                    self.pick_up_tip()
+                if mix_before:
+                    self.mix(mix_before[0], mix_before[1], source)
+                self.aspirate(volume / chunks, source)
+                self.dispense(volume / chunks, dest)
+                if mix_after:
+                    self.mix(mix_after[0], mix_after[1], _well_of(dest))
+                if touch_tip:
+                    self.touch_tip(_well_of(dest))
+                self._blow(blow_out, blowout_location, source, dest)
+                if new_tip == 'always':
+                    self.drop_tip()
+
+    def _distribute(self, volumes, source, dests, new_tip, mix_before,
+                    touch_tip, disposal, blow_out, blowout_location):
+        limit = self.max_volume - disposal
+        pending = list(zip(volumes, dests))
+        while pending:
+            batch = []
+            total = 0
+            while pending and total + pending[0][0] <= limit + 1e-9:
+                total += pending[0][0]
+                batch.append(pending.pop(0))
+            if not batch:
+                # one dispense bigger than the tip, split it
+                volume, dest = pending.pop(0)
+                pending.insert(0, (volume - limit, dest))
+                batch, total = [(limit, dest)], limit
+            if new_tip == 'always':
+                self.pick_up_tip()
+            if mix_before:
+                self.mix(mix_before[0], mix_before[1], source)
+            self.aspirate(total + disposal, source)
+            for volume, dest in batch:
+                self.dispense(volume, dest)
+                if touch_tip:
+                    self.touch_tip(_well_of(dest))
+            if disposal or blow_out or blowout_location:
+                if blowout_location in ('destination well', 'source well'):
+                    self._blow(blow_out, blowout_location, source,
+                               batch[-1][1])
+                else:
+                    self.blow_out(self._ctx.fixed_trash['A1'])
+            if new_tip == 'always':
+                self.drop_tip()
+
+    def _consolidate(self, volumes, sources, dest, new_tip, mix_after,
+                     blow_out, blowout_location):
+        limit = self.max_volume
+        pending = list(zip(volumes, sources))
+        while pending:
+            if new_tip == 'always':
+                self.pick_up_tip()
+            total = 0
+            while pending and total + pending[0][0] <= limit + 1e-9:
+                volume, source = pending.pop(0)
+                self.aspirate(volume, source)
+                total += volume
+            if not total:
+                volume, source = pending.pop(0)
+                pending.insert(0, (volume - limit, source))
+                self.aspirate(limit, source)
+            self.dispense(self.current_volume, dest)
+            if mix_after:
+                self.mix(mix_after[0], mix_after[1], _well_of(dest))
+            self._blow(blow_out, blowout_location, None, dest)
+            if new_tip == 'always':
+                self.drop_tip()
+
+
+class Module:
+    def __init__(self, ctx, model, slot):
+        self._ctx = ctx
+        self.model = model
+        self.parent = str(slot)
+        self.labware = None
+        self.target = None
+        self.temperature = 25.0
+        self.status = 'idle'
+
+    def load_labware(self, name, label=None, namespace=None, version=None):
+        definition = self._ctx._definition(name, version)
+        x, y, z = slot_origin(self.parent)
+        dx, dy, dz = MODULES.get(self.model, (0, 0, 0))
+        self.labware = Labware(definition, self, (x+dx, y+dy, z+dz))
+        self._ctx._record('load_labware', target=self.labware)
+        return self.labware
+
+    def set_temperature(self, celsius):
+        self._ctx._record('set_temperature', value=celsius, target=self)
+        self.target = self.temperature = celsius
+        self.status = 'holding at target'
+
+    def start_set_temperature(self, celsius):
+        self._ctx._record('start_set_temperature', value=celsius, target=self)
+        self.target = celsius
+
+    def await_temperature(self, celsius):
+        self._ctx._record('await_temperature', value=celsius, target=self)
+        self.temperature = celsius
+
+    def deactivate(self):
+        self._ctx._record('deactivate', target=self)
+        self.target = None
+        self.status = 'idle'
+
+    def engage(self, height=None, offset=None, height_from_base=None):
+        self._ctx._record('engage', value=height, target=self)
+
+    def disengage(self):
+        self._ctx._record('disengage', target=self)
+
+    def __repr__(self):
+        return '{} on {}'.format(self.model, self.parent)
+
+
+class Parameters:
+    '''Collects add_parameters() declarations.'''
+
+    def __init__(self):
+        self.declared = {}
+
+    def _add(self, kind, variable_name, **kwargs):
+        kwargs['kind'] = kind
+        self.declared[variable_name] = kwargs
+
+    def add_int(self, variable_name, **kwargs):
+        self._add(int, variable_name, **kwargs)
+
+    def add_float(self, variable_name, **kwargs):
+        self._add(float, variable_name, **kwargs)
+
+    def add_bool(self, variable_name, **kwargs):
+        self._add(bool, variable_name, **kwargs)
+
+    def add_str(self, variable_name, **kwargs):
+        self._add(str, variable_name, **kwargs)
+
+    def add_csv_file(self, variable_name, **kwargs):
+        self._add(None, variable_name, **kwargs)
+
+    def values(self, overrides=None):
+        values = {name: spec.get('default')
+                  for name, spec in self.declared.items()}
+        for name, value in (overrides or {}).items():
+            if name not in self.declared:
+                raise KeyError('protocol has no parameter {}'.format(name))
+            values[name] = convert(self.declared[name], value)
+        return values
+
+
+def convert(spec, value):
+    kind = spec['kind']
+    if isinstance(value, str) and kind is bool:
+        return value.lower() in ('1', 'true', 'yes', 'on')
+    if kind is not None:
+        return kind(value)
+    return value
+
+
+class Params:
+    def __init__(self, values):
+        self.__dict__.update(values)
+
+    def get_all(self):
+        return dict(self.__dict__)
+
+
+class _Clock:
+    '''Takes the place of the time module inside a recorded protocol.
+
+    time() runs on the recording's clock and sleep() moves it forward, so
+    busy waits finish at once and still show up in the timing.
+    '''
+
+    def __init__(self, ctx):
+        self._ctx = ctx
+
+    def time(self):
+        return self._ctx.t0 + self._ctx.clock
+
+    def sleep(self, seconds):
+        self._ctx._sleep(seconds)
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+
+class RecordingContext:
+    def __init__(self, params=None, labware_dir=CUSTOM_LABWARE,
+                 source=None, timing=None, definitions=None):
+        self.labware_dir = labware_dir
+        self.definitions = dict(definitions or {})
+        self.source = source
+        self.timing = timing
+        self.simulating = True
+        self.t0 = time.time()
+        self.clock = 0.0
+        self.params = Params(params or {})
+        self.commands = []
+        self.shortages = []
+        self.loaded_labwares = {}
+        self.loaded_modules = {}
+        self.loaded_instruments = {}
+        self.rail_lights_on = False
+        self.max_speeds = {}
+        self.fixed_trash = Labware(TRASH, '12', slot_origin(12))
+        self.error = None
+        self.error_line = None
+        self.output = ''
+
+    def _caller(self):
+        '''Line and function of the innermost protocol frame, and the stage.
+
+        The stage is the function run() called, e.g. make_mixes for a
+        pickup_tips() inside make_mixes().
+        '''
+        if self.source is None:
+            return None, None, None
+        frames = []
+        frame = sys._getframe(2)
+        while frame is not None:
+            if frame.f_code.co_filename == self.source:
+                frames.append(frame)
+            frame = frame.f_back
+        if not frames:
+            return None, None, None
+        names = [f.f_code.co_name for f in frames]
+        stage = names[-2] if len(names) > 1 and names[-1] == 'run' else (
+                names[-1])
+        return frames[0].f_lineno, names[0], stage
+
+    def _record(self, name, **fields):
+        line, func, stage = self._caller()
+        command = Command(len(self.commands), name, line=line, func=func,
+                          stage=stage, **fields)
+        command.start = self.clock
+        if self.timing is not None:
+            command.duration = self.timing(command, self)
+        elif name == 'delay':
+            command.duration = command.value
+        self.clock += command.duration
+        self.commands.append(command)
+        return command
+
+    def _sleep(self, seconds):
+        last = self.commands[-1] if self.commands else None
+        if last is not None and last.name == 'sleep':
+            # busy waits sleep a second at a time, keep them as one command
+            last.value += seconds
+            last.duration += seconds
+            self.clock += seconds
+        else:
+            command = self._record('sleep', value=seconds)
+            if self.timing is None:
+                command.duration = seconds
+                self.clock += seconds
+
+    def _shortage(self, pipette, tips):
+        self.shortages.append((len(self.commands), pipette, tips,
+                               self._caller()[0]))
+
+    # protocol context api
+
+    def _definition(self, load_name, version=None):
+        # definitions passed in stand in for the ones of that load name
+        if load_name in self.definitions:
+            return self.definitions[load_name]
+        return load_definition(load_name, version, self.labware_dir)
+
+    def is_simulating(self):
+        return self.simulating
+
+    def load_labware(self, load_name, location, label=None, namespace=None,
+                     version=None):
+        definition = self._definition(load_name, version)
+        return self.load_labware_from_definition(definition, location, label)
+
+    def load_labware_from_definition(self, definition, location, label=None):
+        labware = Labware(definition, str(location), slot_origin(location))
+        self.loaded_labwares[str(location)] = labware
+        self._record('load_labware', target=labware)
+        return labware
+
+    def load_instrument(self, instrument_name, mount, tip_racks=None,
+                        replace=False):
+        pipette = Pipette(self, instrument_name, mount, tip_racks)
+        self.loaded_instruments[mount] = pipette
+        self._record('load_instrument', target=pipette)
+        return pipette
+
+    def load_module(self, module_name, location=None, configuration=None):
+        module = Module(self, module_name.lower(), location)
+        self.loaded_modules[str(location)] = module
+        self._record('load_module', target=module)
+        return module
+
+    def define_liquid(self, name, description=None, display_color=None):
+        return Liquid(name, description, display_color)
+
+    def delay(self, seconds=0, minutes=0, msg=None):
+        self._record('delay', value=seconds + minutes*60)
+
+    def pause(self, msg=None):
+        self._record('pause', target=msg)
+
+    def comment(self, msg):
+        self._record('comment', target=msg)
+
+    def set_rail_lights(self, on):
+        self.rail_lights_on = bool(on)
+        self._record('set_rail_lights', value=bool(on))
+
+    def home(self):
+        self._record('home')
+
+    # helpers for the tools
+
+    def pipettes(self):
+        return list(self.loaded_instruments.values())
+
+    def tip_racks(self):
+        return [labware for labware in self.loaded_labwares.values()
+                if labware.is_tiprack]
+
+
+def load_protocol(path):
+    '''Import a protocol file as a module.'''
+    path = os.path.abspath(path)
+    name = '_otto_protocol_{}'.format(abs(hash(path)))
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def declared_parameters(module):
+    parameters = Parameters()
+    if hasattr(module, 'add_parameters'):
+        module.add_parameters(parameters)
+    return parameters
+
+
+def _waiting(ctx, incubate):
+    # incubate() only busy-waits on a real run, so let it wait on our clock
+    def wrapper(*args, **kwargs):
+        ctx.simulating = False
+        try:
+            return incubate(*args, **kwargs)
+        finally:
+            ctx.simulating = True
+    wrapper.wrapped = incubate
+    return wrapper
+
+
+def record(path, params=None, labware_dir=CUSTOM_LABWARE, module=None,
+           timing=None, definitions=None, run=None):
+    '''Dry run path (or an already loaded module) and return the context.
+
+    timing(command, ctx) gives the seconds a command takes, see
+    otto.runtime. Without it only delays and sleeps take time.
+    definitions, {load name: definition}, replace the labware of those
+    load names. run(module, ctx), if given, is called instead of the
+    protocol's own run().
+    '''
+    if module is None:
+        module = load_protocol(path)
+    source = os.path.abspath(module.__file__)
+    values = declared_parameters(module).values(params)
+    ctx = RecordingContext(values, labware_dir, source, timing, definitions)
+    if getattr(module, 'time', None) is time:
+        module.time = _Clock(ctx)
+    incubate = getattr(module, 'incubate', None)
+    if callable(incubate) and isinstance(module.time, _Clock):
+        module.incubate = _waiting(ctx, incubate)
+    output = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(output):
+            if run is None:
+                module.run(ctx)
+            else:
+                run(module, ctx)
+    except Exception as e:
+        ctx.error = e
+        for frame, line in traceback.walk_tb(e.__traceback__):
+            if frame.f_code.co_filename == source:
+                ctx.error_line = line
+    finally:
+        if isinstance(getattr(module, 'time', None), _Clock):
+            module.time = time
+        if hasattr(getattr(module, 'incubate', None), 'wrapped'):
+            module.incubate = module.incubate.wrapped
+        ctx.output = output.getvalue()
+    return ctx
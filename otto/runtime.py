@@ -0,0 +1,236 @@
+'''Run time estimate for a protocol, before it goes on the robot.
+
+    python -m otto.runtime shawn_scripts/production/salt_screens/salt_screen.py
+
+Replays the recorded commands through a time model: gantry moves at the
+pipette's default_speed (arcing over the deck between labware), plunger
+moves at the flow rates the protocol set, mixes by repetition count, plus
+delays, the incubate() busy waits and temperature module ramps. Prints the
+total and a Gantt-style breakdown by the functions run() calls; --steps
+lists every command.
+
+The constants below are ballpark figures for an OT-2 and are easy to tune
+against a stopwatch.
+'''
+
+import argparse
+import math
+import sys
+
+from otto.labware import CUSTOM_LABWARE
+
+Z_SPEED = 125.0        # mm/s
+MOVE_OVERHEAD = 0.15   # s per move for acceleration and settling
+CLEARANCE = 10.0       # mm above the tallest labware when crossing the deck
+PICK_UP = 4.0          # s to press onto tips
+DROP = 2.5             # s to eject
+BLOW_OUT = 1.0
+TOUCH_TIP = 1.5
+HOME = 8.0
+AMBIENT = 22.0         # °C
+HEAT_RATE = 3.5 / 60   # °C/s, temperature module gen2
+COOL_RATE = 2.5 / 60
+DRIFT_RATE = 0.5 / 60  # deactivated block drifting back to ambient
+
+CATEGORIES = {
+    'move_to': 'moving', 'touch_tip': 'moving',
+    'aspirate': 'liquid', 'dispense': 'liquid', 'mix': 'liquid',
+    'blow_out': 'liquid', 'air_gap': 'liquid',
+    'pick_up_tip': 'tips', 'drop_tip': 'tips', 'return_tip': 'tips',
+    'delay': 'waiting', 'sleep': 'waiting', 'pause': 'waiting',
+    'set_temperature': 'temperature', 'await_temperature': 'temperature',
+}
+
+
+class Block:
+    '''Temperature of one module over time, linear ramps.'''
+
+    def __init__(self):
+        self.temp = AMBIENT
+        self.since = 0.0
+        self.target = None
+
+    def now(self, t):
+        target = AMBIENT if self.target is None else self.target
+        rate = DRIFT_RATE if self.target is None else (
+               HEAT_RATE if target > self.temp else COOL_RATE)
+        change = rate * (t - self.since)
+        if abs(target - self.temp) <= change:
+            return target
+        return self.temp + math.copysign(change, target - self.temp)
+
+    def set(self, t, target):
+        self.temp = self.now(t)
+        self.since = t
+        self.target = target
+
+    def time_to(self, t, target):
+        temp = self.now(t)
+        rate = HEAT_RATE if target > temp else COOL_RATE
+        return abs(target - temp) / rate
+
+
+class TimeModel:
+    '''timing hook for otto.recording.record, one instance per run.'''
+
+    def __init__(self):
+        self.head = None
+        self.labware = None
+        self.blocks = {}
+
+    def _block(self, module):
+        return self.blocks.setdefault(id(module), Block())
+
+    def _safe_z(self, ctx):
+        # top of the first well, from the geometry index
+        tops = [labware.origin[2] + float(labware.geometry.top[0])
+                for labware in ctx.loaded_labwares.values()]
+        tops += [module.labware.origin[2] +
+                 float(module.labware.geometry.top[0])
+                 for module in ctx.loaded_modules.values() if module.labware]
+        return max(tops + [0.0]) + CLEARANCE
+
+    def travel(self, point, well, speed, ctx):
+        '''Seconds to get the head to point.'''
+        if point is None:
+            return 0.0
+        here, self.head = self.head, point
+        labware = well.parent if well is not None else None
+        same, self.labware = labware is self.labware, labware
+        if here is None:
+            return MOVE_OVERHEAD
+        xy = math.hypot(point.x - here.x, point.y - here.y)
+        if xy < 0.01:
+            return abs(point.z - here.z) / Z_SPEED
+        top = (well.top().point.z + CLEARANCE if same and well is not None
+               else self._safe_z(ctx))
+        z = max(top - here.z, 0) + max(top - point.z, 0)
+        return xy / speed + z / Z_SPEED + MOVE_OVERHEAD
+
+    def __call__(self, command, ctx):
+        name = command.name
+        if name in ('delay', 'sleep'):
+            return command.value
+        if name in ('set_temperature', 'start_set_temperature',
+                    'await_temperature', 'deactivate'):
+            block = self._block(command.target)
+            if name == 'deactivate':
+                block.set(ctx.clock, None)
+                return 0.0
+            wait = block.time_to(ctx.clock, command.value)
+            if name == 'await_temperature':
+                # the ramp may have started long ago
+                if block.target is not None:
+                    wait = block.time_to(ctx.clock, block.target)
+                return wait
+            block.set(ctx.clock, command.value)
+            return wait if name == 'set_temperature' else 0.0
+        if name == 'home':
+            self.head = None
+            return HOME
+        pipette = command.pipette
+        if pipette is None:
+            return 0.0
+        move = self.travel(command.point, command.well,
+                           pipette.default_speed, ctx)
+        if name in ('aspirate', 'dispense'):
+            return move + command.volume / command.rate
+        if name == 'mix':
+            return move + command.value * command.volume / command.rate
+        if name == 'blow_out':
+            return move + BLOW_OUT
+        if name == 'touch_tip':
+            return move + TOUCH_TIP
+        if name == 'pick_up_tip':
+            return move + PICK_UP
+        if name in ('drop_tip', 'return_tip'):
+            return move + DROP
+        return move
+
+
+def estimate(path, params=None, labware_dir=CUSTOM_LABWARE, module=None):
+    from otto.recording import record
+    return record(path, params, labware_dir, module, timing=TimeModel())
+
+
+def clock(seconds):
+    seconds = int(round(seconds))
+    return '{}:{:02d}:{:02d}'.format(seconds // 3600, seconds // 60 % 60,
+                                     seconds % 60)
+
+
+def by_stage(commands):
+    '''(stage, start, duration) for every run of commands in one stage.'''
+    spans = []
+    for command in commands:
+        stage = command.stage or '?'
+        if spans and spans[-1][0] == stage:
+            spans[-1][2] += command.duration
+        else:
+            spans.append([stage, command.start, command.duration])
+    return [tuple(span) for span in spans if span[2] > 0]
+
+
+def by_category(commands):
+    totals = {}
+    for command in commands:
+        category = CATEGORIES.get(command.name, 'other')
+        totals[category] = totals.get(category, 0.0) + command.duration
+    return totals
+
+
+def gantt(commands, width=50):
+    total = sum(command.duration for command in commands) or 1.0
+    lines = []
+    for stage, start, duration in by_stage(commands):
+        begin = int(start / total * width)
+        length = max(1, int(round(duration / total * width)))
+        bar = ' ' * begin + '#' * min(length, width - begin)
+        lines.append('  {} {:<{w}} {:<20} {}'.format(
+                     clock(start), bar, stage[:20], clock(duration), w=width))
+    return lines
+
+
+def report(path, ctx, steps=False):
+    total = ctx.clock
+    lines = ['{}: {}'.format(path, clock(total))]
+    lines.append('  ' + ', '.join('{} {}'.format(category, clock(seconds))
+                 for category, seconds in sorted(by_category(
+                     ctx.commands).items(), key=lambda c: -c[1]) if seconds))
+    pauses = sum(1 for command in ctx.commands if command.name == 'pause')
+    if pauses:
+        lines.append('  plus {} pause(s) waiting on the operator'.format(
+                     pauses))
+    lines.extend(gantt(ctx.commands))
+    if steps:
+        for command in ctx.commands:
+            if command.duration:
+                lines.append('    {} {:>7.1f}s  line {:<4} {}'.format(
+                             clock(command.start), command.duration,
+                             command.line or '', command))
+    if ctx.error is not None:
+        lines.append('  protocol failed at line {}: {!r}'.format(
+                     ctx.error_line, ctx.error))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    from otto.budget import parse_params
+
+    parser = argparse.ArgumentParser(
+        description='Estimate how long a protocol takes on the robot.')
+    parser.add_argument('protocol', nargs='+')
+    parser.add_argument('-p', '--param', action='append',
+                        help='parameter override, name=value')
+    parser.add_argument('-L', '--labware', default=CUSTOM_LABWARE)
+    parser.add_argument('--steps', action='store_true',
+                        help='list every command with its start and length')
+    args = parser.parse_args(argv)
+    for path in args.protocol:
+        ctx = estimate(path, parse_params(args.param), args.labware)
+        print(report(path, ctx, args.steps))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,173 @@
+'''Incubation aware step scheduler.
+
+The nuclease and crosslinking protocols start an incubation and then
+busy-wait in incubate() until it is over. With a Scheduler the waiting
+steps are declared with what they depend on, and pipetting that does not
+depend on a running incubation is pulled forward into the wait:
+
+    sched = Scheduler(protocol, clock=time.time)
+    sched.step('complex', add_complex)
+    sched.incubate('mnase', mnase_time, after=['complex'])
+    sched.step('quench', quench, after=['mnase'])
+    sched.step('edta', aliquot_edta, estimate=90)
+    sched.step('prok', add_prok, after=['quench', 'edta'])
+    sched.run()
+
+A step only goes into an incubation window if its estimate (seconds) plus
+margin fits before the incubation ends, so the steps waiting on the
+incubation still start on time. Steps without an estimate never go into
+a window. Declared order is kept otherwise.
+
+Pass the protocol module's time.time as clock; under otto.recording that
+is the recorded clock, so dry runs and otto.runtime see the real timing.
+sched.log has (name, start, end) of every step and wait afterwards.
+'''
+
+import time
+
+
+class Step:
+    __slots__ = ('name', 'func', 'after', 'estimate', 'minutes', 'start',
+                 'end')
+
+    def __init__(self, name, func=None, after=(), estimate=None,
+                 minutes=None):
+        self.name = name
+        self.func = func
+        self.after = list(after)
+        self.estimate = estimate
+        self.minutes = minutes
+        self.start = None
+        self.end = None
+
+    @property
+    def timed(self):
+        return self.minutes is not None
+
+    def __repr__(self):
+        return '<Step {}>'.format(self.name)
+
+
+class Scheduler:
+    def __init__(self, protocol, clock=None, margin=15):
+        self.protocol = protocol
+        self.clock = clock or time.time
+        self.margin = margin
+        self.steps = []
+        self.log = []
+        self._by_name = {}
+        self._skipped = 0.0
+
+    def _add(self, step):
+        if step.name in self._by_name:
+            raise ValueError('step {} declared twice'.format(step.name))
+        for name in step.after:
+            if name not in self._by_name:
+                raise ValueError('step {} depends on {}, declare that '
+                                 'first'.format(step.name, name))
+        self._by_name[step.name] = step
+        self.steps.append(step)
+        return step
+
+    def step(self, name, func, after=(), estimate=None):
+        '''Pipetting step, func() runs once everything in after is done.'''
+        return self._add(Step(name, func, after, estimate))
+
+    def incubate(self, name, minutes, after=()):
+        '''Timed incubation, starts as soon as everything in after is done.'''
+        return self._add(Step(name, after=after, minutes=minutes))
+
+    def now(self):
+        return self.clock() + self._skipped
+
+    def _done(self, step, now):
+        return step.end is not None and step.end <= now
+
+    def _ready(self, step, now):
+        return step.start is None and all(
+            self._done(self._by_name[name], now) for name in step.after)
+
+    def _deadline(self):
+        '''End of the earliest running incubation something waits on.'''
+        ends = [step.end for step in self.steps
+                if step.timed and step.start is not None and any(
+                    step.name in other.after and other.start is None
+                    for other in self.steps)]
+        return min(ends) if ends else None
+
+    def _wait(self, until):
+        seconds = until - self.now()
+        if seconds <= 0:
+            return
+        start = self.now()
+        if not self.protocol.is_simulating():
+            # same busy wait as incubate(), ^C cuts it short
+            try:
+                while self.now() < until:
+                    time.sleep(1)
+            except KeyboardInterrupt:
+                self._skipped += max(0.0, until - self.now())
+        else:
+            before = self.clock()
+            self.protocol.delay(seconds=seconds)
+            # opentrons_simulate does not move the clock for a delay
+            self._skipped += seconds - (self.clock() - before)
+        self.log.append(('wait', start, self.now()))
+
+    def _run(self, step):
+        step.start = self.now()
+        if step.timed:
+            step.end = step.start + step.minutes*60
+            self.log.append((step.name, step.start, step.end))
+            return
+        step.func()
+        step.end = self.now()
+        self.log.append((step.name, step.start, step.end))
+
+    def _pick(self, now):
+        ready = [step for step in self.steps if self._ready(step, now)]
+        # incubations start the moment they can
+        for step in ready:
+            if step.timed:
+                return step
+        # then whatever was waiting on a finished incubation
+        for step in ready:
+            if any(self._by_name[name].timed for name in step.after):
+                return step
+        deadline = self._deadline()
+        for step in ready:
+            if deadline is None:
+                return step
+            if step.estimate is not None and (
+                    now + step.estimate + self.margin <= deadline):
+                return step
+        return None
+
+    def run(self):
+        '''Run every step, returns the log.'''
+        while any(step.start is None for step in self.steps):
+            now = self.now()
+            step = self._pick(now)
+            if step is not None:
+                self._run(step)
+                continue
+            running = [s.end for s in self.steps
+                       if s.timed and s.start is not None and s.end > now]
+            if not running:
+                left = [s.name for s in self.steps if s.start is None]
+                raise RuntimeError('steps can never run: {}'.format(
+                                   ', '.join(left)))
+            self._wait(min(running))
+        # the last incubations still have to run out
+        ends = [step.end for step in self.steps if step.timed]
+        if ends:
+            self._wait(max(ends))
+        return self.log
+
+    def timeline(self):
+        '''Log lines relative to the first step.'''
+        if not self.log:
+            return []
+        t0 = self.log[0][1]
+        return ['{:>8.0f}s {:>8.0f}s  {}'.format(start - t0, end - t0, name)
+                for name, start, end in self.log]
@@ -0,0 +1,259 @@
+'''Stage-batched runs of the per-buffer salt screens.
+
+    python -m otto.stages shawn_scripts/production/salt_screens/salt_screen.py
+
+The salt screens' run() goes through every stage for one buffer before
+starting the next:
+
+    for buff in buffs:
+        make_mixes(buff, protocol)
+        plate_96well(buff, protocol)
+        ...
+
+batched(module, protocol) runs the same stage functions the other way
+round, each stage for all buffers before the next stage, with the
+statements around the loop (strobe(), setup()) as they are. make_mixes()
+is not called per buffer: what it would add where, for every buffer, is
+collected with a stand-in pipette and planned once with otto.mixes, one
+tip per component as the protocol does, so the head goes to each stock
+once and multi-dispenses into all the buffers' mixes. The tips come from
+the positions the protocol's own make_mixes() would have picked, and its
+tip counter is moved on by the tips actually used, so the later stages
+carry on with the next tip.
+
+Both orders are dry run (otto.runtime timing) and compared like
+otto.diff does: final well volumes have to come out the same.
+'''
+
+import argparse
+import ast
+import inspect
+import sys
+import textwrap
+
+from otto.labware import CUSTOM_LABWARE
+
+PLANNED = 'make_mixes'
+
+
+def loop(module):
+    '''(before, target, iterable, stages, after) of the module's run().
+
+    target is the loop variable's name, iterable and the stages (one
+    statement each) are ast nodes, before and after the statements
+    around the loop.
+    '''
+    tree = ast.parse(textwrap.dedent(inspect.getsource(module.run)))
+    body = tree.body[0].body
+    for i, stmt in enumerate(body):
+        if isinstance(stmt, ast.For) and isinstance(stmt.target, ast.Name):
+            return (body[:i], stmt.target.id, stmt.iter, stmt.body,
+                    body[i + 1:])
+    raise ValueError('run() of {} has no loop over buffers'.format(
+                     module.__file__))
+
+
+def _eval(node, module, names):
+    code = compile(ast.Expression(node), module.__file__, 'eval')
+    return eval(code, vars(module), names)
+
+
+def _call(stmt, module, names):
+    '''Run one statement of run(), calling plain calls directly so the
+    recording puts them under their own stage.'''
+    if (isinstance(stmt, ast.Expr) and isinstance(stmt.value, ast.Call) and
+            isinstance(stmt.value.func, ast.Name) and
+            not stmt.value.keywords):
+        func = _eval(stmt.value.func, module, names)
+        func(*[_eval(arg, module, names) for arg in stmt.value.args])
+    else:
+        tree = ast.Module(body=[stmt], type_ignores=[])
+        exec(compile(tree, module.__file__, 'exec'), vars(module), names)
+
+
+class _Additions:
+    '''Stands in for a pipette while make_mixes() runs and keeps what it
+    would have added where, and the tips it would have picked up.'''
+
+    def __init__(self):
+        self.mixes = []
+        self.tips = []
+        self._source = None
+
+    def pick_up_tip(self, location=None, *args, **kwargs):
+        self.tips.append(location)
+
+    def aspirate(self, volume=None, location=None, rate=1.0):
+        self._source = location
+
+    def dispense(self, volume=None, location=None, rate=1.0, **kwargs):
+        self.mixes.append({'comps': [self._source], 'vols': [volume],
+                           'loc': location})
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+def tip_counters(func):
+    '''Names in the subscripts of func's pick_up_tip(...) calls, like tip
+    in p300m.pick_up_tip(tips300[which_tips[tip]]).'''
+    tree = ast.parse(textwrap.dedent(inspect.getsource(func)))
+    names = []
+    for node in ast.walk(tree):
+        if not (isinstance(node, ast.Call) and
+                isinstance(node.func, ast.Attribute) and
+                node.func.attr == 'pick_up_tip'):
+            continue
+        for arg in node.args:
+            for sub in ast.walk(arg):
+                if not isinstance(sub, ast.Subscript):
+                    continue
+                for name in ast.walk(sub.slice):
+                    if isinstance(name, ast.Name) and name.id not in names:
+                        names.append(name.id)
+    return names
+
+
+def collect(module, protocol, stmt, target, items):
+    '''{pipette: _Additions} of make_mixes() for every buffer, and the
+    names of its tip counters.
+
+    The module's globals are put back afterwards. The tip counters are the
+    int globals make_mixes() indexes its pick_up_tip() tips with; each has
+    to go up by one per tip picked up.
+    '''
+    func = _eval(stmt.value.func, module, {})
+    saved = dict(vars(module))
+    counters = [name for name in tip_counters(func)
+                if type(saved.get(name)) is int]
+    pipettes = {name: value for name, value in saved.items()
+                if any(value is p for p in protocol.pipettes())}
+    collected = {value: _Additions() for value in pipettes.values()}
+    for name, pipette in pipettes.items():
+        setattr(module, name, collected[pipette])
+    try:
+        for item in items:
+            _call(stmt, module, {'protocol': protocol, target: item})
+        picked = sum(len(c.tips) for c in collected.values())
+        moved = {name: getattr(module, name) - saved[name]
+                 for name in counters}
+    finally:
+        vars(module).update(saved)
+    if picked and not counters:
+        raise ValueError('{}() picks up tips without an int counter to '
+                         'move on'.format(func.__name__))
+    for name, step in moved.items():
+        if step != picked:
+            raise ValueError('{}() moves {} on by {} for {} tips'.format(
+                             func.__name__, name, step, picked))
+    return collected, counters
+
+
+def planned_mixes(module, protocol, stmt, target, items):
+    '''make_mixes() for all buffers at once, planned with otto.mixes.'''
+    from otto.mixes import make_mixes, plan_mixes
+
+    collected, counters = collect(module, protocol, stmt, target, items)
+    used = 0
+    for pipette, additions in collected.items():
+        if not additions.mixes:
+            continue
+        sources = [mix['comps'][0] for mix in additions.mixes]
+        plan = plan_mixes(additions.mixes, dedicated=sources,
+                          max_volume=pipette.max_volume,
+                          disposal_volume=pipette.min_volume)
+        tips = iter(additions.tips)
+        make_mixes(plan, pipette, lambda: pipette.pick_up_tip(next(tips)))
+        used += len(plan)
+    for name in counters:
+        setattr(module, name, getattr(module, name) + used)
+
+
+def batched(module, protocol, plan=True):
+    '''run() with every stage done for all buffers before the next.'''
+    before, target, iterable, stages, after = loop(module)
+    names = {'protocol': protocol}
+    for stmt in before:
+        _call(stmt, module, names)
+    items = list(_eval(iterable, module, names))
+    for stmt in stages:
+        call = getattr(stmt, 'value', None)
+        if plan and isinstance(call, ast.Call) and getattr(
+                call.func, 'id', None) == PLANNED:
+            planned_mixes(module, protocol, stmt, target, items)
+            continue
+        for item in items:
+            _call(stmt, module, dict(names, **{target: item}))
+    for stmt in after:
+        _call(stmt, module, names)
+
+
+def compare(path, params=None, labware_dir=CUSTOM_LABWARE, plan=True):
+    '''(per buffer ctx, batched ctx, otto.diff.compare of the two).'''
+    from otto.diff import compare as diff
+    from otto.recording import load_protocol, record
+    from otto.runtime import TimeModel
+
+    module = load_protocol(path)
+    a = record(path, params, labware_dir, module, timing=TimeModel())
+    b = record(path, params, labware_dir, module, timing=TimeModel(),
+               run=lambda module, ctx: batched(module, ctx, plan))
+    return a, b, diff(a, b)
+
+
+def report(path, a, b, result):
+    from otto.diff import _change
+    from otto.runtime import clock
+
+    lines = [path]
+    for ctx, name in ((a, 'per buffer'), (b, 'batched')):
+        if ctx.error is not None:
+            lines.append('  {} failed at line {}: {!r}'.format(
+                         name, ctx.error_line, ctx.error))
+    lines.append('  run time  {}'.format(_change(*result['runtime'],
+                                                 fmt=clock)))
+    lines.append('  tips      {}'.format(_change(*result['tips'], fmt=str)))
+    lines.append('  travel    {}'.format(_change(
+                 *result['travel'], fmt=lambda mm: '{:.0f} mm'.format(mm))))
+    aspirations = [sum(1 for c in ctx.commands if c.name == 'aspirate')
+                   for ctx in (a, b)]
+    lines.append('  aspirate  {}'.format(_change(*aspirations, fmt=str)))
+    changed = result['volumes']
+    if not changed:
+        lines.append('  final volumes: same in all {} wells'.format(
+                     result['wells'][0]))
+    else:
+        lines.append('  final volumes: {} well(s) differ'.format(
+                     len(changed)))
+        for (slot, load_name, well), va, vb in changed[:10]:
+            lines.append('    slot {} {} {}: {:g} -> {:g} µL'.format(
+                         slot, load_name, well, va, vb))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    from otto.budget import parse_params
+
+    parser = argparse.ArgumentParser(
+        description='Per-buffer salt screen runs next to stage-batched '
+                    'ones.')
+    parser.add_argument('protocol', nargs='+')
+    parser.add_argument('-p', '--param', action='append',
+                        help='parameter override, name=value')
+    parser.add_argument('-L', '--labware', default=CUSTOM_LABWARE)
+    parser.add_argument('--no-plan', action='store_true',
+                        help='batch the stages but call make_mixes() per '
+                             'buffer')
+    args = parser.parse_args(argv)
+    status = 0
+    for path in args.protocol:
+        a, b, result = compare(path, parse_params(args.param), args.labware,
+                               not args.no_plan)
+        print(report(path, a, b, result))
+        if result['volumes'] or b.error is not None:
+            status = 1
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
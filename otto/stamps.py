@@ -0,0 +1,250 @@
+'''96 to 384 stamping planner.
+
+    python -m otto.stamps -s odd:0,12 -s even:0,12 -v 1
+
+The HTS scripts (HTS_1uL_aliquots_mod2, HTS_one_plate_col1_col2,
+384_load_10_10) move compound columns from 96 well plates into 384 rows
+with evenodd/assay_row/i+12 arithmetic and a transfer() per column. Here
+a layout says where every source column goes, as (source column, parity,
+384 column): the A nozzle of an 8-channel in a 384 reaches row A (parity
+0) or row B (parity 1) and the rest of the nozzles every other row below,
+so one move covers one 96 column.
+
+    quadrant(1)                 # A1 -> A1, A2 -> A3, B1 -> C1 ...
+    replicate(0, (0, 12))       # column c -> odd rows of c + 1 and c + 13
+    plan = plan_stamp([plate96], [quadrant(1)], plate384, volume=1)
+    run_program(plan, p20m, pick_up=p20m.pick_up_tip)   # otto.dispense
+
+Every source column is aspirated once for all of its targets when they
+fit in the tip with the pipette's min volume on top (multi-dispense,
+otto.dispense) and the dispenses of an aspiration go in the order with the
+least travel (otto.paths). plate_map() gives the source well of every 384
+well the layouts fill.
+'''
+
+import argparse
+import sys
+
+from otto.dispense import compile_steps
+from otto.labware import CUSTOM_LABWARE
+
+CHANNELS = 8
+COLUMNS = 12
+
+
+def quadrant(q, columns=COLUMNS):
+    '''Layout of the standard quadrant q: 1 is A1, 2 A2, 3 B1, 4 B2.'''
+    if q not in (1, 2, 3, 4):
+        raise ValueError('quadrants are 1-4, not {}'.format(q))
+    parity, shift = (q - 1) // 2, (q - 1) % 2
+    return [(c, parity, 2 * c + shift) for c in range(columns)]
+
+
+def replicate(parity, offsets=(0,), columns=COLUMNS):
+    '''Layout with source column c on rows of parity, at c + each offset.'''
+    return [(c, parity, c + offset) for c in range(columns)
+            for offset in offsets]
+
+
+def parse_layout(spec, columns=COLUMNS):
+    '''q1-q4, or odd|even:offset,... (odd rows are A, C, E ...).'''
+    spec = spec.strip().lower()
+    if spec.startswith('q') and spec[1:].isdigit():
+        return quadrant(int(spec[1:]), columns)
+    rows, _, offsets = spec.partition(':')
+    if rows not in ('odd', 'even'):
+        raise ValueError('layout {!r} is not q1-q4 or odd|even:offsets'
+                         .format(spec))
+    return replicate(rows == 'even', [int(o) for o in
+                                      (offsets or '0').split(',')], columns)
+
+
+def _check(dest, channels):
+    if len(dest.columns()[0]) != 2 * channels:
+        raise ValueError('{} is not a plate with two rows per nozzle'.format(
+                         dest))
+
+
+def plate_map(sources, layouts, dest, channels=CHANNELS):
+    '''{384 well: (source index, source well)} of the layouts.
+
+    Two sources landing in one well is an error.
+    '''
+    _check(dest, channels)
+    rows = dest.rows()
+    mapped = {}
+    for s, (source, layout) in enumerate(zip(sources, layouts)):
+        for column, parity, target in layout:
+            if target >= len(rows[0]):
+                raise ValueError('column {} of {} is off the plate'.format(
+                                 target + 1, dest))
+            if column >= len(source.columns()):
+                raise ValueError('column {} of {} is off the plate'.format(
+                                 column + 1, source))
+            for n in range(channels):
+                well = rows[int(parity) + 2 * n][target]
+                if well in mapped:
+                    other = mapped[well]
+                    raise ValueError('{} gets {} of source {} and {} of '
+                                     'source {}'.format(
+                                         well.well_name,
+                                         other[1].well_name, other[0] + 1,
+                                         source.rows()[n][column].well_name,
+                                         s + 1))
+                mapped[well] = (s, source.rows()[n][column])
+    return mapped
+
+
+def stamp_steps(sources, layouts, dest, volume, tips='plate'):
+    '''otto.dispense steps of the layouts, one per 8-channel move.
+
+    tips is 'plate' (one tip per source plate, like the HTS scripts) or
+    'column' (a new tip for every source column).
+    '''
+    if tips not in ('plate', 'column'):
+        raise ValueError("tips is 'plate' or 'column', not {!r}".format(tips))
+    plate_map(sources, layouts, dest)
+    steps = []
+    for s, (source, layout) in enumerate(zip(sources, layouts)):
+        for column, parity, target in layout:
+            well = source.rows()[0][column]
+            context = s if tips == 'plate' else (s, column)
+            steps.append((well, dest.rows()[int(parity)][target], volume,
+                          context))
+    return steps
+
+
+def plan_stamp(sources, layouts, dest, volume, max_volume=20,
+               disposal_volume=1, tips='plate', multi_dispense=True):
+    '''otto.dispense program stamping sources onto dest.
+
+    disposal_volume goes on top of every multi-dispense aspiration and
+    back into the source, by default a p20's min volume like the API's
+    distribute().
+    '''
+    from otto.paths import optimize_program
+
+    steps = stamp_steps(sources, layouts, dest, volume, tips)
+    if not multi_dispense:
+        program = []
+        for step in steps:
+            ops = compile_steps([step], max_volume)[0][1]
+            if program and program[-1][0] == step[3]:
+                program[-1][1].extend(ops)
+            else:
+                program.append((step[3], ops))
+        return program
+    return optimize_program(compile_steps(steps, max_volume,
+                                          disposal_volume))[0]
+
+
+def moves(program):
+    '''8-channel moves of a program: aspirations and dispenses.'''
+    return sum(1 for context, ops in program for op in ops
+               if op[0] in ('aspirate', 'dispense'))
+
+
+def render(mapped, dest, numbered=False):
+    '''The 384 plate map as text, source well names, . for unused.'''
+    cells = {}
+    for well, (s, source) in mapped.items():
+        cells[well] = '{}{}'.format('{}:'.format(s + 1) if numbered else '',
+                                    source.well_name)
+    width = max([len(cell) for cell in cells.values()] + [2]) + 1
+    lines = ['    ' + ''.join('{:>{}}'.format(c + 1, width)
+                              for c in range(len(dest.rows()[0])))]
+    for row in dest.rows():
+        lines.append('{:<4}'.format(row[0].well_name[0]) + ''.join(
+                     '{:>{}}'.format(cells.get(well, '.'), width)
+                     for well in row))
+    return '\n'.join(lines)
+
+
+def to_csv(mapped, dest, volume, f):
+    f.write('well,source,source_well,volume\n')
+    for well in dest.wells():
+        if well in mapped:
+            s, source = mapped[well]
+            f.write('{},{},{},{:g}\n'.format(well.well_name, s + 1,
+                                             source.well_name, volume))
+
+
+def _deck(count, timing, labware_dir, plate, flow_rate):
+    from otto.recording import RecordingContext
+
+    ctx = RecordingContext(labware_dir=labware_dir, timing=timing)
+    # the HTS scripts' deck: compound plates from slot 1, 384 on 3
+    slots = [1, 2, 4, 5, 6][:count]
+    if len(slots) < count:
+        raise ValueError('room for 5 source plates, not {}'.format(count))
+    sources = [ctx.load_labware('costar_96_wellplate_200ul', slot)
+               for slot in slots]
+    dest = ctx.load_labware(plate, 3)
+    racks = [ctx.load_labware('opentrons_96_tiprack_20ul', 11)]
+    pipette = ctx.load_instrument('p20_multi_gen2', 'right',
+                                  tip_racks=racks)
+    pipette.flow_rate.aspirate = flow_rate
+    pipette.flow_rate.dispense = flow_rate
+    return ctx, sources, dest, pipette
+
+
+def main(argv=None):
+    from otto.diff import compare
+    from otto.dispense import aspirations, run_program
+    from otto.runtime import TimeModel, clock
+
+    parser = argparse.ArgumentParser(
+        description='Stamp 96 well columns onto a 384 well plate.')
+    parser.add_argument('-s', '--source', action='append', required=True,
+                        help='layout of one source plate: q1-q4 or '
+                             'odd|even:offset,...')
+    parser.add_argument('-n', '--columns', type=int, default=COLUMNS,
+                        help='source columns used')
+    parser.add_argument('-v', '--volume', type=float, default=1)
+    parser.add_argument('-d', '--disposal', type=float,
+                        help="µL extra per multi-dispense aspiration "
+                             "(default the pipette's min volume)")
+    parser.add_argument('--tips', choices=('plate', 'column'),
+                        default='plate')
+    parser.add_argument('--plate', default='corning3575_384well_alt')
+    parser.add_argument('--flow-rate', type=float, default=10)
+    parser.add_argument('--csv', help='write the plate map here')
+    parser.add_argument('-L', '--labware', default=CUSTOM_LABWARE)
+    args = parser.parse_args(argv)
+    runs = []
+    for multi_dispense in (True, False):
+        try:
+            layouts = [parse_layout(spec, args.columns)
+                       for spec in args.source]
+            ctx, sources, dest, pipette = _deck(len(layouts), TimeModel(),
+                                                args.labware, args.plate,
+                                                args.flow_rate)
+            disposal = args.disposal
+            if disposal is None:
+                disposal = pipette.min_volume
+            program = plan_stamp(sources, layouts, dest, args.volume,
+                                 pipette.max_volume, disposal,
+                                 args.tips, multi_dispense)
+        except ValueError as e:
+            parser.error(str(e))
+        run_program(program, pipette, pick_up=pipette.pick_up_tip)
+        runs.append((ctx, program))
+    mapped = plate_map(sources, layouts, dest)
+    print(render(mapped, dest, numbered=len(layouts) > 1))
+    print('{} wells from {} source plate(s), {:g} µL each'.format(
+          len(mapped), len(layouts), args.volume))
+    for label, (ctx, program) in zip(('planned', 'one per column'), runs):
+        print('  {:<15} {} tips, {} aspirations, {} moves, {}'.format(
+              label, len(program) * CHANNELS, aspirations(program),
+              moves(program), clock(ctx.clock)))
+    if args.csv:
+        with open(args.csv, 'w') as f:
+            to_csv(mapped, dest, args.volume, f)
+    if compare(runs[1][0], runs[0][0])['volumes']:
+        print('  final volumes differ from one transfer per column')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
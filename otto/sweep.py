@@ -0,0 +1,161 @@
+'''Parameter sweep over a protocol's add_parameters() ranges.
+
+    python -m otto.sweep shawn_scripts/production/crosslinking/crosslinking_multi.py
+    python -m otto.sweep shawn_scripts/production/bca/pierce_bca.py -n 200
+
+Builds the values of every declared parameter (every int when the range
+is small, otherwise the ends, the default and evenly spaced levels; both
+bools; every choice) and dry runs the full product in a process pool via
+otto.batch, or a seeded random sample of it when the product is bigger
+than -n. -p pins parameters to one value and -g gives a list instead of
+the declared range.
+
+Reports the combinations that fail, run out of tips or overfill a well,
+with the range of each parameter that is involved.
+'''
+
+import argparse
+import itertools
+import random
+import sys
+
+from otto.labware import CUSTOM_LABWARE
+
+LEVELS = 5
+MAX_INTS = 25
+
+
+def levels(spec, count=LEVELS):
+    '''Values to try for one declared parameter.'''
+    default = spec.get('default')
+    choices = spec.get('choices')
+    if choices:
+        return [choice['value'] for choice in choices]
+    kind = spec['kind']
+    if kind is bool:
+        return [False, True]
+    low, high = spec.get('minimum'), spec.get('maximum')
+    if kind not in (int, float) or low is None or high is None:
+        return [default]
+    if kind is int and high - low < MAX_INTS:
+        return list(range(low, high + 1))
+    values = {low, high}
+    if default is not None:
+        values.add(default)
+    for i in range(1, count - 1):
+        value = low + (high - low) * i / (count - 1)
+        values.add(int(round(value)) if kind is int else round(value, 3))
+    return sorted(values)
+
+
+def space(declared, pinned=None, grid=None, count=LEVELS):
+    '''(names, [values per name]) to sweep.'''
+    names = []
+    values = []
+    for name, spec in declared.items():
+        if name in (pinned or {}):
+            continue
+        names.append(name)
+        values.append(grid[name] if name in (grid or {}) else
+                      levels(spec, count))
+    return names, values
+
+
+def combinations(names, values, limit, seed=0):
+    '''Every combination, or limit of them drawn at random.'''
+    total = 1
+    for vals in values:
+        total *= len(vals)
+    if total <= limit:
+        return [dict(zip(names, combo))
+                for combo in itertools.product(*values)], total
+    rng = random.Random(seed)
+    seen = set()
+    drawn = []
+    while len(drawn) < limit:
+        combo = tuple(rng.randrange(len(vals)) for vals in values)
+        if combo in seen:
+            continue
+        seen.add(combo)
+        drawn.append({name: vals[i]
+                      for name, vals, i in zip(names, values, combo)})
+    return drawn, total
+
+
+def _spread(results, names):
+    '''Per parameter, the values seen among results.'''
+    spread = {}
+    for result in results:
+        for name in names:
+            spread.setdefault(name, set()).add(result['params'][name])
+    return spread
+
+
+def report(path, results, names, total):
+    lines = ['{}: {} of {} combinations'.format(path, len(results), total)]
+    for status, what in (('FAIL', 'fail'), ('TIPS', 'run out of tips'),
+                         ('VOL', 'overfill a well')):
+        bad = [r for r in results if r['status'] == status]
+        if not bad:
+            continue
+        lines.append('  {} {}'.format(len(bad), what))
+        spread = _spread(bad, names)
+        everything = _spread(results, names)
+        for name in names:
+            # only the parameters that narrow it down are worth printing
+            if spread[name] != everything[name]:
+                lines.append('    {}: {}'.format(name, ', '.join(
+                             str(v) for v in sorted(spread[name]))))
+        errors = {}
+        for r in bad:
+            key = r['error'] or (r['overfilled'][0][0] if r['overfilled']
+                                 else 'short {} tips'.format(r['short']))
+            errors.setdefault((r['line'], key), []).append(r)
+        for (line, key), rs in sorted(errors.items(), key=lambda e: -len(
+                                      e[1]))[:5]:
+            example = ' '.join('{}={}'.format(name, rs[0]['params'][name])
+                               for name in names)
+            lines.append('    {}x {}{} e.g. {}'.format(
+                         len(rs), 'line {}: '.format(line) if line else '',
+                         key, example))
+    passed = sum(1 for r in results if r['status'] == 'pass')
+    lines.append('  {} pass'.format(passed))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    from otto.batch import parse_grid, run_jobs
+    from otto.budget import parse_params
+    from otto.recording import declared_parameters, load_protocol
+
+    parser = argparse.ArgumentParser(
+        description='Dry run a protocol over its parameter ranges.')
+    parser.add_argument('protocol', nargs='+')
+    parser.add_argument('-p', '--param', action='append',
+                        help='pin a parameter, name=value')
+    parser.add_argument('-g', '--grid', action='append',
+                        help='values to try for a parameter, name=v1,v2,...')
+    parser.add_argument('-n', '--limit', type=int, default=2000,
+                        help='sample this many when there are more')
+    parser.add_argument('--levels', type=int, default=LEVELS)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-j', '--processes', type=int, default=None)
+    parser.add_argument('-L', '--labware', default=CUSTOM_LABWARE)
+    args = parser.parse_args(argv)
+    pinned = parse_params(args.param)
+    grid = parse_grid(args.grid)
+    failed = False
+    for path in args.protocol:
+        declared = declared_parameters(load_protocol(path)).declared
+        names, values = space(declared, pinned, grid, args.levels)
+        combos, total = combinations(names, values, args.limit, args.seed)
+        jobs = [(path, dict(pinned, **combo), args.labware)
+                for combo in combos]
+        results = run_jobs(jobs, args.processes)
+        print(report(path, results, names, total))
+        failed = failed or any(r['status'] != 'pass' for r in results)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
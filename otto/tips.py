@@ -0,0 +1,235 @@
+'''Column-packing tip allocator.
+
+Replaces the pickup_tips(number, pipette, protocol) copies in the protocols.
+Multichannel partial pickups take tips from the bottom of a column up (an
+N tip pickup lands the A nozzle on row 8-N), so every column is fully
+described by how many tips are left in it. Columns are kept in bins by tips
+left, which makes a pickup a scan over at most 8 bins no matter how many
+racks are loaded.
+
+    tips = TipAllocator([p20m, p300m])
+    tips.pick_up(p300m, 3)
+
+Pass a TipInventory to carry half used racks over to the next run:
+
+    inventory = TipInventory(read_only=protocol.is_simulating())
+    tips = TipAllocator([p20m, p300m], inventory=inventory)
+
+Put a fresh rack down with `python -m otto.tips reset <slot>` (or give the
+rack a new barcode).
+'''
+
+import json
+import os
+import sys
+from collections import deque
+
+
+ROWS = 'ABCDEFGH'
+
+
+class OutOfTipsError(Exception):
+    pass
+
+
+DEFAULT_INVENTORY = os.environ.get('OTTO_TIPS',
+                                   '/data/user_storage/otto_tips.json')
+
+
+class TipInventory:
+    '''Tips left per column of every rack, kept in a small json file.
+
+    Racks are keyed by deck slot and barcode. Without a barcode the rack's
+    load name stands in, so swapping in a fresh rack of the same type needs
+    a reset of that slot.
+    '''
+
+    def __init__(self, path=DEFAULT_INVENTORY, barcodes=None, read_only=False):
+        self.path = path
+        self.barcodes = {str(slot): code
+                         for slot, code in (barcodes or {}).items()}
+        self.read_only = read_only
+        self.racks = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.racks = json.load(f)
+
+    def key(self, rack):
+        slot = str(rack.parent)
+        return '{}/{}'.format(slot, self.barcodes.get(slot, rack.load_name))
+
+    def load(self, rack):
+        return self.racks.get(self.key(rack))
+
+    def store(self, rack, left):
+        self.racks[self.key(rack)] = list(left)
+
+    def reset(self, slot=None):
+        if slot is None:
+            self.racks = {}
+        else:
+            prefix = '{}/'.format(slot)
+            self.racks = {key: left for key, left in self.racks.items()
+                          if not key.startswith(prefix)}
+
+    def commit(self):
+        if self.read_only:
+            return
+        # write then rename so a crash mid-run never leaves half a file
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.racks, f, sort_keys=True)
+        os.replace(tmp, self.path)
+
+
+class _RackSet:
+    '''Tip state for the racks of one pipette.'''
+
+    def __init__(self, pipette, racks, inventory=None):
+        self.pipette = pipette
+        self.racks = list(racks)
+        self.loaded = len(self.racks)
+        self.inventory = inventory
+        self.left = []
+        self.bins = [deque() for i in range(9)]
+        for r, rack in enumerate(self.racks):
+            left = inventory.load(rack) if inventory else None
+            self.left.append(list(left) if left else [8]*12)
+            for col in range(12):
+                self.bins[self.left[r][col]].append((r, col))
+
+    def take(self, number):
+        # smallest partial column that fits, fresh column last
+        for count in range(number, 9):
+            if self.bins[count]:
+                r, col = self.bins[count].popleft()
+                break
+        else:
+            return None
+        self.left[r][col] = count - number
+        if count - number > 0:
+            self.bins[count - number].append((r, col))
+        if self.inventory and self.racks[r] is not None:
+            self.inventory.store(self.racks[r], self.left[r])
+            self.inventory.commit()
+        return r, col, count - number
+
+    def add_virtual_rack(self):
+        # stands in for a rack that is not on the deck, simulation only
+        self.racks.append(None)
+        self.left.append([8]*12)
+        for col in range(12):
+            self.bins[8].append((len(self.racks)-1, col))
+
+    def remaining(self):
+        return sum(sum(cols) for r, cols in enumerate(self.left)
+                   if self.racks[r] is not None)
+
+    def needed(self):
+        # racks actually touched, counting the loaded ones as used
+        used = [r for r, cols in enumerate(self.left) if min(cols) < 8]
+        return max(self.loaded, max(used) + 1 if used else 0)
+
+
+class TipAllocator:
+    '''Hands out tips for any number of pipettes from their tip_racks.
+
+    Racks are used in tip_racks order and a pickup rolls over to the next
+    rack on its own. Running out raises OutOfTipsError. When simulating the
+    allocator keeps counting on racks that are not there instead, and
+    check() at the end of run() reports how many racks every pipette needs:
+
+        tips = TipAllocator([p300m], simulating=protocol.is_simulating())
+        ...
+        tips.check()
+    '''
+
+    def __init__(self, pipettes, inventory=None, simulating=False):
+        self._sets = {}
+        self.inventory = inventory
+        self.simulating = simulating
+        for pipette in pipettes:
+            self.add_pipette(pipette)
+
+    def add_pipette(self, pipette, racks=None):
+        if racks is None:
+            racks = pipette.tip_racks
+        self._sets[id(pipette)] = _RackSet(pipette, racks, self.inventory)
+
+    def _set(self, pipette):
+        try:
+            return self._sets[id(pipette)]
+        except KeyError:
+            raise ValueError(
+                '{} is not tracked by this allocator'.format(pipette.name))
+
+    def next_tip(self, pipette, number=None):
+        '''Claim number tips (default one per channel) and return the well
+        the pipette should go to.'''
+        if number is None:
+            number = getattr(pipette, 'channels', 8)
+        if not 1 <= number <= getattr(pipette, 'channels', 8):
+            raise ValueError('cannot pick up {} tips with {}'.format(
+                             number, pipette.name))
+        tips = self._set(pipette)
+        taken = tips.take(number)
+        if taken is None and self.simulating and tips.racks:
+            tips.add_virtual_rack()
+            taken = tips.take(number)
+        if taken is None:
+            raise OutOfTipsError(
+                '{} needs more than {} tip rack(s): no column has {} tips '
+                'left. Add racks to tip_racks in load_instrument.'.format(
+                    pipette.name, tips.loaded, number))
+        # the A nozzle lands just below the tips that stay in the column
+        r, col, left = taken
+        rack = tips.racks[r]
+        if rack is None:
+            rack = tips.racks[0]
+        return rack[ROWS[left] + str(col+1)]
+
+    def pick_up(self, pipette, number=None):
+        well = self.next_tip(pipette, number)
+        pipette.pick_up_tip(well)
+        return well
+
+    def remaining(self, pipette):
+        return self._set(pipette).remaining()
+
+    def racks_needed(self, pipette):
+        return self._set(pipette).needed()
+
+    def check(self):
+        '''Raise if any pipette went past its loaded racks.'''
+        short = []
+        for tips in self._sets.values():
+            if tips.needed() > tips.loaded:
+                short.append('{} needs {} tip racks, {} loaded'.format(
+                             tips.pipette.name, tips.needed(), tips.loaded))
+        if short:
+            raise OutOfTipsError('; '.join(short))
+
+    def partial_columns(self, pipette):
+        '''Number of started but not empty columns, by tips left.'''
+        tips = self._set(pipette)
+        return {count: len(tips.bins[count]) for count in range(1, 8)
+                if tips.bins[count]}
+
+
+def main(argv):
+    if len(argv) < 1 or argv[0] not in ('show', 'reset'):
+        print('usage: python -m otto.tips show|reset [slot] [inventory.json]')
+        return 1
+    path = argv[2] if len(argv) > 2 else DEFAULT_INVENTORY
+    inventory = TipInventory(path)
+    if argv[0] == 'reset':
+        inventory.reset(argv[1] if len(argv) > 1 else None)
+        inventory.commit()
+    for key, left in sorted(inventory.racks.items()):
+        print('{:<40} {:>3} tips  {}'.format(key, sum(left),
+              ' '.join(str(count) for count in left)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,205 @@
+'''Columnar command trace of a recorded run.
+
+    python -m otto.trace shawn_scripts/production/salt_screens/salt_screen.py -o salt_screen.npz
+
+to_trace(ctx) turns the commands of an otto.recording run into one numpy
+structured array, one row per command, plus small lookup tables for the
+command names, pipettes, labware and modules the integer columns point
+into. Traces save to and load from .npz without pickling, so volume,
+time, tip and travel analyses can run offline over many runs:
+
+    trace = Trace.load('salt_screen.npz')
+    dispensed = trace['volume'][trace.rows('dispense')].sum()
+
+Liquid handling rows keep the A nozzle well; tips says how many nozzles
+carried a tip. transfer/distribute/consolidate rows carry the summed
+volume, and the commands they expanded into point back at them in group.
+'''
+
+import argparse
+import sys
+
+import numpy as np
+
+from otto.labware import CUSTOM_LABWARE
+
+DTYPE = np.dtype([
+    ('step', 'i4'),
+    ('name', 'u1'),        # index into names
+    ('pipette', 'i1'),     # index into pipettes, -1 for none
+    ('labware', 'i2'),     # index into labware, -1 for none
+    ('well', 'i2'),        # well index within the labware
+    ('module', 'i1'),      # index into modules, -1 for none
+    ('volume', 'f4'),
+    ('x', 'f4'), ('y', 'f4'), ('z', 'f4'),
+    ('tips', 'i1'),
+    ('value', 'f8'),       # temperature, seconds, repetitions, light state
+    ('rate', 'f4'),        # µL/s
+    ('group', 'i4'),       # step of the transfer it belongs to, -1 for none
+    ('line', 'i4'),
+    ('stage', 'i2'),       # index into stages
+    ('start', 'f8'),
+    ('duration', 'f4'),
+])
+
+
+class Trace:
+    '''A structured array of commands and the tables its columns index.'''
+
+    def __init__(self, records, names, pipettes, labware, wells, modules,
+                 stages, source=''):
+        self.records = records
+        self.names = list(names)
+        self.pipettes = list(pipettes)
+        self.labware = list(labware)
+        self.wells = [list(w) for w in wells]
+        self.modules = list(modules)
+        self.stages = list(stages)
+        self.source = source
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, column):
+        return self.records[column]
+
+    def rows(self, *names):
+        '''Boolean mask of the rows of the given command names.'''
+        codes = [self.names.index(n) for n in names if n in self.names]
+        return np.isin(self.records['name'], codes)
+
+    def well_name(self, row):
+        labware = self.records['labware'][row]
+        if labware < 0:
+            return None
+        well = self.wells[labware][self.records['well'][row]]
+        return '{} of {}'.format(well, self.labware[labware])
+
+    def save(self, path):
+        np.savez_compressed(
+            path, records=self.records, names=np.array(self.names),
+            pipettes=np.array(self.pipettes), labware=np.array(self.labware),
+            wells=np.array([','.join(w) for w in self.wells]),
+            modules=np.array(self.modules), stages=np.array(self.stages),
+            source=np.array(self.source))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['records'], data['names'].tolist(),
+                       data['pipettes'].tolist(), data['labware'].tolist(),
+                       [w.split(',') for w in data['wells'].tolist()],
+                       data['modules'].tolist(), data['stages'].tolist(),
+                       str(data['source']))
+
+
+def _index(table, lookup, key, label):
+    if key not in lookup:
+        lookup[key] = len(table)
+        table.append(label)
+    return lookup[key]
+
+
+def to_trace(ctx):
+    '''Trace of a recorded run.'''
+    names, pipettes, labware, wells, modules, stages = [], [], [], [], [], []
+    lookups = ({}, {}, {}, {}, {})
+    rows = []
+    for command in ctx.commands:
+        name = _index(names, lookups[0], command.name, command.name)
+        pipette = -1
+        if command.pipette is not None:
+            pipette = _index(pipettes, lookups[1], id(command.pipette),
+                             '{} ({})'.format(command.pipette.name,
+                                              command.pipette.mount))
+        lw = well = -1
+        parent = getattr(command.well, 'parent', None)
+        if parent is not None and hasattr(parent, 'wells'):
+            if id(parent) not in lookups[2]:
+                wells.append([w.well_name for w in parent.wells()])
+            lw = _index(labware, lookups[2], id(parent), str(parent))
+            well = command.well.index
+        module = -1
+        if hasattr(command.target, 'model'):
+            module = _index(modules, lookups[3], id(command.target),
+                            str(command.target))
+        stage = _index(stages, lookups[4], command.stage, command.stage or '')
+        point = command.point or (np.nan, np.nan, np.nan)
+        value = command.value
+        if not isinstance(value, (int, float)):
+            value = np.nan
+        rows.append((
+            command.step, name, pipette, lw, well, module,
+            np.nan if command.volume is None else command.volume,
+            point[0], point[1], point[2],
+            command.tips or 0, value,
+            np.nan if command.rate is None else command.rate,
+            -1 if command.group is None else command.group,
+            command.line or 0, stage, command.start, command.duration))
+    records = np.array(rows, dtype=DTYPE)
+    return Trace(records, names, pipettes, labware, wells, modules, stages,
+                 ctx.source or '')
+
+
+def travel(trace):
+    '''mm of straight line head travel per pipette, {pipette: mm}.'''
+    moved = {}
+    records = trace.records
+    has_point = ~np.isnan(records['x'])
+    for i, label in enumerate(trace.pipettes):
+        mine = records[(records['pipette'] == i) & has_point]
+        xyz = np.stack([mine['x'], mine['y'], mine['z']], axis=1)
+        moved[label] = float(np.linalg.norm(np.diff(xyz, axis=0),
+                                            axis=1).sum())
+    return moved
+
+
+def summary(trace):
+    '''(name, count, µL) per command name.'''
+    records = trace.records
+    counts = np.bincount(records['name'], minlength=len(trace.names))
+    volume = np.nan_to_num(records['volume'].astype('f8'))
+    volumes = np.bincount(records['name'], weights=volume,
+                          minlength=len(trace.names))
+    return [(name, int(counts[i]), float(volumes[i]))
+            for i, name in enumerate(trace.names)]
+
+
+def main(argv=None):
+    from otto.budget import parse_params
+    from otto.recording import record
+
+    parser = argparse.ArgumentParser(
+        description='Record a protocol into a columnar trace.')
+    parser.add_argument('protocol')
+    parser.add_argument('-p', '--param', action='append',
+                        help='parameter override, name=value')
+    parser.add_argument('-L', '--labware', default=CUSTOM_LABWARE)
+    parser.add_argument('-o', '--output', help='.npz file to write')
+    parser.add_argument('--runtime', action='store_true',
+                        help='fill start/duration from otto.runtime')
+    args = parser.parse_args(argv)
+    timing = None
+    if args.runtime:
+        from otto.runtime import TimeModel
+        timing = TimeModel()
+    ctx = record(args.protocol, parse_params(args.param), args.labware,
+                 timing=timing)
+    trace = to_trace(ctx)
+    print('{}: {} commands, {} bytes'.format(args.protocol, len(trace),
+                                             trace.records.nbytes))
+    for name, count, volume in summary(trace):
+        print('  {:<24} {:>6}{}'.format(name, count, '  {:>10.1f} µL'.format(
+              volume) if volume else ''))
+    for label, mm in travel(trace).items():
+        print('  {} travel: {:.0f} mm'.format(label, mm))
+    if ctx.error is not None:
+        print('  protocol failed at line {}: {!r}'.format(ctx.error_line,
+                                                          ctx.error))
+    if args.output:
+        trace.save(args.output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,245 @@
+'''Per-well volume ledger for a recorded run.
+
+    python -m otto.volumes shawn_scripts/production/pcr/consolidate.py --csv maps/
+
+Keeps one numpy array of volumes per labware and follows every aspirate,
+dispense and blow out through the wells under the nozzles that carry tips
+(a multichannel in a reservoir takes its volume once per tip), starting
+from the load_liquid() volumes. Along the way it flags
+
+    overflow       a well goes over the max volume of its definition, or
+                   load_liquid() declares more than fits
+    underflow      aspirating more than a well holds
+    depleted       the same for a well declared with load_liquid(), i.e.
+                   a stock or reservoir that runs dry
+    below bottom   a tip sent below the bottom of the well, like
+                   .bottom(-2)
+
+Wells nobody declared and nothing was dispensed into before they were
+drawn from are unknown stocks: they go negative without being flagged,
+also after a disposal volume is blown back into them. plate_map() and
+to_csv() give the final volumes laid out like the plate.
+
+    ledger = Ledger.from_run(record(path))
+    for event in ledger.events: ...
+'''
+
+import argparse
+import os
+import sys
+
+import numpy as np
+
+from otto.labware import CUSTOM_LABWARE
+
+LIQUID = ('aspirate', 'dispense', 'blow_out')
+TOLERANCE = 1e-3   # µL
+
+
+class Event:
+    __slots__ = ('kind', 'step', 'line', 'well', 'volume', 'level')
+
+    def __init__(self, kind, command, well, volume, level):
+        self.kind = kind
+        self.step = command.step if command is not None else None
+        self.line = command.line if command is not None else None
+        self.well = well
+        self.volume = volume
+        self.level = level
+
+    def __repr__(self):
+        where = 'load_liquid' if self.step is None else (
+                'step {} (line {})'.format(self.step, self.line))
+        return '{} {}: {:g} µL, {} at {:g} µL'.format(
+            self.kind, where, self.volume, self.well, self.level)
+
+
+class Ledger:
+    '''Well volumes, one array per labware.
+
+    With liquids=False the load_liquid() volumes are ignored and every well
+    starts empty, so -low is what each source has to be loaded with.
+    '''
+
+    def __init__(self, liquids=True):
+        self.liquids = liquids
+        self.labware = []
+        self.volume = {}     # id(labware) -> volumes by well index
+        self.peak = {}
+        self.low = {}
+        self.known = {}      # volume is known: declared or filled here
+        self.declared = {}
+        self.touched = {}
+        self.max_volume = {}
+        self.events = []
+        self._flagged = set()
+
+    def add(self, labware):
+        '''Start tracking labware, with its load_liquid() volumes.'''
+        key = id(labware)
+        if key in self.volume:
+            return key
+        wells = labware.wells()
+        start = np.array([sum(v for liquid, v in well.liquids)
+                          for well in wells], dtype=float)
+        if not self.liquids:
+            start[:] = 0
+        self.labware.append(labware)
+        self.volume[key] = start
+        self.peak[key] = start.copy()
+        self.low[key] = start.copy()
+        self.declared[key] = np.array([bool(w.liquids) and self.liquids
+                                       for w in wells])
+        self.known[key] = self.declared[key].copy()
+        self.touched[key] = self.declared[key].copy()
+        self.max_volume[key] = np.array([w.max_volume for w in wells],
+                                        dtype=float)
+        # loaded with more than fits before anything happens
+        for i in np.flatnonzero(start > self.max_volume[key] + TOLERANCE):
+            self._flag('overflow', None, wells[i], start[i], start[i])
+        return key
+
+    def _flag(self, kind, command, well, volume, level):
+        if (kind, id(well)) in self._flagged:
+            return
+        self._flagged.add((kind, id(well)))
+        self.events.append(Event(kind, command, well, volume, level))
+
+    def apply(self, command):
+        '''Book one recorded command.'''
+        if command.name not in LIQUID or not command.volume:
+            return
+        well = command.well
+        if not hasattr(well, 'liquids') or well.parent is None:
+            return
+        labware = well.parent
+        key = self.add(labware)
+        wells = command.pipette.wells_under(well, command.tips)
+        index = np.array([w.index for w in wells])
+        volume, known = self.volume[key], self.known[key]
+        self.touched[key][index] = True
+        if command.point is not None and (
+                command.point[2] < well.bottom_point.z - TOLERANCE):
+            self._flag('below bottom', command, well, command.volume,
+                       float(volume[well.index]))
+        if command.name == 'aspirate':
+            need = np.bincount(index, minlength=len(volume)) * command.volume
+            short = known & (need > volume + TOLERANCE)
+            for i in np.flatnonzero(short):
+                kind = 'depleted' if self.declared[key][i] else 'underflow'
+                self._flag(kind, command, labware.wells()[i], need[i],
+                           float(volume[i]))
+            np.subtract.at(volume, index, command.volume)
+            low = self.low[key]
+            np.minimum(low, volume, out=low)
+        else:
+            # liquid going back into an unknown stock it was drawn from,
+            # like a disposal volume, leaves it unknown
+            known[index] |= volume[index] > -TOLERANCE
+            np.add.at(volume, index, command.volume)
+            peak = self.peak[key]
+            np.maximum(peak, volume, out=peak)
+            over = volume > self.max_volume[key] + TOLERANCE
+            for i in np.flatnonzero(over[index]):
+                i = index[i]
+                self._flag('overflow', command, labware.wells()[i],
+                           command.volume, float(volume[i]))
+
+    @classmethod
+    def from_run(cls, ctx, liquids=True):
+        ledger = cls(liquids)
+        for labware in list(ctx.loaded_labwares.values()) + [
+                module.labware for module in ctx.loaded_modules.values()
+                if module.labware is not None]:
+            if not labware.is_tiprack:
+                ledger.add(labware)
+        for command in ctx.commands:
+            ledger.apply(command)
+        return ledger
+
+    def plate_map(self, labware, which='volume'):
+        '''Final (or peak) volumes as a rows x columns array.'''
+        values = getattr(self, which)[self.add(labware)]
+        columns = labware.columns()
+        grid = np.full((max(len(c) for c in columns), len(columns)), np.nan)
+        for c, column in enumerate(columns):
+            for r, well in enumerate(column):
+                grid[r, c] = values[well.index]
+        return grid
+
+    def to_csv(self, labware, f, which='volume'):
+        grid = self.plate_map(labware, which)
+        rows = labware.rows_by_name()
+        f.write(',' + ','.join(str(c + 1) for c in range(grid.shape[1])) +
+                '\n')
+        for name, values in zip(sorted(rows), grid):
+            f.write(name + ',' + ','.join(
+                '' if np.isnan(v) else '{:g}'.format(round(v, 3))
+                for v in values) + '\n')
+
+
+def well_volumes(ctx):
+    '''{well: [volume, peak]} for every well liquid went in or out of.'''
+    ledger = Ledger.from_run(ctx)
+    fill = {}
+    for labware in ledger.labware:
+        key = id(labware)
+        for i in np.flatnonzero(ledger.touched[key]):
+            fill[labware.wells()[i]] = [float(ledger.volume[key][i]),
+                                        float(ledger.peak[key][i])]
+    return fill
+
+
+def overfilled(fill, slack=0.0):
+    '''(well, final, peak) for wells that went over their max_volume.'''
+    return [(well, volume, peak) for well, (volume, peak) in fill.items()
+            if peak > well.max_volume + slack]
+
+
+def main(argv=None):
+    from otto.budget import parse_params
+    from otto.recording import record
+
+    parser = argparse.ArgumentParser(
+        description='Per-well volumes and over/underflows of a protocol.')
+    parser.add_argument('protocol', nargs='+')
+    parser.add_argument('-p', '--param', action='append',
+                        help='parameter override, name=value')
+    parser.add_argument('-L', '--labware', default=CUSTOM_LABWARE)
+    parser.add_argument('--csv', metavar='DIR',
+                        help='write a final volume map per labware here')
+    args = parser.parse_args(argv)
+    failed = False
+    for path in args.protocol:
+        ctx = record(path, parse_params(args.param), args.labware)
+        ledger = Ledger.from_run(ctx)
+        print(path)
+        kinds = {}
+        for event in ledger.events:
+            kinds.setdefault(event.kind, []).append(event)
+        for kind, events in sorted(kinds.items()):
+            print('  {} {}'.format(len(events), kind))
+            for event in events[:5]:
+                print('    {}'.format(event))
+        if not ledger.events:
+            print('  no over/underflows')
+        failed = failed or bool(ledger.events)
+        if args.csv:
+            os.makedirs(args.csv, exist_ok=True)
+            stem = os.path.splitext(os.path.basename(path))[0]
+            for labware in ledger.labware:
+                if not ledger.touched[id(labware)].any():
+                    continue
+                name = '{}_{}_{}.csv'.format(stem, labware.parent,
+                                              labware.load_name)
+                with open(os.path.join(args.csv, name.replace(' ', '_')),
+                          'w') as f:
+                    ledger.to_csv(labware, f)
+        if ctx.error is not None:
+            print('  protocol failed at line {}: {!r}'.format(
+                  ctx.error_line, ctx.error))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
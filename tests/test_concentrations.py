@@ -0,0 +1,24 @@
+'''Concentrations of a plate column filled from troughs.'''
+
+import numpy as np
+
+from otto.concentrations import Tracker
+from otto.recording import RecordingContext
+
+
+def test_trough_fills_every_row():
+    ctx = RecordingContext()
+    trough = ctx.load_labware('nest_12_reservoir_15ml', 2)
+    plate = ctx.load_labware('costar_96_wellplate_200ul', 3)
+    rack = ctx.load_labware('opentrons_96_tiprack_300ul', 1)
+    p300m = ctx.load_instrument('p300_multi_gen2', 'left', tip_racks=[rack])
+    for source in (trough['A1'], trough['A2']):
+        p300m.pick_up_tip()
+        p300m.aspirate(100, source)
+        p300m.dispense(100, plate['A1'])
+        p300m.drop_tip()
+
+    tracker = Tracker({trough['A1']: {'NaCl': 1000}}).run(ctx)
+    salt = tracker.concentration(plate)[:, 0, 0]
+    assert np.allclose(salt, 500)
+    assert np.allclose(tracker.volume[id(plate)][:8], 200)
@@ -0,0 +1,25 @@
+'''Loading sheet against a multichannel drawing from a trough.'''
+
+from otto.reagents import loading_sheet
+from otto.recording import RecordingContext
+
+
+def test_multichannel_trough_counts_every_tip():
+    ctx = RecordingContext()
+    trough = ctx.load_labware('nest_12_reservoir_15ml', 2)
+    plate = ctx.load_labware('costar_96_wellplate_200ul', 3)
+    rack = ctx.load_labware('opentrons_96_tiprack_300ul', 1)
+    p300m = ctx.load_instrument('p300_multi_gen2', 'left', tip_racks=[rack])
+    p300m.pick_up_tip()
+    for column in plate.rows()[0]:
+        p300m.aspirate(100, trough['A2'])
+        p300m.dispense(100, column)
+    p300m.drop_tip()
+
+    drawn = sum(c.volume * c.tips for c in ctx.commands
+                if c.name == 'aspirate')
+    sheet = {entry['well']: entry for entry in loading_sheet(ctx)}
+    assert drawn == 12 * 100 * 8
+    assert list(sheet) == [trough['A2']]
+    assert abs(sheet[trough['A2']]['used'] - drawn) < 1e-6
+    assert sheet[trough['A2']]['load'] >= drawn + 1000
@@ -0,0 +1,37 @@
+'''Ledger flags around unknown stocks.'''
+
+from otto.recording import RecordingContext
+from otto.volumes import Ledger
+
+
+def _deck():
+    ctx = RecordingContext()
+    trough = ctx.load_labware('nest_12_reservoir_15ml', 2)
+    plate = ctx.load_labware('costar_96_wellplate_200ul', 3)
+    rack = ctx.load_labware('opentrons_96_tiprack_300ul', 1)
+    p300m = ctx.load_instrument('p300_multi_gen2', 'left', tip_racks=[rack])
+    return ctx, trough, plate, p300m
+
+
+def test_disposal_back_into_unknown_stock():
+    ctx, trough, plate, p300m = _deck()
+    p300m.pick_up_tip()
+    for columns in (plate.rows()[0][:2], plate.rows()[0][2:4]):
+        p300m.aspirate(220, trough['A1'])
+        for column in columns:
+            p300m.dispense(100, column)
+        p300m.blow_out(trough['A1'])
+    p300m.drop_tip()
+    assert Ledger.from_run(ctx).events == []
+
+
+def test_filled_well_drawn_dry():
+    ctx, trough, plate, p300m = _deck()
+    p300m.pick_up_tip()
+    p300m.aspirate(100, trough['A1'])
+    p300m.dispense(100, plate['A1'])
+    p300m.aspirate(150, plate['A1'])
+    p300m.drop_tip()
+    events = Ledger.from_run(ctx).events
+    assert [(e.kind, e.well) for e in events] == [
+        ('underflow', well) for well in plate.columns()[0]]